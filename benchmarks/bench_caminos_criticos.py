@@ -0,0 +1,302 @@
+"""
+Micro-benchmarks de los caminos críticos del servidor, sin red.
+
+Importa server.py en el mismo proceso y llama a los endpoints con el cliente
+de pruebas de Flask. La sesión del cliente OSRM se reemplaza por un stub que
+responde una ruta fija (rama OSRM de /api/estimate-route) o falla la conexión
+(rama estática). Cada caso se mide a escala 1 (la red de RUTAS_DATABASE y 50
+buses) y a escala 100 (100 veces las rutas, copias desplazadas dentro de
+Popayán, y 5000 buses).
+
+Los resultados (p50, p95, media en µs y operaciones por segundo por caso) se
+escriben en JSON. Con --comparar se contrastan contra un resultado anterior
+y el proceso termina con código 1 si algún caso empeoró su p50 más que
+--umbral (fracción, 0.25 = 25 %).
+
+Uso:
+    python benchmarks/bench_caminos_criticos.py --salida base.json
+    python benchmarks/bench_caminos_criticos.py --comparar base.json --umbral 0.25
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests  # noqa: E402
+
+import server  # noqa: E402
+
+BUSES_POR_ESCALA = 50
+LAT_MIN, LAT_MAX = 2.41, 2.47       # zona donde se ubican las copias de las rutas
+LON_MIN, LON_MAX = -76.64, -76.58
+
+
+# ------------------------------------------------------
+# OSRM simulado
+# ------------------------------------------------------
+class _RespuestaOSRM:
+    status_code = 200
+
+    def __init__(self, url):
+        self.url = url
+
+    def json(self):
+        origen, destino = self.url.rsplit("/", 1)[1].split(";")
+        lon1, lat1 = map(float, origen.split(","))
+        lon2, lat2 = map(float, destino.split(","))
+        return {
+            "code": "Ok",
+            "routes": [{
+                "distance": server.distancia_haversine(lat1, lon1, lat2, lon2) * 1300,
+                "duration": 420,
+                "geometry": {"type": "LineString", "coordinates": [[lon1, lat1], [lon2, lat2]]}
+            }]
+        }
+
+
+def _osrm_responde(url, **kwargs):
+    return _RespuestaOSRM(url)
+
+
+def _osrm_caido(url, **kwargs):
+    raise requests.ConnectionError("OSRM simulado fuera de servicio")
+
+
+# ------------------------------------------------------
+# Red de rutas y flota
+# ------------------------------------------------------
+def escalar_red(base, escala, rnd):
+    """Rutas de `base` repetidas `escala` veces: las copias se desplazan al azar dentro de la ciudad"""
+    rutas = {empresa: dict(rutas_dict) for empresa, rutas_dict in base.items()}
+    for copia in range(1, escala):
+        for empresa, rutas_dict in base.items():
+            for num, paradas in rutas_dict.items():
+                lat0 = min(p['lat'] for p in paradas)
+                lon0 = min(p['lon'] for p in paradas)
+                alto = max(p['lat'] for p in paradas) - lat0
+                ancho = max(p['lon'] for p in paradas) - lon0
+                dlat = rnd.uniform(LAT_MIN, LAT_MAX - alto) - lat0
+                dlon = rnd.uniform(LON_MIN, LON_MAX - ancho) - lon0
+                rutas[empresa][num + 1000 * copia] = [
+                    {"nombre": "%s (%d)" % (p['nombre'], copia), "lat": round(p['lat'] + dlat, 6),
+                     "lon": round(p['lon'] + dlon, 6), "orden": p['orden']}
+                    for p in paradas
+                ]
+    return rutas
+
+
+def cerca(parada, rnd, metros=60):
+    delta = metros / 111195.0
+    return parada['lat'] + rnd.uniform(-delta, delta), parada['lon'] + rnd.uniform(-delta, delta)
+
+
+def poblar_buses(rutas, cantidad, rnd):
+    """Ubica `cantidad` buses sobre tramos al azar de las rutas"""
+    server.BUS_POSITIONS.limpiar()
+    claves = [(empresa, num) for empresa, rutas_dict in rutas.items() for num in rutas_dict]
+    emparejador = server.obtener_emparejador()
+    ahora = time.time()
+    for i in range(cantidad):
+        empresa, num = claves[i % len(claves)]
+        paradas = rutas[empresa][num]
+        j = rnd.randrange(len(paradas) - 1)
+        f = rnd.random()
+        lat = paradas[j]['lat'] + f * (paradas[j + 1]['lat'] - paradas[j]['lat'])
+        lon = paradas[j]['lon'] + f * (paradas[j + 1]['lon'] - paradas[j]['lon'])
+        server.BUS_POSITIONS.actualizar("BUS-%05d" % i, empresa, num, lat, lon, 20.0, ahora,
+                                        emparejador=emparejador)
+
+
+# ------------------------------------------------------
+# Casos
+# ------------------------------------------------------
+def preparar_casos(rutas, num_buses, rnd):
+    """Retorna [(nombre, funcion, generador_de_argumentos)]"""
+    cliente = server.app.test_client()
+    claves = [(empresa, num) for empresa, rutas_dict in rutas.items() for num in rutas_dict]
+    todas = [p for rutas_dict in rutas.values() for paradas in rutas_dict.values() for p in paradas]
+
+    def punto():
+        return rnd.uniform(LAT_MIN, LAT_MAX), rnd.uniform(LON_MIN, LON_MAX)
+
+    def tramo_de_ruta():
+        empresa, num = rnd.choice(claves)
+        paradas = rutas[empresa][num]
+        o = rnd.randrange(len(paradas) - 1)
+        d = rnd.randrange(o + 1, len(paradas))
+        return empresa, num, paradas, o, d
+
+    def args_haversine():
+        return punto() + punto()
+
+    def args_parada():
+        return punto() + (todas,)
+
+    def args_distancia():
+        _, _, paradas, o, d = tramo_de_ruta()
+        return paradas, o + 1, d + 1
+
+    def args_estimacion_libre():
+        _, _, paradas, o, d = tramo_de_ruta()
+        (olat, olon), (dlat, dlon) = cerca(paradas[o], rnd), cerca(paradas[d], rnd)
+        return ({"origenLat": olat, "origenLon": olon, "destinoLat": dlat, "destinoLon": dlon},)
+
+    def args_estimacion_ruta():
+        empresa, num, paradas, o, d = tramo_de_ruta()
+        (olat, olon), (dlat, dlon) = cerca(paradas[o], rnd), cerca(paradas[d], rnd)
+        return ({"origenLat": olat, "origenLon": olon, "destinoLat": dlat, "destinoLon": dlon,
+                 "empresa": empresa, "numeroRuta": num},)
+
+    def args_eta():
+        lat, lon = cerca(rnd.choice(todas), rnd)
+        return ({"userLat": lat, "userLon": lon},)
+
+    def args_gps():
+        empresa, num, paradas, o, _ = tramo_de_ruta()
+        lat, lon = cerca(paradas[o], rnd)
+        return ({"idBus": "BUS-%05d" % rnd.randrange(num_buses), "empresa": empresa, "ruta": num,
+                 "lat": lat, "lon": lon, "velocidad": 25},)
+
+    def estimar(payload):
+        return cliente.post("/api/estimate-route", json=payload)
+
+    def estimar_osrm(payload):
+        server.CLIENTE_OSRM.session.get = _osrm_responde
+        return estimar(payload)
+
+    def estimar_estatico(payload):
+        server.CLIENTE_OSRM.session.get = _osrm_caido
+        return estimar(payload)
+
+    return [
+        ("distancia_haversine", server.distancia_haversine, args_haversine),
+        ("encontrar_parada_mas_cercana", server.encontrar_parada_mas_cercana, args_parada),
+        ("calcular_distancia_entre_paradas", server.calcular_distancia_entre_paradas, args_distancia),
+        ("estimate_route_osrm", estimar_osrm, args_estimacion_libre),
+        ("estimate_route_estatico", estimar_estatico, args_estimacion_libre),
+        ("estimate_route_empresa", estimar, args_estimacion_ruta),
+        ("eta_usuario", lambda payload: cliente.post("/api/eta", json=payload), args_eta),
+        ("update_bus_gps", lambda payload: cliente.post("/api/update-bus-gps", json=payload), args_gps),
+        ("get_buses", lambda: cliente.get("/api/buses"), lambda: ()),
+    ]
+
+
+def medir(funcion, generar_args, segundos, minimo):
+    """Llama la función con argumentos nuevos en cada vuelta. Retorna las duraciones en µs (sin calentamiento)."""
+    for _ in range(max(3, minimo // 10)):
+        funcion(*generar_args())
+    duraciones = []
+    limite = time.perf_counter() + segundos
+    while len(duraciones) < minimo or time.perf_counter() < limite:
+        argumentos = generar_args()
+        inicio = time.perf_counter()
+        funcion(*argumentos)
+        duraciones.append((time.perf_counter() - inicio) * 1e6)
+    return duraciones
+
+
+def resumir(duraciones):
+    ordenadas = sorted(duraciones)
+    n = len(ordenadas)
+    media = sum(ordenadas) / n
+    return {
+        "n": n,
+        "p50_us": round(ordenadas[n // 2], 2),
+        "p95_us": round(ordenadas[min(n - 1, int(n * 0.95))], 2),
+        "media_us": round(media, 2),
+        "ops_s": int(1e6 / media) if media else 0
+    }
+
+
+def ejecutar(escalas, segundos, minimo, semilla):
+    red_original = server.red_vigente()
+    base = red_original.rutas
+    get_original = server.CLIENTE_OSRM.session.get
+    resultados = {}
+    try:
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            for escala in escalas:
+                rnd = random.Random(semilla)
+                rutas = server.recargar_red(escalar_red(base, escala, rnd), origen="benchmark").rutas
+                num_buses = BUSES_POR_ESCALA * escala
+                poblar_buses(rutas, num_buses, rnd)
+                for nombre, funcion, generar_args in preparar_casos(rutas, num_buses, rnd):
+                    server.CACHE_OSRM.limpiar()
+                    resumen = resumir(medir(funcion, generar_args, segundos, minimo))
+                    resumen.update({"escala": escala, "rutas": sum(len(r) for r in rutas.values()),
+                                    "buses": num_buses})
+                    resultados["%s@%d" % (nombre, escala)] = resumen
+                    print("%-40s %s" % ("%s@%d" % (nombre, escala), resumen), file=sys.stderr)
+    finally:
+        server.recargar_red(base, red_original.tarifas, origen=red_original.origen)
+        server.CLIENTE_OSRM.session.get = get_original
+        server.BUS_POSITIONS.limpiar()
+    return resultados
+
+
+def comparar(actual, anterior, umbral):
+    """Retorna la lista de casos cuyo p50 empeoró más que umbral (fracción)"""
+    regresiones = []
+    for caso, medida in sorted(actual.items()):
+        previo = anterior.get(caso)
+        if previo is None or not previo.get("p50_us"):
+            print("%-40s %10.2f µs   (sin referencia)" % (caso, medida["p50_us"]), file=sys.stderr)
+            continue
+        razon = medida["p50_us"] / previo["p50_us"]
+        empeoro = razon > 1 + umbral
+        print("%-40s %10.2f µs   antes %10.2f µs   x%.2f%s" % (
+            caso, medida["p50_us"], previo["p50_us"], razon, "   REGRESIÓN" if empeoro else ""), file=sys.stderr)
+        if empeoro:
+            regresiones.append({"caso": caso, "p50_us": medida["p50_us"], "p50_us_anterior": previo["p50_us"],
+                                "razon": round(razon, 3)})
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de los caminos críticos del servidor (sin red)")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados (por defecto stdout)")
+    parser.add_argument("--comparar", help="resultados JSON anteriores contra los que comparar")
+    parser.add_argument("--umbral", type=float, default=0.25,
+                        help="empeoramiento máximo aceptado del p50 (fracción, por defecto 0.25)")
+    parser.add_argument("--escalas", default="1,100", help="tamaños de red a medir (por defecto 1,100)")
+    parser.add_argument("--segundos", type=float, default=0.5, help="tiempo de medición por caso")
+    parser.add_argument("--minimo", type=int, default=30, help="llamadas mínimas por caso")
+    parser.add_argument("--semilla", type=int, default=7)
+    args = parser.parse_args()
+
+    escalas = [int(e) for e in args.escalas.split(",")]
+    informe = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "escalas": escalas,
+        "resultados": ejecutar(escalas, args.segundos, args.minimo, args.semilla)
+    }
+
+    regresiones = []
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)["resultados"]
+        regresiones = comparar(informe["resultados"], anterior, args.umbral)
+        informe["comparacion"] = {"base": args.comparar, "umbral": args.umbral, "regresiones": regresiones}
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if regresiones:
+        print("%d caso(s) empeoraron más de %d %%" % (len(regresiones), args.umbral * 100), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
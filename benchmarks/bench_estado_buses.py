@@ -0,0 +1,123 @@
+"""
+Compara el dict por tick (BUS_POSITIONS original) con AlmacenBuses.
+
+Mide memoria por bus rastreado, costo por actualización, memoria asignada
+dentro de cada actualización (pico medido con tracemalloc, es decir la basura
+que deja cada tick) y el tiempo de armar el JSON de /api/buses.
+
+Uso: python benchmarks/bench_estado_buses.py [num_buses] [num_actualizaciones]
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from estado_buses import AlmacenBuses  # noqa: E402
+
+EMPRESAS = ["TransPubenza", "TransLibertad", "TransTambo", "Sotracauca"]
+PARADAS = ["Parque Caldas (Centro)", "Calle 5", "Barrio Bolivar", "Av. Las Américas", "Entrada Universidad"]
+
+
+class EstadoDict:
+    """Comportamiento original: un dict nuevo de 9 claves por actualización"""
+
+    def __init__(self):
+        self.buses = {}
+
+    def actualizar(self, id_bus, empresa, ruta, lat, lon, vel, timestamp,
+                   ultima_parada_index=None, estado=None, proxima_parada=None):
+        self.buses[id_bus] = {
+            "empresa": empresa,
+            "ruta": ruta,
+            "lat": lat,
+            "lon": lon,
+            "vel": vel,
+            "timestamp": timestamp,
+            "ultima_parada_index": ultima_parada_index,
+            "estado": estado,
+            "proxima_parada": proxima_parada
+        }
+
+    def json_activos(self, ahora, ttl_segundos):
+        activos = []
+        for bid, datos in list(self.buses.items()):
+            if ahora - datos['timestamp'] < ttl_segundos:
+                bus_info = datos.copy()
+                bus_info['id'] = bid
+                activos.append(bus_info)
+        return json.dumps(activos)
+
+
+def generar_actualizaciones(num_buses, cantidad):
+    rnd = random.Random(42)
+    ids = ["BUS-%05d" % i for i in range(num_buses)]
+    return [
+        (ids[i % num_buses], EMPRESAS[i % 4], i % 10,
+         2.44 + rnd.random() * 0.02, -76.62 + rnd.random() * 0.02, round(rnd.uniform(10, 40), 1),
+         i % 6, "EN_TRANSITO", PARADAS[i % 5])
+        for i in range(cantidad)
+    ]
+
+
+def medir(nombre, almacen, num_buses, actualizaciones):
+    ahora = time.time()
+
+    # Memoria por bus: una actualización por bus con tracemalloc activo.
+    # Los textos se copian para no contar como "compartidos" los literales del benchmark.
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for id_bus, empresa, ruta, lat, lon, vel, idx, estado, proxima in actualizaciones[:num_buses]:
+        almacen.actualizar(id_bus, "".join(empresa), ruta, lat, lon, vel, ahora, idx,
+                           "".join(estado), "".join(proxima))
+    memoria = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    inicio = time.perf_counter()
+    for id_bus, empresa, ruta, lat, lon, vel, idx, estado, proxima in actualizaciones:
+        almacen.actualizar(id_bus, empresa, ruta, lat, lon, vel, ahora, idx, estado, proxima)
+    duracion = time.perf_counter() - inicio
+
+    # Bytes asignados por actualización sobre buses ya existentes
+    muestras = actualizaciones[:2000]
+    tracemalloc.start()
+    asignados = 0
+    for id_bus, empresa, ruta, lat, lon, vel, idx, estado, proxima in muestras:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        almacen.actualizar(id_bus, empresa, ruta, lat, lon, vel, ahora, idx, estado, proxima)
+        asignados += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    inicio = time.perf_counter()
+    texto = almacen.json_activos(ahora, 300)
+    duracion_json = time.perf_counter() - inicio
+
+    return {
+        "nombre": nombre,
+        "bytes_por_bus": round(memoria / num_buses, 1),
+        "us_por_actualizacion": round(duracion / len(actualizaciones) * 1e6, 3),
+        "actualizaciones_por_s": int(len(actualizaciones) / duracion),
+        "bytes_asignados_por_actualizacion": round(asignados / len(muestras), 1),
+        "ms_json_activos": round(duracion_json * 1000, 2),
+        "bytes_json": len(texto)
+    }
+
+
+def main():
+    num_buses = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    cantidad = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    actualizaciones = generar_actualizaciones(num_buses, cantidad)
+
+    resultados = [
+        medir("dict_por_tick", EstadoDict(), num_buses, actualizaciones),
+        medir("almacen_compacto", AlmacenBuses(), num_buses, actualizaciones),
+    ]
+    print(json.dumps({"buses": num_buses, "actualizaciones": cantidad, "resultados": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Estado de buses compartido entre procesos (estado_compartido.py) según el número de workers.
+
+Para 1, 2, 4, ... procesos (hasta --procesos) mide:
+
+- ingesta: cada proceso aplica su parte de los reportes en lotes de
+  --lote, como /api/update-bus-gps/batch en workers distintos;
+- lectura: cada proceso responde consultas de /api/buses?near= mientras uno
+  de ellos sigue ingiriendo, de modo que cada consulta incluye ponerse al
+  día con los cambios de los demás.
+
+Reporta reportes y consultas por segundo sumando todos los procesos. La
+escalabilidad depende de los núcleos disponibles (se informa os.cpu_count()).
+
+Uso: python benchmarks/bench_estado_compartido.py [--buses 10000] [--reportes 200000] [--procesos 4]
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from estado_compartido import AlmacenBusesCompartido  # noqa: E402
+
+EMPRESAS = ["TransPubenza", "TransLibertad", "TransTambo", "Sotracauca"]
+
+
+def _reportes(num_buses, cantidad, semilla):
+    aleatorio = random.Random(semilla)
+    return [
+        (f"BUS-{b}", EMPRESAS[b % 4], b % 12 + 1, 2.40 + aleatorio.random() * 0.08,
+         -76.65 + aleatorio.random() * 0.08, aleatorio.uniform(0, 40), float(i))
+        for i, b in ((i, aleatorio.randrange(num_buses)) for i in range(cantidad))
+    ]
+
+
+def _ingerir(archivo, num_buses, reportes, lote, barrera, resultado):
+    almacen = AlmacenBusesCompartido(archivo, max_buses=num_buses)
+    barrera.wait()
+    inicio = time.perf_counter()
+    ahora = time.time()
+    for posicion in range(0, len(reportes), lote):
+        almacen.actualizar_lote(reportes[posicion:posicion + lote], ahora)
+    resultado.put(time.perf_counter() - inicio)
+
+
+def _consultar(archivo, num_buses, segundos, barrera, resultado, reportes=None, lote=100):
+    almacen = AlmacenBusesCompartido(archivo, max_buses=num_buses)
+    aleatorio = random.Random(os.getpid())
+    barrera.wait()
+    fin = time.perf_counter() + segundos
+    consultas = posicion = 0
+    while time.perf_counter() < fin:
+        if reportes is not None:
+            almacen.actualizar_lote(reportes[posicion:posicion + lote], time.time())
+            posicion = (posicion + lote) % len(reportes)
+        almacen.json_cercanos(2.40 + aleatorio.random() * 0.08, -76.65 + aleatorio.random() * 0.08, 10, time.time())
+        consultas += 1
+    resultado.put(consultas)
+
+
+def medir(procesos, num_buses, reportes, lote, segundos):
+    archivo = os.path.join(tempfile.gettempdir() if not os.path.isdir("/dev/shm") else "/dev/shm",
+                           f"bench-rutaya-{os.getpid()}")
+    try:
+        AlmacenBusesCompartido(archivo, max_buses=num_buses)
+        resultado = mp.Queue()
+        barrera = mp.Barrier(procesos)
+        parte = len(reportes) // procesos
+        hijos = [mp.Process(target=_ingerir, args=(archivo, num_buses, reportes[p * parte:(p + 1) * parte], lote,
+                                                   barrera, resultado)) for p in range(procesos)]
+        for hijo in hijos:
+            hijo.start()
+        duraciones = [resultado.get() for _ in hijos]
+        for hijo in hijos:
+            hijo.join()
+
+        barrera = mp.Barrier(procesos)
+        hijos = [mp.Process(target=_consultar, args=(archivo, num_buses, segundos, barrera, resultado,
+                                                     reportes if p == 0 else None, lote)) for p in range(procesos)]
+        for hijo in hijos:
+            hijo.start()
+        consultas = sum(resultado.get() for _ in hijos)
+        for hijo in hijos:
+            hijo.join()
+        return {
+            "procesos": procesos,
+            "reportes_por_segundo": round(parte * procesos / max(duraciones)),
+            "consultas_por_segundo": round(consultas / segundos)
+        }
+    finally:
+        os.remove(archivo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--buses", type=int, default=10000)
+    parser.add_argument("--reportes", type=int, default=200000)
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--lote", type=int, default=100)
+    parser.add_argument("--segundos", type=float, default=3.0, help="duración de la fase de lectura")
+    args = parser.parse_args()
+
+    reportes = _reportes(args.buses, args.reportes, 7)
+    cantidades = []
+    procesos = 1
+    while procesos <= args.procesos:
+        cantidades.append(procesos)
+        procesos *= 2
+    print(json.dumps({
+        "buses": args.buses,
+        "reportes": args.reportes,
+        "cpus": os.cpu_count(),
+        "resultados": [medir(p, args.buses, reportes, args.lote, args.segundos) for p in cantidades]
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Estimaciones concurrentes con OSRM lento: servidor Flask con hilos frente al modo ASGI.
+
+Lanza N POST /api/estimate-route a la vez (coordenadas distintas, sin acierto
+de cache) contra un OSRM simulado que tarda --latencia-ms en responder:
+
+- Flask: cliente de pruebas de Flask desde un pool de --hilos hilos, como un
+  servidor WSGI con ese número de workers. Cada estimación ocupa un hilo
+  durante toda la espera a OSRM.
+- ASGI: la app de servidor_asgi.py llamada directamente (sin sockets) con
+  httpx.MockTransport como OSRM. Todas las estimaciones esperan a la vez en
+  el bucle de un solo hilo.
+
+Reporta tiempo total, estimaciones por segundo y hilos del proceso.
+
+Uso: python benchmarks/bench_estimacion_async.py [--consultas 2000] [--latencia-ms 200] [--hilos 32]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("OSRM_MONITOR_INTERVALO", "3600")     # sin sondas durante la medición
+os.environ.setdefault("OSRM_PRESUPUESTO_SEGUNDOS", "60")
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+import servidor_asgi  # noqa: E402
+
+
+def _cuerpo_osrm(url):
+    origen, destino = url.rsplit("/", 1)[1].split(";")
+    lon1, lat1 = map(float, origen.split(","))
+    lon2, lat2 = map(float, destino.split(","))
+    return {
+        "code": "Ok",
+        "routes": [{
+            "distance": server.distancia_haversine(lat1, lon1, lat2, lon2) * 1300,
+            "duration": 420,
+            "geometry": {"type": "LineString", "coordinates": [[lon1, lat1], [lon2, lat2]]}
+        }]
+    }
+
+
+def _payloads(n, destino_lat):
+    # Orígenes en una grilla de ~65 m: cada consulta cae en otra celda del cache OSRM
+    return [
+        json.dumps({"origenLat": 2.40 + (i % 150) * 0.0006, "origenLon": -76.68 + (i // 150) * 0.0006,
+                    "destinoLat": destino_lat, "destinoLon": -76.60}).encode()
+        for i in range(n)
+    ]
+
+
+def medir_flask(payloads, latencia, hilos):
+    class Respuesta:
+        status_code = 200
+
+        def __init__(self, url):
+            self.url = url
+
+        def json(self):
+            return _cuerpo_osrm(self.url)
+
+    def get(url, **kwargs):
+        time.sleep(latencia)
+        return Respuesta(url)
+
+    server.CLIENTE_OSRM.session.get = get
+    cliente = server.app.test_client()
+
+    def una(cuerpo):
+        r = cliente.post("/api/estimate-route", data=cuerpo, content_type="application/json")
+        return r.get_json().get("metodo")
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        metodos = list(pool.map(una, payloads))
+    return time.perf_counter() - inicio, metodos, hilos
+
+
+async def medir_asgi(payloads, latencia):
+    async def osrm(peticion):
+        await asyncio.sleep(latencia)
+        return httpx.Response(200, json=_cuerpo_osrm(str(peticion.url.copy_with(query=None))))
+
+    server.CLIENTE_OSRM._cliente_async = httpx.AsyncClient(
+        transport=httpx.MockTransport(osrm),
+        limits=httpx.Limits(max_connections=server.CLIENTE_OSRM.conexiones_async)
+    )
+    app = servidor_asgi.app
+    max_hilos = threading.active_count()
+
+    async def una(cuerpo):
+        nonlocal max_hilos
+        scope = {"type": "http", "method": "POST", "path": "/api/estimate-route", "query_string": b"",
+                 "headers": [(b"content-type", b"application/json")], "http_version": "1.1"}
+        pendientes = [{"type": "http.request", "body": cuerpo, "more_body": False}]
+        enviados = []
+
+        async def receive():
+            return pendientes.pop() if pendientes else {"type": "http.disconnect"}
+
+        async def send(mensaje):
+            enviados.append(mensaje)
+
+        await app(scope, receive, send)
+        max_hilos = max(max_hilos, threading.active_count())
+        return json.loads(enviados[-1]["body"]).get("metodo")
+
+    inicio = time.perf_counter()
+    metodos = await asyncio.gather(*(una(cuerpo) for cuerpo in payloads))
+    duracion = time.perf_counter() - inicio
+    await server.CLIENTE_OSRM.cerrar_async()
+    return duracion, metodos, max_hilos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--latencia-ms", type=float, default=200)
+    parser.add_argument("--hilos", type=int, default=32, help="workers del servidor Flask")
+    args = parser.parse_args()
+    latencia = args.latencia_ms / 1000
+
+    resultados = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for nombre, medir in (
+            ("flask", lambda: medir_flask(_payloads(args.consultas, 2.45), latencia, args.hilos)),
+            ("asgi", lambda: asyncio.run(medir_asgi(_payloads(args.consultas, 2.46), latencia))),
+        ):
+            duracion, metodos, hilos = medir()
+            resultados[nombre] = {
+                "segundos": round(duracion, 2),
+                "estimaciones_por_segundo": round(len(metodos) / duracion, 1),
+                "hilos": hilos,
+                "metodos": {m: metodos.count(m) for m in sorted(set(metodos), key=str)}
+            }
+    print(json.dumps({
+        "consultas": args.consultas,
+        "latencia_osrm_ms": args.latencia_ms,
+        "resultados": resultados
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
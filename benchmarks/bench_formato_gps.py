@@ -0,0 +1,88 @@
+"""
+Compara JSON y el formato binario (formato_binario.py) para reportes GPS.
+
+Mide bytes por reporte y el costo de decodificar un lote hasta tener las tuplas
+(id_bus, empresa, ruta, lat, lon, velocidad, marca) que recibe
+AlmacenBuses.actualizar_lote, es decir el trabajo previo a la validación.
+
+Uso: python benchmarks/bench_formato_gps.py [num_reportes] [num_buses]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import formato_binario  # noqa: E402
+
+EMPRESAS = ["TransPubenza", "TransLibertad", "TransTambo", "Sotracauca"]
+
+
+def generar_reportes(cantidad, num_buses):
+    rnd = random.Random(42)
+    return [
+        {
+            "idBus": "BUS-%05d" % (i % num_buses),
+            "empresa": EMPRESAS[i % 4],
+            "ruta": i % 10 + 1,
+            "lat": round(2.43 + rnd.random() * 0.04, 6),
+            "lon": round(-76.63 + rnd.random() * 0.05, 6),
+            "velocidad": round(rnd.uniform(0, 45), 1),
+            "seq": i
+        }
+        for i in range(cantidad)
+    ]
+
+
+def decodificar_json(cuerpo):
+    # Mismo trabajo de conversión que hace el endpoint con cada item JSON
+    resultado = []
+    for item in json.loads(cuerpo):
+        marca = item.get("seq", item.get("timestamp"))
+        resultado.append((
+            str(item["idBus"]), item["empresa"], int(item["ruta"]), float(item["lat"]), float(item["lon"]),
+            float(item.get("velocidad", 20)), None if marca is None else float(marca)
+        ))
+    return resultado
+
+
+def cronometrar(funcion, argumento, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(argumento)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_buses = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    reportes = generar_reportes(cantidad, num_buses)
+
+    cuerpo_json = json.dumps(reportes).encode("utf-8")
+    cuerpo_ndjson = "".join(json.dumps(r) + "\n" for r in reportes).encode("utf-8")
+    cuerpo_binario = formato_binario.codificar(reportes)
+    assert len(formato_binario.decodificar(cuerpo_binario)) == cantidad
+
+    resultados = []
+    for nombre, cuerpo, funcion in (
+        ("json", cuerpo_json, decodificar_json),
+        ("binario", cuerpo_binario, formato_binario.decodificar),
+    ):
+        duracion = cronometrar(funcion, cuerpo, 5)
+        resultados.append({
+            "formato": nombre,
+            "bytes_por_reporte": round(len(cuerpo) / cantidad, 1),
+            "us_por_reporte": round(duracion / cantidad * 1e6, 3),
+            "reportes_por_s": int(cantidad / duracion)
+        })
+    resultados.append({"formato": "ndjson", "bytes_por_reporte": round(len(cuerpo_ndjson) / cantidad, 1)})
+
+    print(json.dumps({"reportes": cantidad, "buses": num_buses, "resultados": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Latencia de consultas espaciales sobre AlmacenBuses según el tamaño de la flota.
+
+Para flotas de 50 a 20.000 buses repartidos en ~11 x 11 km alrededor de
+Popayán mide una consulta por rectángulo (una vista de ~1 km) y la de los k
+buses más cercanos, usando la grilla del almacén, frente a recorrer todos los
+buses como se hacía antes. La consulta por rectángulo crece con la cantidad
+de buses que devuelve (buses_por_vista), no con el tamaño de la flota.
+
+Uso: python benchmarks/bench_indice_buses.py [consultas]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from estado_buses import AlmacenBuses, _distancia_km  # noqa: E402
+
+FLOTAS = [50, 500, 5000, 20000]
+LAT0, LON0, LADO = 2.39, -76.66, 0.1   # grados (~11 km)
+VISTA = 0.009                          # ~1 km
+K = 5
+
+
+def escaneo_rectangulo(buses, lat_min, lon_min, lat_max, lon_max):
+    return [b for b in buses if lat_min <= b[1] <= lat_max and lon_min <= b[2] <= lon_max]
+
+
+def escaneo_cercanos(buses, lat, lon, k):
+    return sorted((_distancia_km(lat, lon, b[1], b[2]), b[0]) for b in buses)[:k]
+
+
+def medir(funcion, consultas):
+    inicio = time.perf_counter()
+    for argumentos in consultas:
+        funcion(*argumentos)
+    return round((time.perf_counter() - inicio) / len(consultas) * 1e6, 1)
+
+
+def main():
+    num_consultas = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rnd = random.Random(7)
+    ahora = time.time()
+    puntos = [(LAT0 + rnd.random() * LADO, LON0 + rnd.random() * LADO) for _ in range(num_consultas)]
+
+    resultados = []
+    for flota in FLOTAS:
+        almacen = AlmacenBuses(lat_ref=2.44)
+        buses = []
+        for i in range(flota):
+            lat, lon = LAT0 + rnd.random() * LADO, LON0 + rnd.random() * LADO
+            almacen.actualizar("BUS-%05d" % i, "TransPubenza", 1, lat, lon, 20.0, ahora)
+            buses.append(("BUS-%05d" % i, lat, lon))
+
+        rectangulos = [(lat, lon, lat + VISTA, lon + VISTA) for lat, lon in puntos]
+        en_vista = sum(len(escaneo_rectangulo(buses, *r)) for r in rectangulos) / len(rectangulos)
+        resultados.append({
+            "buses": flota,
+            "buses_por_vista": round(en_vista, 1),
+            "us_rectangulo_indice": medir(
+                lambda *r: almacen._en_rectangulo(*r, 0.0), rectangulos),
+            "us_rectangulo_escaneo": medir(
+                lambda *r: escaneo_rectangulo(buses, *r), rectangulos),
+            "us_cercanos_indice": medir(
+                lambda lat, lon: almacen._cercanos(lat, lon, K, None, 0.0), puntos),
+            "us_cercanos_escaneo": medir(
+                lambda lat, lon: escaneo_cercanos(buses, lat, lon, K), puntos),
+        })
+
+    print(json.dumps({"consultas": num_consultas, "k": K, "resultados": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
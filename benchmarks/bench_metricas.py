@@ -0,0 +1,87 @@
+"""
+Costo de registrar métricas (metricas.py) en los caminos calientes.
+
+Mide, por operación, contador.inc y histograma.observar con etiquetas desde
+1 y --hilos hilos a la vez, frente a un contador protegido por un lock
+(la alternativa directa), y el tiempo de exponer GET /metrics con los
+fragmentos de todos esos hilos. Verifica que los totales sumen exacto.
+
+Uso: python benchmarks/bench_metricas.py [--operaciones 200000] [--hilos 4]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metricas import RegistroMetricas  # noqa: E402
+
+
+class ContadorConLock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def inc(self, valor=1, etiquetas=()):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+
+def _medir(funcion, operaciones, hilos):
+    """ns por operación con `hilos` hilos haciendo operaciones / hilos llamadas cada uno"""
+    por_hilo = operaciones // hilos
+    barrera = threading.Barrier(hilos + 1)
+
+    def trabajo():
+        barrera.wait()
+        for i in range(por_hilo):
+            funcion(i)
+
+    trabajadores = [threading.Thread(target=trabajo) for _ in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.join()
+    return (time.perf_counter() - inicio) * 1e9 / (por_hilo * hilos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--operaciones", type=int, default=200000)
+    parser.add_argument("--hilos", type=int, default=4)
+    args = parser.parse_args()
+
+    registro = RegistroMetricas()
+    reportes = registro.contador("bench_reportes_total", "reportes", ("resultado",))
+    latencias = registro.histograma("bench_duracion_segundos", "duración", ("metodo", "ruta"))
+    con_lock = ContadorConLock()
+    etiquetas_http = ("POST", "/api/update-bus-gps")
+
+    resultados = {}
+    for hilos in sorted({1, args.hilos}):
+        resultados[f"contador_ns_{hilos}_hilos"] = round(
+            _medir(lambda i: reportes.inc(1, ("aplicado",)), args.operaciones, hilos), 1)
+        resultados[f"histograma_ns_{hilos}_hilos"] = round(
+            _medir(lambda i: latencias.observar((i % 1000) * 1e-5, etiquetas_http), args.operaciones, hilos), 1)
+        resultados[f"contador_con_lock_ns_{hilos}_hilos"] = round(
+            _medir(lambda i: con_lock.inc(1, ("aplicado",)), args.operaciones, hilos), 1)
+
+    inicio = time.perf_counter()
+    texto = registro.exponer()
+    resultados["exponer_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+
+    esperados = sum((args.operaciones // h) * h for h in sorted({1, args.hilos}))
+    valores = registro.valores()
+    assert valores[reportes][("aplicado",)] == esperados
+    assert sum(valores[latencias][etiquetas_http][:-1]) == esperados
+    resultados["bytes_exposicion"] = len(texto.encode("utf-8"))
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Snapshot y WAL del estado de los buses (persistencia_buses.py).
+
+Llena un almacén con --buses buses, escribe el snapshot, simula --segundos de
+reportes (cada bus reporta cada --periodo segundos) confirmados en bloques
+cada --intervalo segundos como lo hace el hilo de fondo, y mide:
+
+- costo de cada confirmación (bloque + fsync) y bytes por cambio en el WAL;
+- tiempo de escribir el snapshot y su tamaño;
+- tiempo de arranque: cargar snapshot + WAL en un almacén nuevo.
+
+Uso: python benchmarks/bench_persistencia_buses.py [--buses 20000] [--segundos 60] [--periodo 5]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from estado_buses import AlmacenBuses  # noqa: E402
+from persistencia_buses import PersistenciaBuses  # noqa: E402
+
+EMPRESAS = ["TransPubenza", "TransLibertad", "TransTambo", "Sotracauca"]
+ESTADOS = ["EN_TRANSITO", "EN_PARADA"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--buses", type=int, default=20000)
+    parser.add_argument("--segundos", type=float, default=60, help="reportes simulados en el WAL")
+    parser.add_argument("--periodo", type=float, default=5, help="segundos entre reportes de cada bus")
+    parser.add_argument("--intervalo", type=float, default=0.2, help="segundos entre confirmaciones")
+    args = parser.parse_args()
+
+    aleatorio = random.Random(7)
+    directorio = tempfile.mkdtemp(prefix="bench-persistencia-")
+    try:
+        almacen = AlmacenBuses(lat_ref=2.44)
+        persistencia = PersistenciaBuses(almacen, directorio, intervalo_snapshot=3600)
+        persistencia.cargar()
+        ahora = time.time()
+        for b in range(args.buses):
+            almacen.actualizar(f"BUS-{b}", EMPRESAS[b % 4], b % 12 + 1, 2.40 + aleatorio.random() * 0.08,
+                               -76.65 + aleatorio.random() * 0.08, 20.0, ahora,
+                               estado=ESTADOS[b % 2], proxima_parada=f"Parada {b % 40}")
+        inicio = time.perf_counter()
+        persistencia.snapshot()
+        ms_snapshot = (time.perf_counter() - inicio) * 1000
+
+        por_bloque = max(int(args.buses / args.periodo * args.intervalo), 1)
+        bloques = int(args.segundos / args.intervalo)
+        tiempos = []
+        for _ in range(bloques):
+            for _ in range(por_bloque):
+                b = aleatorio.randrange(args.buses)
+                almacen.actualizar(f"BUS-{b}", EMPRESAS[b % 4], b % 12 + 1, 2.40 + aleatorio.random() * 0.08,
+                                   -76.65 + aleatorio.random() * 0.08, 20.0, ahora,
+                                   estado=ESTADOS[b % 2], proxima_parada=f"Parada {b % 40}")
+            inicio = time.perf_counter()
+            persistencia.confirmar()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        estadisticas = persistencia.estadisticas()
+
+        restaurado = AlmacenBuses(lat_ref=2.44)
+        inicio = time.perf_counter()
+        resumen = PersistenciaBuses(restaurado, directorio).cargar()
+        ms_carga = (time.perf_counter() - inicio) * 1000
+        assert len(restaurado) == len(almacen)
+
+        print(json.dumps({
+            "buses": args.buses,
+            "cambios_por_confirmacion": por_bloque,
+            "confirmaciones": bloques,
+            "confirmacion_p50_ms": round(tiempos[len(tiempos) // 2], 2),
+            "confirmacion_p95_ms": round(tiempos[int(len(tiempos) * 0.95)], 2),
+            "bytes_por_cambio_wal": round(estadisticas["bytes_wal"] / (por_bloque * bloques), 1),
+            "snapshot_ms": round(ms_snapshot, 1),
+            "snapshot_bytes": os.path.getsize(os.path.join(directorio, "buses.snap")),
+            "wal_bytes": estadisticas["bytes_wal"],
+            "arranque_ms": round(ms_carga, 1),
+            "arranque": resumen
+        }, indent=2))
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
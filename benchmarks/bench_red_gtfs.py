@@ -0,0 +1,119 @@
+"""
+Carga de la red desde GTFS: lectura de los CSV frente al cache binario mapeado.
+
+Genera un feed GTFS sintético en una carpeta temporal (--empresas x
+--rutas-por-empresa rutas de --paradas paradas y --viajes viajes diarios por
+ruta en cada sentido) y mide:
+
+- lectura del feed (red_gtfs.leer_gtfs) y escritura del cache;
+- arranque con el cache (cargar_red con el cache ya compilado), como lo haría
+  cada worker;
+- que ambas cargas den las mismas rutas y tarifas.
+
+Uso: python benchmarks/bench_red_gtfs.py [--empresas 10] [--rutas-por-empresa 30] [--viajes 60]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from red_gtfs import RedGTFS, cargar_red, huella_feed, leer_gtfs  # noqa: E402
+
+
+def _escribir(carpeta, nombre, columnas, filas):
+    with open(os.path.join(carpeta, nombre), "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(columnas)
+        escritor.writerows(filas)
+
+
+def generar_feed(carpeta, empresas, rutas_por_empresa, paradas, viajes):
+    aleatorio = random.Random(7)
+    _escribir(carpeta, "agency.txt", ["agency_id", "agency_name", "agency_url", "agency_timezone"],
+              [(f"A{e}", f"Empresa {e}", "https://example.com", "America/Bogota") for e in range(empresas)])
+    total_paradas = empresas * rutas_por_empresa * paradas // 3
+    _escribir(carpeta, "stops.txt", ["stop_id", "stop_name", "stop_lat", "stop_lon"],
+              [(f"S{s}", f"Parada {s}", round(2.40 + aleatorio.random() * 0.08, 6),
+                round(-76.65 + aleatorio.random() * 0.08, 6)) for s in range(total_paradas)])
+    rutas, viajes_filas, horarios, tarifas = [], [], [], []
+    for e in range(empresas):
+        tarifas.append((f"F{e}", 2500 + 100 * e, "COP", "0", "0", f"A{e}"))
+        for r in range(rutas_por_empresa):
+            route_id = f"R{e}-{r}"
+            rutas.append((route_id, f"A{e}", str(r + 1) if r % 5 else f"{r + 1}A", f"Ruta {r + 1}", "3"))
+            secuencia = aleatorio.sample(range(total_paradas), paradas)
+            for sentido in (0, 1):
+                orden = secuencia if sentido == 0 else secuencia[::-1]
+                for v in range(viajes):
+                    trip_id = f"{route_id}-{sentido}-{v}"
+                    viajes_filas.append((route_id, "L", trip_id, sentido))
+                    salida = 5 * 3600 + v * 900
+                    for i, parada in enumerate(orden):
+                        hora = time.strftime("%H:%M:%S", time.gmtime(salida + i * 90))
+                        horarios.append((trip_id, hora, hora, f"S{parada}", i + 1))
+    _escribir(carpeta, "routes.txt", ["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"],
+              rutas)
+    _escribir(carpeta, "trips.txt", ["route_id", "service_id", "trip_id", "direction_id"], viajes_filas)
+    _escribir(carpeta, "stop_times.txt", ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+              horarios)
+    _escribir(carpeta, "fare_attributes.txt",
+              ["fare_id", "price", "currency_type", "payment_method", "transfers", "agency_id"], tarifas)
+    return len(horarios)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--empresas", type=int, default=10)
+    parser.add_argument("--rutas-por-empresa", type=int, default=30)
+    parser.add_argument("--paradas", type=int, default=40)
+    parser.add_argument("--viajes", type=int, default=60, help="viajes por ruta y sentido")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="bench-gtfs-")
+    try:
+        filas = generar_feed(carpeta, args.empresas, args.rutas_por_empresa, args.paradas, args.viajes)
+        cache = os.path.join(carpeta, "red.bin")
+
+        inicio = time.perf_counter()
+        leida = leer_gtfs(carpeta)
+        ms_lectura = (time.perf_counter() - inicio) * 1000
+        inicio = time.perf_counter()
+        leida.guardar(cache, huella_feed(carpeta))
+        ms_guardar = (time.perf_counter() - inicio) * 1000
+
+        tiempos = []
+        for _ in range(20):
+            inicio = time.perf_counter()
+            mapeada = cargar_red(carpeta, cache)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        assert mapeada.desde_cache
+        assert mapeada.rutas == leida.rutas and mapeada.tarifas == leida.tarifas
+        assert mapeada.ids_ruta == leida.ids_ruta
+        assert RedGTFS.cargar(cache, b"otra-ver") is None   # otra huella: se vuelve a leer el feed
+
+        print(json.dumps({
+            "rutas": leida.resumen()["rutas"],
+            "paradas_en_rutas": leida.resumen()["paradas"],
+            "filas_stop_times": filas,
+            "bytes_feed": sum(os.path.getsize(os.path.join(carpeta, n)) for n in os.listdir(carpeta)
+                              if n.endswith(".txt")),
+            "bytes_cache": os.path.getsize(cache),
+            "lectura_csv_ms": round(ms_lectura, 1),
+            "escritura_cache_ms": round(ms_guardar, 1),
+            "arranque_con_cache_p50_ms": round(tiempos[len(tiempos) // 2], 2),
+            "arranque_con_cache_max_ms": round(tiempos[-1], 2)
+        }, indent=2))
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Latencia del ruteo local (ruteo_local.py) sobre un grafo del tamaño de Popayán.
+
+Sin un extracto OSM a mano, genera una malla de calles de ~11 x 11 km
+centrada en Popayán: cuadras de ~90 m, avenidas a 50 km/h cada 8 calles y el
+resto a 25 km/h, algunas calles de un solo sentido y algunas cuadras cortadas.
+La guarda con GrafoVial.guardar, la vuelve a cargar y mide consultas entre
+puntos al azar del área urbana (p50/p95 en ms y nodos explorados).
+
+Uso: python benchmarks/bench_ruteo_local.py [consultas] [lado_en_cuadras]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from grafo_vial import GrafoVial, _distancia_m  # noqa: E402
+from ruteo_local import MotorRutasLocal  # noqa: E402
+
+LAT0, LON0 = 2.39, -76.66
+CUADRA_GRADOS = 0.00081   # ~90 m
+
+
+def malla_urbana(lado, rnd):
+    nodos = [(LAT0 + f * CUADRA_GRADOS, LON0 + c * CUADRA_GRADOS) for f in range(lado) for c in range(lado)]
+    aristas = []
+
+    def unir(a, b, avenida, sentido):
+        (lat1, lon1), (lat2, lon2) = nodos[a], nodos[b]
+        metros = _distancia_m(lat1, lon1, lat2, lon2)
+        segundos = metros / ((50 if avenida else 25) / 3.6)
+        medio = [((lat1 + lat2) / 2 + rnd.uniform(-1e-5, 1e-5), (lon1 + lon2) / 2 + rnd.uniform(-1e-5, 1e-5))]
+        if sentido >= 0:
+            aristas.append((a, b, metros, segundos, medio))
+        if sentido <= 0:
+            aristas.append((b, a, metros, segundos, medio))
+
+    for f in range(lado):
+        for c in range(lado):
+            n = f * lado + c
+            if c + 1 < lado and rnd.random() > 0.05:
+                # Calles (filas): una de cada 4 de un solo sentido, alternando
+                unir(n, n + 1, f % 8 == 0, 0 if f % 4 else (1 if f % 8 else -1) * (f % 8 != 0))
+            if f + 1 < lado and rnd.random() > 0.05:
+                unir(n, n + lado, c % 8 == 0, 0 if c % 4 else (1 if c % 8 else -1) * (c % 8 != 0))
+    return GrafoVial.desde_aristas(nodos, aristas)
+
+
+def main():
+    consultas = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    lado = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    rnd = random.Random(11)
+    grafo = malla_urbana(lado, rnd)
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        archivo = os.path.join(carpeta, "grafo.bin")
+        grafo.guardar(archivo)
+        tamano = os.path.getsize(archivo)
+        inicio = time.perf_counter()
+        motor = MotorRutasLocal.desde_archivo(archivo)
+        carga_ms = (time.perf_counter() - inicio) * 1000
+
+    extension = (lado - 1) * CUADRA_GRADOS
+    puntos = [
+        (LAT0 + rnd.random() * extension, LON0 + rnd.random() * extension,
+         LAT0 + rnd.random() * extension, LON0 + rnd.random() * extension)
+        for _ in range(consultas)
+    ]
+    duraciones = []
+    km = []
+    for punto in puntos:
+        t0 = time.perf_counter()
+        ruta = motor.ruta(*punto)
+        duraciones.append((time.perf_counter() - t0) * 1000)
+        if ruta is not None:
+            km.append(ruta["distancia_km"])
+    duraciones.sort()
+
+    print(json.dumps({
+        "nodos": grafo.num_nodos,
+        "aristas": grafo.num_aristas,
+        "bytes_archivo": tamano,
+        "ms_carga": round(carga_ms, 1),
+        "consultas": consultas,
+        "km_promedio": round(sum(km) / len(km), 2) if km else None,
+        "ms_p50": round(duraciones[len(duraciones) // 2], 2),
+        "ms_p95": round(duraciones[int(len(duraciones) * 0.95)], 2),
+        "ms_max": round(duraciones[-1], 2),
+        "motor": motor.estadisticas()
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
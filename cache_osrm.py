@@ -0,0 +1,229 @@
+"""
+Cache de respuestas OSRM para el servidor de rutas de Popayán.
+
+Las coordenadas se ajustan a una grilla (``resolucion`` en grados) para que
+consultas casi idénticas compartan la misma entrada. El cache en memoria es
+LRU con expiración por TTL y, opcionalmente, se respalda en un archivo SQLite
+para sobrevivir reinicios del servidor.
+
+El disco nunca se toca con el candado de la memoria tomado: las lecturas usan
+su propia conexión (en modo WAL no esperan a las escrituras) y las escrituras
+se encolan para un hilo que las confirma por lotes, así que un acierto en
+memoria no espera un fsync. Un error de SQLite (p. ej. "database is locked"
+con varios workers sobre el mismo archivo) cuenta como fallo de cache, nunca
+se propaga al llamador.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_LIMPIAR = object()   # tarea del hilo escritor: borrar la tabla
+
+
+class CacheRutasOSRM:
+    def __init__(self, max_entradas=5000, ttl_segundos=6 * 3600, resolucion=0.0005, archivo=None,
+                 max_pendientes=10000, max_entradas_disco=50000, purga_segundos=600, log=print):
+        """
+        max_entradas: tamaño máximo del cache en memoria (LRU)
+        ttl_segundos: vigencia de cada entrada
+        resolucion: tamaño de celda de la grilla en grados (0.0005 ~ 55 m)
+        archivo: ruta a un archivo SQLite para persistir, None = solo memoria
+        max_pendientes: escrituras a disco encoladas; si el disco no da abasto las nuevas se descartan
+        max_entradas_disco: tope de filas del archivo SQLite (se borran primero las que vencen antes)
+        purga_segundos: cada cuánto el hilo escritor borra las filas vencidas y aplica el tope
+        """
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.resolucion = resolucion
+        self.archivo = archivo
+        self.max_entradas_disco = max_entradas_disco
+        self.purga_segundos = purga_segundos
+        self._log = log
+        self._entradas = OrderedDict()   # { clave: (expira, valor) }
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._hits_disco = 0
+        self._errores_disco = 0
+        self._descartadas_disco = 0
+        self._db = None
+        self._lock_db = threading.Lock()   # conexión de lectura
+        self._cola = queue.Queue(max_pendientes)
+        self._hilo = None
+        if archivo:
+            self._db = sqlite3.connect(archivo, check_same_thread=False, timeout=1)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rutas (clave TEXT PRIMARY KEY, expira REAL, valor TEXT)"
+            )
+            try:
+                self._purgar(self._db)
+            except sqlite3.Error as e:   # otro worker escribiendo: la purga periódica lo hará
+                self._db.rollback()
+                self._log(f"⚠️ Error al purgar el cache OSRM en disco: {e}")
+
+    def clave(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """Ajusta ambos puntos a la grilla y retorna la clave del par"""
+        r = self.resolucion
+        return "%d,%d;%d,%d" % (
+            round(origen_lat / r), round(origen_lon / r),
+            round(destino_lat / r), round(destino_lon / r)
+        )
+
+    @property
+    def persistente(self):
+        return self._db is not None
+
+    def obtener(self, clave):
+        """Retorna el valor cacheado o None si no existe o ya expiró (memoria y después disco)"""
+        valor = self.obtener_memoria(clave)
+        if valor is None and self._db is not None:
+            valor = self.obtener_disco(clave)
+        if valor is None:
+            with self._lock:
+                self._misses += 1
+        return valor
+
+    def obtener_memoria(self, clave):
+        """Solo el nivel en memoria: nunca bloquea en E/S (apto para el bucle de asyncio)"""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] <= ahora:
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            self._hits += 1
+            return entrada[1]
+
+    def obtener_disco(self, clave):
+        """Solo el archivo SQLite; si lo encuentra lo sube a memoria. None si no está o si SQLite falla."""
+        if self._db is None:
+            return None
+        ahora = time.time()
+        try:
+            with self._lock_db:
+                fila = self._db.execute(
+                    "SELECT expira, valor FROM rutas WHERE clave = ?", (clave,)
+                ).fetchone()
+            if fila is None or fila[0] <= ahora:
+                return None
+            valor = json.loads(fila[1])
+        except (sqlite3.Error, ValueError) as e:
+            with self._lock:
+                self._errores_disco += 1
+            self._log(f"⚠️ Error al leer el cache OSRM en disco: {e}")
+            return None
+        with self._lock:
+            self._insertar(clave, fila[0], valor)
+            self._hits += 1
+            self._hits_disco += 1
+        return valor
+
+    def contar_miss(self):
+        """Cuenta un fallo de cache para quien consulta los niveles por separado"""
+        with self._lock:
+            self._misses += 1
+
+    def guardar(self, clave, valor):
+        """Guarda en memoria y encola la escritura a disco (no espera a SQLite)"""
+        expira = time.time() + self.ttl_segundos
+        with self._lock:
+            self._insertar(clave, expira, valor)
+        if self._db is not None:
+            self._encolar((clave, expira, json.dumps(valor)))
+
+    def _insertar(self, clave, expira, valor):
+        # Debe llamarse con self._lock tomado
+        self._entradas[clave] = (expira, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+        if self._db is not None:
+            self._encolar(_LIMPIAR)
+
+    def _encolar(self, tarea):
+        if self._hilo is None or not self._hilo.is_alive():
+            with self._lock:
+                if self._hilo is None or not self._hilo.is_alive():
+                    self._hilo = threading.Thread(target=self._escribir, name="cache-osrm-disco", daemon=True)
+                    self._hilo.start()
+        try:
+            self._cola.put_nowait(tarea)
+        except queue.Full:
+            with self._lock:
+                self._descartadas_disco += 1
+
+    # ------------------------------------------------------
+    # Hilo escritor
+    # ------------------------------------------------------
+    def _escribir(self):
+        # Conexión propia del hilo: un commit (y su fsync) por lote de escrituras pendientes
+        db = sqlite3.connect(self.archivo, timeout=5)
+        proxima_purga = time.monotonic() + self.purga_segundos
+        while True:
+            try:
+                tareas = [self._cola.get(timeout=max(0.0, proxima_purga - time.monotonic()))]
+            except queue.Empty:
+                tareas = []
+            while len(tareas) < 500:
+                try:
+                    tareas.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for tarea in tareas:
+                    if tarea is _LIMPIAR:
+                        db.execute("DELETE FROM rutas")
+                    else:
+                        db.execute("INSERT OR REPLACE INTO rutas (clave, expira, valor) VALUES (?, ?, ?)", tarea)
+                db.commit()
+            except sqlite3.Error as e:
+                db.rollback()
+                with self._lock:
+                    self._errores_disco += 1
+                self._log(f"⚠️ Error al escribir el cache OSRM en disco ({len(tareas)} rutas): {e}")
+            if time.monotonic() >= proxima_purga:
+                proxima_purga = time.monotonic() + self.purga_segundos
+                try:
+                    self._purgar(db)
+                except sqlite3.Error as e:
+                    db.rollback()
+                    self._log(f"⚠️ Error al purgar el cache OSRM en disco: {e}")
+
+    def _purgar(self, db):
+        """Borra las filas vencidas y, si aún sobran, las más próximas a vencer hasta el tope"""
+        db.execute("DELETE FROM rutas WHERE expira < ?", (time.time(),))
+        if self.max_entradas_disco:
+            sobrantes = db.execute("SELECT COUNT(*) FROM rutas").fetchone()[0] - self.max_entradas_disco
+            if sobrantes > 0:
+                db.execute(
+                    "DELETE FROM rutas WHERE clave IN (SELECT clave FROM rutas ORDER BY expira LIMIT ?)",
+                    (sobrantes,)
+                )
+        db.commit()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "hits": self._hits,
+                "hits_disco": self._hits_disco,
+                "misses": self._misses,
+                "tasa_acierto": round(self._hits / total, 3) if total else 0.0,
+                "persistente": self._db is not None,
+                "escrituras_pendientes": self._cola.qsize(),
+                "errores_disco": self._errores_disco,
+                "descartadas_disco": self._descartadas_disco
+            }
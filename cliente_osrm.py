@@ -0,0 +1,113 @@
+"""
+Cliente HTTP compartido para el servicio OSRM.
+
+Mantiene un único requests.Session con pool de conexiones keep-alive, de modo
+que las consultas sucesivas reutilizan la conexión TCP en lugar de abrir una
+nueva por llamada, y un pool de hilos para consultar varios tramos a la vez.
+
+Para el modo ASGI (servidor_asgi.py) ofrece además ruta_async, que usa un
+httpx.AsyncClient con su propio pool: la espera a OSRM no ocupa un hilo.
+httpx solo se importa si se usa ese modo.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PARAMETROS_RUTA = {
+    "overview": "full",
+    "geometries": "geojson",
+    "steps": "false"
+}
+
+
+class ClienteOSRM:
+    def __init__(self, url_base="http://router.project-osrm.org", perfil="driving",
+                 pool_conexiones=20, timeout_conexion=3.05, timeout_lectura=10, hilos=8,
+                 conexiones_async=200):
+        self.url_base = url_base.rstrip("/")
+        self.perfil = perfil
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_conexiones)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="osrm")
+        self.pool_conexiones = pool_conexiones
+        self.conexiones_async = conexiones_async
+        self._cliente_async = None   # httpx.AsyncClient, se crea en el bucle del servidor ASGI
+
+    def url_ruta(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        # OSRM espera lon,lat (no lat,lon)
+        return (f"{self.url_base}/route/v1/{self.perfil}/"
+                f"{origen_lon},{origen_lat};{destino_lon},{destino_lat}")
+
+    def ruta(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """
+        Consulta una ruta a OSRM.
+        Retorna: dict con distancia_km, tiempo_minutos y geometria (GeoJSON)
+                 None si OSRM no encontró ruta
+        Los errores de red y las respuestas 5xx/429 (servidor caído o saturado) se
+        propagan al llamador como excepción.
+        """
+        response = self.session.get(
+            self.url_ruta(origen_lat, origen_lon, destino_lat, destino_lon),
+            params=PARAMETROS_RUTA, timeout=self.timeout
+        )
+        return self._leer_ruta(response)
+
+    async def ruta_async(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """Igual que ruta() pero sin bloquear el hilo: debe llamarse desde el bucle de asyncio"""
+        response = await self._cliente().get(
+            self.url_ruta(origen_lat, origen_lon, destino_lat, destino_lon), params=PARAMETROS_RUTA
+        )
+        return self._leer_ruta(response)
+
+    def _cliente(self):
+        if self._cliente_async is None:
+            import httpx
+            self._cliente_async = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.conexiones_async,
+                                    max_keepalive_connections=self.pool_conexiones)
+            )
+        return self._cliente_async
+
+    async def cerrar_async(self):
+        if self._cliente_async is not None:
+            await self._cliente_async.aclose()
+            self._cliente_async = None
+
+    @staticmethod
+    def _leer_ruta(response):
+        # Sirve para respuestas de requests y de httpx (misma interfaz)
+        if response.status_code >= 500 or response.status_code == 429:
+            response.raise_for_status()
+        if response.status_code != 200:
+            return None
+
+        data = response.json()
+        if data.get('code') != 'Ok' or not data.get('routes'):
+            return None
+
+        route = data['routes'][0]
+        return {
+            'distancia_km': round(route['distance'] / 1000, 2),
+            'tiempo_minutos': int(route['duration'] / 60),
+            'geometria': route.get('geometry', None)
+        }
+
+    def disponible(self, timeout=5):
+        """Prueba rápida de disponibilidad (ruta corta en el centro de Popayán)"""
+        try:
+            resp = self.session.get(
+                self.url_ruta(2.4448, -76.6147, 2.4520, -76.6075),
+                params={"overview": "false"}, timeout=timeout
+            )
+            return resp.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def en_paralelo(self, funcion, argumentos):
+        """Aplica funcion(*args) a cada tupla de argumentos usando el pool de hilos, conservando el orden"""
+        return list(self._ejecutor.map(lambda args: funcion(*args), argumentos))
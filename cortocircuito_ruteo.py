@@ -0,0 +1,243 @@
+"""
+Cortocircuito (circuit breaker) y monitor de salud alrededor de un backend de ruteo.
+
+Envuelve un ClienteOSRM con la misma interfaz (ruta, disponible, en_paralelo)
+para que, cuando OSRM está caído o lento, las estimaciones no esperen el
+timeout completo en cada consulta:
+
+- CERRADO: las consultas pasan. Una excepción o una respuesta más lenta que
+  ``presupuesto_s`` cuenta como fallo; tras ``max_fallos`` fallos seguidos el
+  circuito se abre.
+- ABIERTO: ruta() lanza CircuitoAbierto de inmediato (el llamador usa el
+  método estático) durante ``espera_s`` segundos.
+- SEMIABIERTO: pasada la espera, se dejan pasar hasta ``sondas`` consultas a
+  la vez como prueba; el resto sigue rechazándose. Si la prueba sale bien el
+  circuito se cierra y si falla vuelve a abrirse. Solo el resultado de una
+  sonda saca al circuito de ABIERTO o SEMIABIERTO: una consulta admitida
+  antes de abrirse que termina después no cambia el estado.
+
+Un hilo de fondo (iniciar_monitor) hace una consulta de prueba cada
+``intervalo`` segundos por el mismo circuito, de modo que disponible() y las
+estadísticas (estado y percentiles de latencia) se responden sin salir a la
+red, y un circuito abierto se vuelve a probar aunque no lleguen consultas.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+CERRADO = "CERRADO"
+ABIERTO = "ABIERTO"
+SEMIABIERTO = "SEMIABIERTO"
+
+
+class CircuitoAbierto(Exception):
+    """La consulta se rechazó sin salir al backend porque el circuito está abierto"""
+
+
+def _percentil(ordenadas, fraccion):
+    return ordenadas[min(int(len(ordenadas) * fraccion), len(ordenadas) - 1)]
+
+
+class CortocircuitoRuteo:
+    def __init__(self, ruteador, max_fallos=5, presupuesto_s=2.0, espera_s=30.0, sondas=1,
+                 timeout_sonda=5.0, ventana=500):
+        """
+        ruteador: objeto con ruta(), disponible() y en_paralelo() (p. ej. ClienteOSRM)
+        max_fallos: fallos seguidos que abren el circuito
+        presupuesto_s: una respuesta más lenta que esto cuenta como fallo (aunque se use)
+        espera_s: segundos que el circuito queda abierto antes de volver a probar
+        sondas: consultas de prueba simultáneas permitidas en SEMIABIERTO
+        timeout_sonda: timeout de la consulta de prueba del monitor
+        ventana: latencias recientes guardadas para los percentiles
+        """
+        self.ruteador = ruteador
+        self.max_fallos = max_fallos
+        self.presupuesto_s = presupuesto_s
+        self.espera_s = espera_s
+        self.sondas = sondas
+        self.timeout_sonda = timeout_sonda
+
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos_seguidos = 0
+        self._abierto_desde = 0.0
+        self._sondas_en_curso = 0
+        self._latencias = deque(maxlen=ventana)   # segundos de las consultas que llegaron al backend
+        self._ultima_sonda = None                 # {"ok", "latencia_ms", "en"} de la última sonda del monitor
+        self._consultas = 0
+        self._rechazadas = 0
+        self._fallos = 0
+        self._lentas = 0
+        self._aperturas = 0
+        self._hilo_monitor = None
+
+    # ------------------------------------------------------
+    # Máquina de estados
+    # ------------------------------------------------------
+    def _admitir(self, ahora):
+        # Retorna (admitida, sonda): si la consulta puede salir al backend y si es una sonda de SEMIABIERTO
+        with self._lock:
+            self._consultas += 1
+            if self._estado == ABIERTO and ahora - self._abierto_desde >= self.espera_s:
+                self._estado = SEMIABIERTO
+            if self._estado == CERRADO:
+                return True, False
+            if self._estado == SEMIABIERTO and self._sondas_en_curso < self.sondas:
+                self._sondas_en_curso += 1
+                return True, True
+            self._rechazadas += 1
+            return False, False
+
+    def _registrar(self, exito, latencia, ahora, sonda):
+        with self._lock:
+            self._latencias.append(latencia)
+            lenta = exito and latencia > self.presupuesto_s
+            if lenta:
+                self._lentas += 1
+            elif not exito:
+                self._fallos += 1
+            bien = exito and not lenta
+
+            if sonda:
+                # Solo una sonda decide la salida de SEMIABIERTO y libera su lugar
+                self._sondas_en_curso = max(self._sondas_en_curso - 1, 0)
+                if bien:
+                    self._fallos_seguidos = 0
+                    self._estado = CERRADO
+                else:
+                    self._fallos_seguidos += 1
+                    self._abrir(ahora)
+                return
+            if self._estado != CERRADO:
+                # Consulta admitida antes de que el circuito se abriera: no cambia el estado
+                return
+            if bien:
+                self._fallos_seguidos = 0
+                return
+            self._fallos_seguidos += 1
+            if self._fallos_seguidos >= self.max_fallos:
+                self._abrir(ahora)
+
+    def _liberar_sonda(self, sonda):
+        # La consulta terminó sin resultado (p. ej. cancelada): no cuenta como éxito ni como fallo
+        if sonda:
+            with self._lock:
+                self._sondas_en_curso = max(self._sondas_en_curso - 1, 0)
+
+    def _abrir(self, ahora):
+        # Debe llamarse con self._lock tomado
+        if self._estado != ABIERTO:
+            self._aperturas += 1
+        self._estado = ABIERTO
+        self._abierto_desde = ahora
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._estado == ABIERTO and time.time() - self._abierto_desde >= self.espera_s:
+                return SEMIABIERTO
+            return self._estado
+
+    # ------------------------------------------------------
+    # Interfaz de ruteo
+    # ------------------------------------------------------
+    def ruta(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """
+        Igual que ruteador.ruta; con el circuito abierto lanza CircuitoAbierto sin consultar.
+        Los errores del backend se registran y se propagan al llamador.
+        """
+        admitida, sonda = self._admitir(time.time())
+        if not admitida:
+            raise CircuitoAbierto()
+        inicio = time.perf_counter()
+        try:
+            resultado = self.ruteador.ruta(origen_lat, origen_lon, destino_lat, destino_lon)
+        except Exception:
+            self._registrar(False, time.perf_counter() - inicio, time.time(), sonda)
+            raise
+        self._registrar(True, time.perf_counter() - inicio, time.time(), sonda)
+        return resultado
+
+    async def ruta_async(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """Igual que ruta() usando ruteador.ruta_async (modo ASGI)"""
+        admitida, sonda = self._admitir(time.time())
+        if not admitida:
+            raise CircuitoAbierto()
+        inicio = time.perf_counter()
+        try:
+            resultado = await self.ruteador.ruta_async(origen_lat, origen_lon, destino_lat, destino_lon)
+        except asyncio.CancelledError:
+            # Cancelada por el llamador: no dice nada del backend, pero una sonda libera su lugar
+            self._liberar_sonda(sonda)
+            raise
+        except Exception:
+            self._registrar(False, time.perf_counter() - inicio, time.time(), sonda)
+            raise
+        self._registrar(True, time.perf_counter() - inicio, time.time(), sonda)
+        return resultado
+
+    def disponible(self, timeout=None):
+        """Estado en cache (no sale a la red): el circuito no está abierto y la última sonda respondió"""
+        with self._lock:
+            ultima_ok = self._ultima_sonda is None or self._ultima_sonda["ok"]
+        return self.estado != ABIERTO and ultima_ok
+
+    def en_paralelo(self, funcion, argumentos):
+        return self.ruteador.en_paralelo(funcion, argumentos)
+
+    # ------------------------------------------------------
+    # Monitor de salud
+    # ------------------------------------------------------
+    def sondear(self):
+        """Una consulta de prueba por el circuito (si la admite). Retorna True/False, o None si se rechazó."""
+        ahora = time.time()
+        admitida, sonda = self._admitir(ahora)
+        if not admitida:
+            return None
+        inicio = time.perf_counter()
+        try:
+            ok = bool(self.ruteador.disponible(timeout=self.timeout_sonda))
+        except Exception:
+            ok = False
+        latencia = time.perf_counter() - inicio
+        self._registrar(ok, latencia, time.time(), sonda)
+        with self._lock:
+            self._ultima_sonda = {"ok": ok, "latencia_ms": round(latencia * 1000, 1), "en": ahora}
+        return ok
+
+    def iniciar_monitor(self, intervalo=10.0):
+        """Inicia el hilo que llama sondear() cada `intervalo` segundos"""
+        if self._hilo_monitor is not None and self._hilo_monitor.is_alive():
+            return
+
+        def ciclo():
+            while True:
+                self.sondear()
+                time.sleep(intervalo)
+
+        self._hilo_monitor = threading.Thread(target=ciclo, name="ruteo-monitor", daemon=True)
+        self._hilo_monitor.start()
+
+    def estadisticas(self):
+        estado = self.estado
+        with self._lock:
+            latencias = sorted(self._latencias)
+            ultima = dict(self._ultima_sonda) if self._ultima_sonda else None
+            datos = {
+                "estado": estado,
+                "fallos_seguidos": self._fallos_seguidos,
+                "consultas": self._consultas,
+                "rechazadas": self._rechazadas,
+                "fallos": self._fallos,
+                "lentas": self._lentas,
+                "aperturas": self._aperturas,
+                "presupuesto_ms": round(self.presupuesto_s * 1000),
+                "muestras_latencia": len(latencias)
+            }
+        for nombre, fraccion in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            datos[nombre] = round(_percentil(latencias, fraccion) * 1000, 1) if latencias else None
+        if ultima is not None:
+            ultima["hace_s"] = round(time.time() - ultima.pop("en"), 1)
+        datos["ultima_sonda"] = ultima
+        return datos
@@ -1,13 +1,30 @@
-from flask import Flask, render_template_string, jsonify, request
+from flask import Flask, Response, render_template_string, jsonify, request, stream_with_context
+import os
 import requests
 import time
+from proxy_backend import ProxyBackend, RetransmisorBuses
 
 app = Flask(__name__)
 
 # Configuración
-BACKEND_URL = "http://192.168.1.7:3002"
+BACKEND_URL = os.environ.get("BACKEND_URL", "http://192.168.1.7:3002")
 PORT = 5001
 
+# Todas las vistas abiertas comparten estas respuestas: la carga sobre el backend no crece con los visores
+PROXY_TTL_BUSES = float(os.environ.get("PROXY_TTL_BUSES", 0.5))
+PROXY_TTL_RUTAS = float(os.environ.get("PROXY_TTL_RUTAS", 300))
+PROXY = ProxyBackend(
+    BACKEND_URL,
+    ttl_por_ruta={"/api/buses": PROXY_TTL_BUSES, "/api/rutas": PROXY_TTL_RUTAS},
+    pool_conexiones=int(os.environ.get("PROXY_POOL_CONEXIONES", 20))
+)
+# Una sola conexión al stream del backend para todos los visores (stream y ?since=)
+PROXY_STREAM_LATIDO = 15
+RETRANSMISOR = RetransmisorBuses(
+    PROXY,
+    inactividad=float(os.environ.get("PROXY_STREAM_INACTIVIDAD", 60))
+)
+
 @app.route("/")
 def index():
     return render_template_string(
@@ -305,70 +322,76 @@ def index():
         }
     }
 
+    function removeMarker(id) {
+        if (markers[id]) {
+            map.removeLayer(markers[id]);
+            delete markers[id];
+        }
+    }
+
     function updateMap(buses) {
         const currentIds = new Set(buses.map(b => b.id));
         
         // Remove old markers
         Object.keys(markers).forEach(id => {
-            if (!currentIds.has(id)) {
-                map.removeLayer(markers[id]);
-                delete markers[id];
-            }
+            if (!currentIds.has(id)) removeMarker(id);
         });
         
         // Update/Add markers
-        buses.forEach(b => {
-            const color = getMarkerColor(b.empresa);
-            
-            // Status indicator (moving vs stopped)
-            const isStopped = b.estado === "EN_PARADA";
-            const statusColor = isStopped ? "#e74c3c" : "#2ecc71"; 
-            
-            const icon = L.divIcon({
-                className: 'custom-marker',
-                html: `
+        buses.forEach(upsertMarker);
+    }
+
+    function upsertMarker(b) {
+        const color = getMarkerColor(b.empresa);
+        
+        // Status indicator (moving vs stopped)
+        const isStopped = b.estado === "EN_PARADA";
+        const statusColor = isStopped ? "#e74c3c" : "#2ecc71"; 
+        
+        const icon = L.divIcon({
+            className: 'custom-marker',
+            html: `
+                <div style="
+                    background-color: ${color}; 
+                    width: 20px; height: 20px; 
+                    border-radius: 50%; 
+                    border: 3px solid white; 
+                    box-shadow: 0 0 4px rgba(0,0,0,0.3);
+                    position: relative;
+                ">
                     <div style="
-                        background-color: ${color}; 
-                        width: 20px; height: 20px; 
-                        border-radius: 50%; 
-                        border: 3px solid white; 
-                        box-shadow: 0 0 4px rgba(0,0,0,0.3);
-                        position: relative;
-                    ">
-                        <div style="
-                            position: absolute; bottom: -5px; right: -5px;
-                            width: 10px; height: 10px;
-                            background-color: ${statusColor};
-                            border-radius: 50%;
-                            border: 1px solid white;
-                        "></div>
-                    </div>`,
-                iconSize: [24, 24],
-                iconAnchor: [12, 12]
-            });
+                        position: absolute; bottom: -5px; right: -5px;
+                        width: 10px; height: 10px;
+                        background-color: ${statusColor};
+                        border-radius: 50%;
+                        border: 1px solid white;
+                    "></div>
+                </div>`,
+            iconSize: [24, 24],
+            iconAnchor: [12, 12]
+        });
 
-            const popupContent = `
-                <div style="min-width: 150px">
-                    <h3 style="margin:0 0 5px; color:${color}">${b.empresa}</h3>
-                    <b>Ruta ${b.ruta}</b><br>
-                    <div style="margin-top:5px; padding-top:5px; border-top:1px solid #eee">
-                        Vel: <b>${b.vel} km/h</b><br>
-                        Estado: <b>${b.estado || 'En ruta'}</b><br>
-                        ${b.proxima_parada ? `Próxima: ${b.proxima_parada}` : ''}
-                    </div>
+        const popupContent = `
+            <div style="min-width: 150px">
+                <h3 style="margin:0 0 5px; color:${color}">${b.empresa}</h3>
+                <b>Ruta ${b.ruta}</b><br>
+                <div style="margin-top:5px; padding-top:5px; border-top:1px solid #eee">
+                    Vel: <b>${b.vel} km/h</b><br>
+                    Estado: <b>${b.estado || 'En ruta'}</b><br>
+                    ${b.proxima_parada ? `Próxima: ${b.proxima_parada}` : ''}
                 </div>
-            `;
+            </div>
+        `;
 
-            if (!markers[b.id]) {
-                markers[b.id] = L.marker([b.lat, b.lon], {icon: icon})
-                    .bindPopup(popupContent)
-                    .addTo(map);
-            } else {
-                markers[b.id].setLatLng([b.lat, b.lon]);
-                markers[b.id].setIcon(icon);
-                markers[b.id].setPopupContent(popupContent);
-            }
-        });
+        if (!markers[b.id]) {
+            markers[b.id] = L.marker([b.lat, b.lon], {icon: icon})
+                .bindPopup(popupContent)
+                .addTo(map);
+        } else {
+            markers[b.id].setLatLng([b.lat, b.lon]);
+            markers[b.id].setIcon(icon);
+            markers[b.id].setPopupContent(popupContent);
+        }
     }
 
     function updatePanel(buses) {
@@ -410,23 +433,63 @@ def index():
         map.setView([lat, lon], 16);
     }
 
+    // Estado local: el stream (o el sondeo incremental) solo trae los cambios desde lastSeq
+    let busState = {};
+    let lastSeq = 0;
+
+    function applyUpdate(data) {
+        if (Array.isArray(data)) {
+            // Respuesta sin secuencia (backend antiguo o error del proxy): lista completa
+            busState = {};
+            data.forEach(b => busState[b.id] = b);
+            lastSeq = 0;
+            updateMap(data);
+        } else if (data.completo) {
+            busState = {};
+            data.buses.forEach(b => busState[b.id] = b);
+            lastSeq = data.seq;
+            updateMap(data.buses);
+        } else {
+            data.eliminados.forEach(id => {
+                delete busState[id];
+                removeMarker(id);
+            });
+            data.buses.forEach(b => {
+                busState[b.id] = b;
+                upsertMarker(b);
+            });
+            lastSeq = data.seq;
+        }
+        updatePanel(Object.values(busState));
+    }
+
     async function fetchData() {
         try {
-            const res = await fetch("/api/proxy/buses");
+            const res = await fetch(`/api/proxy/buses?since=${lastSeq}`);
             if (!res.ok) throw new Error("Error fetching data");
-            
-            const data = await res.json();
-            updateMap(data);
-            updatePanel(data);
+            applyUpdate(await res.json());
         } catch (error) {
             console.error("Error:", error);
             document.getElementById("status").innerText = "Error de conexión con el backend";
         }
     }
 
-    // Update every 1 second for smoother animation
-    setInterval(fetchData, 1000);
-    fetchData();
+    // Recibe los cambios por SSE; si el navegador no lo soporta, sondeo cada segundo
+    function startStream() {
+        if (!window.EventSource) {
+            setInterval(fetchData, 1000);
+            fetchData();
+            return;
+        }
+        const source = new EventSource("/api/proxy/buses/stream");
+        source.addEventListener("buses", e => applyUpdate(JSON.parse(e.data)));
+        source.onerror = () => {
+            // EventSource reconecta solo; el primer mensaje tras reconectar trae el estado completo
+            document.getElementById("status").innerText = "Reconectando con el backend...";
+        };
+    }
+
+    startStream();
     cargarRutasData(); // Cargar rutas disponibles al inicio
 
 </script>
@@ -435,33 +498,98 @@ def index():
         """
     )
 
+def respuesta_backend(resultado):
+    codigo, cuerpo, tipo = resultado
+    return Response(cuerpo, status=codigo, content_type=tipo)
+
+def backend_no_disponible(e):
+    return jsonify({"success": False, "mensaje": f"Backend no disponible: {e}"}), 502
+
 @app.route("/api/proxy/buses")
 def proxy_buses():
+    if "since" in request.args:
+        try:
+            desde = int(request.args["since"])
+        except ValueError:
+            return jsonify({"success": False, "mensaje": "El parámetro since debe ser un número entero"}), 400
+        mensaje = RETRANSMISOR.cambios_desde(desde)
+        if mensaje is not None:
+            return Response(mensaje, mimetype="application/json")
+    # Sin réplica todavía: el arreglo completo, una misma respuesta para todos los visores
+    try:
+        return respuesta_backend(PROXY.get("/api/buses"))
+    except requests.RequestException as e:
+        return backend_no_disponible(e)
+
+@app.route("/api/proxy/buses/stream")
+def proxy_buses_stream():
+    if request.args:
+        # Con filtros se reenvía un stream propio del backend tal como llega
+        return reenviar_stream_filtrado()
+
+    visor = RETRANSMISOR.suscribir()
+
+    def eventos():
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                mensaje = RETRANSMISOR.siguiente(visor, PROXY_STREAM_LATIDO)
+                if mensaje is None:
+                    yield ": latido\n\n"
+                else:
+                    yield "event: buses\ndata: " + mensaje + "\n\n"
+        finally:
+            RETRANSMISOR.cancelar(visor)
+
+    return Response(stream_with_context(eventos()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def reenviar_stream_filtrado():
     try:
-        response = requests.get(f"{BACKEND_URL}/api/buses", timeout=2)
-        return jsonify(response.json()) if response.status_code == 200 else jsonify([])
-    except: return jsonify([])
+        response = PROXY.stream("/api/buses/stream", params=request.args)
+    except requests.RequestException as e:
+        return backend_no_disponible(e)
+    if response.status_code != 200:
+        response.close()
+        return jsonify({"success": False, "mensaje": "Stream no disponible"}), response.status_code
+
+    def reenviar():
+        try:
+            for bloque in response.iter_content(chunk_size=None):
+                yield bloque
+        finally:
+            response.close()
+
+    return Response(stream_with_context(reenviar()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/proxy/rutas")
 def proxy_rutas():
     try:
-        response = requests.get(f"{BACKEND_URL}/api/rutas", timeout=2)
-        return jsonify(response.json()) if response.status_code == 200 else jsonify({})
-    except: return jsonify({})
+        return respuesta_backend(PROXY.get("/api/rutas"))
+    except requests.RequestException:
+        # El mapa espera un objeto; sin backend se muestra vacío
+        return jsonify({}), 502
 
 @app.route("/api/proxy/simular-bus", methods=['POST'])
 def proxy_simular():
     try:
-        response = requests.post(f"{BACKEND_URL}/api/simular-bus", json=request.json, timeout=2)
-        return jsonify(response.json())
-    except Exception as e: return jsonify({"success":False, "mensaje": str(e)})
+        return respuesta_backend(PROXY.post("/api/simular-bus", json=request.get_json(silent=True)))
+    except requests.RequestException as e:
+        return backend_no_disponible(e)
 
 @app.route("/api/proxy/eta", methods=['POST'])
 def proxy_eta():
     try:
-        response = requests.post(f"{BACKEND_URL}/api/eta", json=request.json, timeout=2)
-        return jsonify(response.json())
-    except Exception as e: return jsonify({"success":False, "mensaje": str(e)})
+        return respuesta_backend(PROXY.post("/api/eta", json=request.get_json(silent=True)))
+    except requests.RequestException as e:
+        return backend_no_disponible(e)
+
+@app.route("/api/proxy/stats")
+def proxy_stats():
+    estadisticas = PROXY.estadisticas()
+    estadisticas["stream"] = RETRANSMISOR.estadisticas()
+    return jsonify(estadisticas)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=PORT, debug=True)
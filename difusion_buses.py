@@ -0,0 +1,217 @@
+"""
+Difusión (push) de posiciones de buses para Server-Sent Events.
+
+Un solo hilo pide al almacén los cambios desde la última secuencia, como máximo
+``max_hz`` veces por segundo, y reparte el JSON de cada bus (armado una sola vez)
+a los suscriptores según su filtro: empresa, ruta o rectángulo del mapa.
+
+Los pendientes de cada suscriptor se agrupan por bus: si el cliente no alcanza
+a leer, la posición nueva reemplaza a la anterior y solo se envía la última.
+Si aun así supera ``max_pendientes`` se descartan y el cliente recibe el estado
+completo en su siguiente mensaje. Un cliente lento nunca frena al hilo de
+difusión ni a los demás suscriptores.
+
+Los mensajes tienen el mismo formato que /api/buses?since=:
+    {"seq": N, "completo": bool, "buses": [...], "eliminados": [ids]}
+"""
+import json
+import threading
+import time
+
+
+class Suscriptor:
+    __slots__ = ("filtro", "pendientes", "visibles", "necesita_completo", "completo",
+                 "seq", "hay_datos", "mensajes", "descartes")
+
+    def __init__(self, empresa=None, ruta=None, bbox=None):
+        """bbox: (lat_min, lon_min, lat_max, lon_max) o None"""
+        self.filtro = (empresa, ruta, bbox)
+        self.pendientes = {}       # { id_bus: json_bus, o None si se eliminó o salió del filtro }
+        self.visibles = set()      # ids que el cliente tiene (o tendrá al leer los pendientes)
+        self.necesita_completo = True
+        self.completo = False      # el próximo mensaje reemplaza todo el estado del cliente
+        self.seq = 0
+        self.hay_datos = threading.Event()
+        self.mensajes = 0
+        self.descartes = 0
+
+
+def _acepta(filtro, empresa, ruta, lat, lon):
+    f_empresa, f_ruta, bbox = filtro
+    if f_empresa is not None and empresa != f_empresa:
+        return False
+    if f_ruta is not None and ruta != f_ruta:
+        return False
+    if bbox is not None:
+        lat_min, lon_min, lat_max, lon_max = bbox
+        return lat_min <= lat <= lat_max and lon_min <= lon <= lon_max
+    return True
+
+
+class DifusorBuses:
+    def __init__(self, almacen, max_hz=2.0, max_pendientes=5000, max_suscriptores=500, log=print):
+        """
+        almacen: AlmacenBuses del que se leen los cambios
+        max_hz: máximo de mensajes por segundo a cada suscriptor
+        max_pendientes: buses pendientes por suscriptor antes de descartarlos y reenviar todo
+        max_suscriptores: conexiones simultáneas aceptadas
+        """
+        self.almacen = almacen
+        self.max_hz = max_hz
+        self.max_pendientes = max_pendientes
+        self.max_suscriptores = max_suscriptores
+        self._log = log
+        self._lock = threading.Lock()
+        self._suscriptores = set()
+        self._hay_suscriptores = threading.Event()
+        self._hilo = None
+        self._seq = 0
+        self._ciclos = 0
+        self._descartes = 0
+
+    # ------------------------------------------------------
+    # Suscripciones
+    # ------------------------------------------------------
+    def suscribir(self, empresa=None, ruta=None, bbox=None):
+        """Retorna un Suscriptor, o None si se alcanzó max_suscriptores"""
+        suscriptor = Suscriptor(empresa, ruta, bbox)
+        with self._lock:
+            if len(self._suscriptores) >= self.max_suscriptores:
+                return None
+            self._suscriptores.add(suscriptor)
+            self._hay_suscriptores.set()
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name="buses-difusion", daemon=True)
+                self._hilo.start()
+        return suscriptor
+
+    def cancelar(self, suscriptor):
+        with self._lock:
+            self._suscriptores.discard(suscriptor)
+            if not self._suscriptores:
+                self._hay_suscriptores.clear()
+
+    def siguiente(self, suscriptor, timeout):
+        """
+        Espera hasta `timeout` segundos el próximo mensaje del suscriptor.
+        Retorna el mensaje (texto JSON) o None si no hubo cambios en ese tiempo.
+        """
+        if not suscriptor.hay_datos.wait(timeout):
+            return None
+        with self._lock:
+            suscriptor.hay_datos.clear()
+            pendientes = suscriptor.pendientes
+            if not pendientes and not suscriptor.completo:
+                return None
+            suscriptor.pendientes = {}
+            completo = suscriptor.completo
+            suscriptor.completo = False
+            seq = suscriptor.seq
+            suscriptor.mensajes += 1
+
+        buses = ",".join(texto for texto in pendientes.values() if texto is not None)
+        eliminados = "" if completo else ",".join(
+            json.dumps(id_bus) for id_bus, texto in pendientes.items() if texto is None
+        )
+        return '{"seq":%d,"completo":%s,"buses":[%s],"eliminados":[%s]}' % (
+            seq, "true" if completo else "false", buses, eliminados)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "suscriptores": len(self._suscriptores),
+                "max_suscriptores": self.max_suscriptores,
+                "max_hz": self.max_hz,
+                "ciclos": self._ciclos,
+                "descartes": self._descartes,
+                "seq": self._seq
+            }
+
+    # ------------------------------------------------------
+    # Hilo de difusión
+    # ------------------------------------------------------
+    def _ejecutar(self):
+        intervalo = 1.0 / self.max_hz
+        while True:
+            self._hay_suscriptores.wait()
+            inicio = time.monotonic()
+            try:
+                self._ciclo()
+            except Exception as e:
+                self._log(f"⚠️ Error en la difusión de buses: {e}")
+            time.sleep(max(0.0, intervalo - (time.monotonic() - inicio)))
+
+    def _ciclo(self):
+        ahora = time.time()
+        anterior = self._seq
+        seq, completo, cambiados, eliminados = self.almacen.cambios(anterior, ahora)
+        self._seq = seq
+
+        with self._lock:
+            self._ciclos += 1
+            suscriptores = list(self._suscriptores)
+            if completo:
+                if seq != anterior:
+                    # El difusor quedó más atrás que el historial: todos reciben el estado completo
+                    for suscriptor in suscriptores:
+                        suscriptor.necesita_completo = True
+            elif cambiados or eliminados:
+                self._repartir(suscriptores, seq, cambiados, eliminados)
+            nuevos = [s for s in suscriptores if s.necesita_completo]
+
+        if not nuevos:
+            return
+        if not completo:
+            seq, _, cambiados, _ = self.almacen.cambios(0, ahora)
+        with self._lock:
+            for suscriptor in nuevos:
+                filtro = suscriptor.filtro
+                suscriptor.pendientes = {
+                    id_bus: texto
+                    for id_bus, empresa, ruta, lat, lon, texto in cambiados
+                    if _acepta(filtro, empresa, ruta, lat, lon)
+                }
+                suscriptor.visibles = set(suscriptor.pendientes)
+                suscriptor.necesita_completo = False
+                suscriptor.completo = True
+                suscriptor.seq = seq
+                suscriptor.hay_datos.set()
+
+    def _repartir(self, suscriptores, seq, cambiados, eliminados):
+        # Debe llamarse con self._lock tomado.
+        # El filtro se evalúa una vez por filtro distinto, no por suscriptor.
+        por_filtro = {}
+        for suscriptor in suscriptores:
+            if suscriptor.necesita_completo:
+                continue
+            filtro = suscriptor.filtro
+            resultado = por_filtro.get(filtro)
+            if resultado is None:
+                aceptados = {}
+                salen = set(eliminados)
+                for id_bus, empresa, ruta, lat, lon, texto in cambiados:
+                    if _acepta(filtro, empresa, ruta, lat, lon):
+                        aceptados[id_bus] = texto
+                    else:
+                        salen.add(id_bus)
+                resultado = por_filtro[filtro] = (aceptados, salen)
+            aceptados, salen = resultado
+
+            pendientes = suscriptor.pendientes
+            visibles = suscriptor.visibles
+            pendientes.update(aceptados)
+            visibles.update(aceptados)
+            quitar = visibles.intersection(salen)
+            if quitar:
+                visibles.difference_update(quitar)
+                pendientes.update(dict.fromkeys(quitar))
+
+            if len(pendientes) > self.max_pendientes:
+                # Cliente demasiado lento: se descarta lo acumulado y se le reenvía el estado completo
+                pendientes.clear()
+                suscriptor.necesita_completo = True
+                suscriptor.descartes += 1
+                self._descartes += 1
+            elif pendientes:
+                suscriptor.seq = seq
+                suscriptor.hay_datos.set()
@@ -0,0 +1,142 @@
+"""
+Emparejamiento de posiciones GPS con la geometría de las rutas (map-matching).
+
+La geometría de una ruta es la polilínea de sus paradas en orden; el tramo i
+va de la parada i a la i + 1. Cada punto se proyecta sobre el tramo más
+cercano y se convierte en kilómetros recorridos desde la primera parada
+(``acumulado_km`` de la TablaRuta más la fracción del tramo).
+
+Para no recorrer todos los tramos en cada reporte, el almacén guarda por bus
+el último tramo emparejado (cursor) y la búsqueda empieza en los tramos
+vecinos a ese cursor. Solo si el punto queda lejos de todos ellos (bus nuevo,
+salto de GPS o cambio de ruta) se recorre la ruta completa, así que el costo
+amortizado por reporte es constante.
+
+Las proyecciones usan coordenadas planas (equirectangulares) alrededor de la
+primera parada de la ruta; a escala de ciudad el error es menor al 0,1 %.
+"""
+import math
+
+from indice_paradas import KM_POR_GRADO
+
+IDA = 1
+REGRESO = -1
+
+
+class EmparejadorRuta:
+    def __init__(self, tabla, ventana=2, desvio_pista_km=0.1, max_desvio_km=0.5):
+        """
+        tabla: TablaRuta de la ruta (paradas y distancias acumuladas)
+        ventana: tramos revisados a cada lado del cursor antes de recorrer toda la ruta
+        desvio_pista_km: si el tramo más cercano dentro de la ventana está a más de esto, se recorre toda la ruta
+        max_desvio_km: un punto más lejos que esto de toda la ruta no se empareja
+        """
+        self.tabla = tabla
+        self.ventana = ventana
+        self.desvio_pista2 = desvio_pista_km ** 2
+        self.max_desvio2 = max_desvio_km ** 2
+
+        paradas = tabla.paradas
+        self.num_tramos = max(len(paradas) - 1, 0)
+        lat_ref = paradas[0]['lat'] if paradas else 0.0
+        self._km_lat = KM_POR_GRADO
+        self._km_lon = KM_POR_GRADO * math.cos(math.radians(lat_ref))
+
+        # Por tramo: origen (x, y) en km planos, vector (dx, dy) y su largo² en el plano
+        self._x = []
+        self._y = []
+        self._dx = []
+        self._dy = []
+        self._largo2 = []
+        for p1, p2 in zip(paradas, paradas[1:]):
+            x1, y1 = self._plano(p1['lat'], p1['lon'])
+            x2, y2 = self._plano(p2['lat'], p2['lon'])
+            self._x.append(x1)
+            self._y.append(y1)
+            self._dx.append(x2 - x1)
+            self._dy.append(y2 - y1)
+            self._largo2.append((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+    def _plano(self, lat, lon):
+        return lon * self._km_lon, lat * self._km_lat
+
+    def _proyectar(self, tramo, x, y):
+        # Retorna (distancia² al tramo, fracción recorrida del tramo en [0, 1])
+        dx, dy = self._dx[tramo], self._dy[tramo]
+        px, py = x - self._x[tramo], y - self._y[tramo]
+        largo2 = self._largo2[tramo]
+        t = 0.0 if largo2 == 0 else min(1.0, max(0.0, (px * dx + py * dy) / largo2))
+        ex, ey = px - t * dx, py - t * dy
+        return ex * ex + ey * ey, t
+
+    def _mas_cercano(self, tramos, x, y):
+        mejor_d2, mejor_tramo, mejor_t = math.inf, -1, 0.0
+        for tramo in tramos:
+            d2, t = self._proyectar(tramo, x, y)
+            if d2 < mejor_d2:
+                mejor_d2, mejor_tramo, mejor_t = d2, tramo, t
+        return mejor_d2, mejor_tramo, mejor_t
+
+    def emparejar(self, lat, lon, tramo_pista=-1):
+        """
+        Proyecta el punto sobre la ruta.
+        tramo_pista: último tramo emparejado de este bus (-1 = desconocido)
+        Retorna (tramo, km_ruta, desvio_km) o None si el punto está a más de max_desvio_km de la ruta.
+        """
+        if self.num_tramos == 0:
+            return None
+        x, y = self._plano(lat, lon)
+        d2 = math.inf
+        if 0 <= tramo_pista < self.num_tramos:
+            d2, tramo, t = self._mas_cercano(
+                range(max(0, tramo_pista - self.ventana), min(self.num_tramos, tramo_pista + self.ventana + 1)),
+                x, y)
+        if d2 > self.desvio_pista2:
+            d2, tramo, t = self._mas_cercano(range(self.num_tramos), x, y)
+        if d2 > self.max_desvio2:
+            return None
+        km_ruta = self.tabla.acumulado_km[tramo] + t * self.tabla.tramos_km[tramo]
+        return tramo, km_ruta, math.sqrt(d2)
+
+
+class EmparejadorRutas:
+    """Un EmparejadorRuta por (empresa, numeroRuta); es el emparejador que recibe AlmacenBuses"""
+
+    def __init__(self, tablas, umbral_sentido_km=0.02, **opciones):
+        """
+        tablas: { (empresa, numeroRuta): TablaRuta }
+        umbral_sentido_km: avance mínimo sobre la ruta entre dos reportes para fijar el sentido
+        opciones: parámetros de EmparejadorRuta
+        """
+        self.umbral_sentido_km = umbral_sentido_km
+        self.rutas = {clave: EmparejadorRuta(tabla, **opciones) for clave, tabla in tablas.items()}
+
+    def emparejar_bus(self, empresa, ruta, lat, lon, tramo_pista, km_anterior, sentido_anterior):
+        """
+        Empareja un reporte conociendo el estado anterior del bus en la misma ruta
+        (tramo_pista = -1, km_anterior = nan y sentido_anterior = 0 si no hay).
+        Retorna (tramo, km_ruta, sentido, ultima_parada_index) o None si no se pudo emparejar.
+        El sentido sale del avance sobre la ruta (IDA si aumenta km_ruta, REGRESO si disminuye)
+        y ultima_parada_index es la posición de la última parada dejada atrás en ese sentido.
+        """
+        emparejador = self.rutas.get((empresa, ruta))
+        if emparejador is None:
+            return None
+        resultado = emparejador.emparejar(lat, lon, tramo_pista)
+        if resultado is None:
+            return None
+        tramo, km_ruta, _ = resultado
+
+        sentido = sentido_anterior
+        avance = km_ruta - km_anterior   # nan si no hay km anterior: ninguna comparación es verdadera
+        if avance > self.umbral_sentido_km:
+            sentido = IDA
+        elif avance < -self.umbral_sentido_km:
+            sentido = REGRESO
+        # Un bus justo sobre una parada ya la cuenta como pasada
+        acumulado = emparejador.tabla.acumulado_km
+        if sentido == REGRESO:
+            parada = tramo if km_ruta <= acumulado[tramo] else tramo + 1
+        else:
+            parada = tramo + 1 if km_ruta >= acumulado[tramo + 1] else tramo
+        return tramo, km_ruta, sentido, parada
@@ -0,0 +1,763 @@
+"""
+Almacén compacto del estado de los buses (reemplaza el dict BUS_POSITIONS).
+
+Cada bus ocupa una posición (slot) en columnas ``array`` de tamaño fijo
+(lat, lon, velocidad, timestamp, ...). Los textos repetidos (empresa, estado,
+próxima parada) se guardan una sola vez en una tabla y cada bus solo guarda su
+código. Una actualización escribe en el lugar, sin crear un dict nuevo por
+tick, y el JSON de /api/buses se arma directamente desde las columnas.
+
+Los buses sin reportes durante ``ttl_segundos`` se eliminan. Para no recorrer
+todo el almacén, cada bus está en una cubeta según su último timestamp
+(cubetas de ``ancho_cubeta`` segundos) y la limpieza solo visita las cubetas
+vencidas. También se mantiene el conjunto de buses de cada (empresa, ruta) y
+una grilla de celdas de ``celda_km`` de lado para consultas por rectángulo y
+por cercanía; un bus solo cambia de celda cuando cruza su borde.
+
+Cada cambio (alta, actualización o eliminación) recibe un número de
+secuencia creciente, lo que permite entregar solo lo cambiado desde una
+secuencia dada (sondeo incremental de /api/buses?since=).
+
+Si se pasa un emparejador (ver emparejamiento_rutas.py), cada escritura
+proyecta la posición sobre la geometría de la ruta y guarda los km
+recorridos, el sentido y la última parada pasada. El tramo emparejado queda
+en el slot y sirve de punto de partida para el siguiente reporte del bus.
+
+Con varios procesos, estado_compartido.py usa un AlmacenBuses por proceso como
+réplica local de un segmento de memoria compartida (ver replicar()), y
+persistencia_buses.py guarda snapshots y un WAL a partir de registros().
+"""
+import heapq
+import json
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+from indice_paradas import KM_POR_GRADO
+
+SIN_INDICE = -1   # ultima_parada_index no informado
+NINGUNO = -1      # fin de la lista de cambios
+SIN_MARCA = float("-inf")   # el bus aún no envió seq/timestamp propio
+
+
+class AlmacenBuses:
+    def __init__(self, ttl_segundos=300, max_buses=50000, ancho_cubeta=10, max_eliminados=10000,
+                 celda_km=0.25, lat_ref=0.0):
+        """
+        ttl_segundos: un bus sin reportes durante este tiempo se elimina
+        max_buses: máximo de buses rastreados; al superarlo se elimina el más antiguo
+        ancho_cubeta: segundos que agrupa cada cubeta de expiración
+        max_eliminados: eliminaciones recordadas para consultas incrementales; un cliente
+                        más atrasado que eso recibe el estado completo
+        celda_km: lado de las celdas de la grilla espacial
+        lat_ref: latitud de referencia para que las celdas sean cuadradas en km
+        """
+        self.ttl_segundos = ttl_segundos
+        self.max_buses = max_buses
+        self.ancho_cubeta = ancho_cubeta
+        self.max_eliminados = max_eliminados
+        self.celda_km = celda_km
+        self._celda_lat = celda_km / KM_POR_GRADO
+        self._cos_ref = max(math.cos(math.radians(lat_ref)), 0.01)
+        self._celda_lon = self._celda_lat / self._cos_ref
+
+        self._lock = threading.Lock()
+        # Métodos ligados una sola vez: "with self._lock" crea dos objetos por llamada
+        self._tomar = self._lock.acquire
+        self._soltar = self._lock.release
+        self._slots = {}       # { id_bus: slot }
+        self._ids = []         # slot -> id_bus (None si está libre)
+        self._libres = []      # slots reutilizables
+
+        self.lat = array('d')
+        self.lon = array('d')
+        self.vel = array('d')
+        self.timestamp = array('d')
+        self.ruta = array('i')
+        self.ultima_parada = array('i')
+        self.empresa = array('I')      # código en la tabla de textos
+        self.estado = array('I')
+        self.proxima_parada = array('I')
+        self.cubeta = array('d')       # cubeta de expiración actual del slot
+        self.seq = array('q')          # secuencia del último cambio del slot
+        self.marca = array('d')        # último seq/timestamp del propio reporte (descarta repetidos)
+        self.fila = array('d')         # celda de la grilla espacial (enteros guardados como float)
+        self.col = array('d')
+        self.tramo = array('i')        # último tramo de la ruta emparejado (cursor del emparejador)
+        self.km_ruta = array('d')      # km recorridos sobre la ruta (nan = sin emparejar)
+        self.sentido = array('b')      # 1 ida, -1 regreso, 0 desconocido
+        # Lista doblemente enlazada de slots en orden de cambio (el más reciente al final)
+        self._anterior = array('i')
+        self._siguiente = array('i')
+
+        # Tabla de textos: código 0 = sin valor
+        self._textos = [None]
+        self._textos_json = ["null"]
+        self._codigos = {None: 0}
+
+        self._cubetas = {}     # { cubeta: set(id_bus) }
+        self._por_ruta = {}    # { (codigo_empresa, ruta): set(id_bus) }
+        self._celdas = {}      # { (fila, col): set(id_bus) }
+        self._expirados = 0
+        self._desalojados = 0
+        self._hilo_expiracion = None
+
+        self.secuencia = 0                # último número de secuencia asignado
+        self._primero = NINGUNO           # slot con el cambio más antiguo
+        self._ultimo = NINGUNO            # slot con el cambio más reciente
+        self._eliminados = deque()        # (seq, id_bus) de las eliminaciones
+        self._seq_compactado = 0          # eliminaciones con seq <= esto ya se olvidaron
+
+    # ------------------------------------------------------
+    # Textos compartidos
+    # ------------------------------------------------------
+    def _codigo(self, texto):
+        codigo = self._codigos.get(texto)
+        if codigo is None:
+            codigo = len(self._textos)
+            self._textos.append(texto)
+            self._textos_json.append(json.dumps(texto))
+            self._codigos[texto] = codigo
+        return codigo
+
+    def texto(self, codigo):
+        return self._textos[codigo]
+
+    # ------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------
+    def _slot_nuevo(self, id_bus):
+        # Debe llamarse con self._lock tomado
+        if len(self._slots) >= self.max_buses:
+            self._desalojar_mas_antiguo()
+        if self._libres:
+            slot = self._libres.pop()
+            self._ids[slot] = id_bus
+        else:
+            slot = len(self._ids)
+            self._ids.append(id_bus)
+            for columna in (self.lat, self.lon, self.vel, self.timestamp, self.cubeta, self.marca,
+                            self.fila, self.col, self.km_ruta):
+                columna.append(0.0)
+            for columna in (self.ruta, self.ultima_parada, self.empresa, self.estado, self.proxima_parada, self.seq,
+                            self.tramo, self.sentido):
+                columna.append(0)
+            self._anterior.append(NINGUNO)
+            self._siguiente.append(NINGUNO)
+        self.marca[slot] = SIN_MARCA
+        self._slots[id_bus] = slot
+        return slot
+
+    def _marcar_cambio(self, id_bus, slot, seq=None):
+        # Debe llamarse con self._lock tomado. seq: secuencia ya asignada por el origen de una réplica.
+        if seq is None:
+            self.secuencia += 1
+            seq = self.secuencia
+        elif seq > self.secuencia:
+            self.secuencia = seq
+        self.seq[slot] = seq
+        if slot != self._ultimo:
+            self._desenlazar(slot)
+            self._anterior[slot] = self._ultimo
+            if self._ultimo == NINGUNO:
+                self._primero = slot
+            else:
+                self._siguiente[self._ultimo] = slot
+            self._ultimo = slot
+
+    def _desenlazar(self, slot):
+        # Debe llamarse con self._lock tomado. Sin efecto si el slot no está en la lista.
+        anterior = self._anterior[slot]
+        siguiente = self._siguiente[slot]
+        if anterior == NINGUNO and self._primero != slot:
+            return
+        if anterior == NINGUNO:
+            self._primero = siguiente
+        else:
+            self._siguiente[anterior] = siguiente
+        if siguiente == NINGUNO:
+            self._ultimo = anterior
+        else:
+            self._anterior[siguiente] = anterior
+        self._anterior[slot] = self._siguiente[slot] = NINGUNO
+
+    def _indexar(self, id_bus, slot, nuevo, empresa_ant, ruta_ant, cubeta_ant):
+        # Debe llamarse con self._lock tomado, después de escribir empresa/ruta/timestamp del slot
+        empresa = self.empresa[slot]
+        ruta = self.ruta[slot]
+        if nuevo or empresa != empresa_ant or ruta != ruta_ant:
+            if not nuevo:
+                self._quitar_de(self._por_ruta, (empresa_ant, ruta_ant), id_bus)
+            miembros = self._por_ruta.get((empresa, ruta))
+            if miembros is None:
+                miembros = self._por_ruta[(empresa, ruta)] = set()
+            miembros.add(id_bus)
+
+        cubeta = self.timestamp[slot] // self.ancho_cubeta
+        if nuevo or cubeta != cubeta_ant:
+            if not nuevo:
+                self._quitar_de(self._cubetas, cubeta_ant, id_bus)
+            miembros = self._cubetas.get(cubeta)
+            if miembros is None:
+                miembros = self._cubetas[cubeta] = set()
+            miembros.add(id_bus)
+            self.cubeta[slot] = cubeta
+
+        # Sin int(): (3.0, -7.0) y (3, -7) son la misma clave de dict
+        fila = self.lat[slot] // self._celda_lat
+        col = self.lon[slot] // self._celda_lon
+        if nuevo or fila != self.fila[slot] or col != self.col[slot]:
+            if not nuevo:
+                self._quitar_de(self._celdas, (self.fila[slot], self.col[slot]), id_bus)
+            miembros = self._celdas.get((fila, col))
+            if miembros is None:
+                miembros = self._celdas[(fila, col)] = set()
+            miembros.add(id_bus)
+            self.fila[slot] = fila
+            self.col[slot] = col
+
+    @staticmethod
+    def _quitar_de(indice, clave, id_bus):
+        miembros = indice.get(clave)
+        if miembros is not None:
+            miembros.discard(id_bus)
+            if not miembros:
+                del indice[clave]
+
+    def actualizar(self, id_bus, empresa, ruta, lat, lon, vel, timestamp,
+                   ultima_parada_index=None, estado=None, proxima_parada=None, emparejador=None):
+        """
+        Crea o reemplaza el registro completo del bus (los campos opcionales no informados quedan vacíos).
+        emparejador: EmparejadorRutas opcional; si ultima_parada_index no se informa, se toma del emparejamiento
+        """
+        self._tomar()
+        try:
+            return self._escribir(id_bus, empresa, ruta, lat, lon, vel, timestamp,
+                                  ultima_parada_index, estado, proxima_parada, emparejador)
+        finally:
+            self._soltar()
+
+    def actualizar_lote(self, reportes, timestamp, emparejador=None):
+        """
+        Aplica varios reportes con una sola toma del lock.
+        reportes: secuencia de (id_bus, empresa, ruta, lat, lon, vel, marca), donde marca es el
+                  seq o timestamp propio del reporte (o None). Un reporte con marca menor o igual
+                  a la última aceptada para ese bus es repetido o llegó desordenado y se descarta.
+        emparejador: como en actualizar()
+        Retorna una lista de bool (True = aplicado) en el mismo orden.
+        """
+        aplicados = []
+        marcas = self.marca
+        self._tomar()
+        try:
+            for id_bus, empresa, ruta, lat, lon, vel, marca in reportes:
+                if marca is not None:
+                    slot = self._slots.get(id_bus)
+                    if slot is not None and marca <= marcas[slot]:
+                        aplicados.append(False)
+                        continue
+                slot = self._escribir(id_bus, empresa, ruta, lat, lon, vel, timestamp, None, None, None, emparejador)
+                if marca is not None:
+                    marcas[slot] = marca
+                aplicados.append(True)
+        finally:
+            self._soltar()
+        return aplicados
+
+    def _escribir(self, id_bus, empresa, ruta, lat, lon, vel, timestamp,
+                  ultima_parada_index, estado, proxima_parada, emparejador, emparejado=None, seq=None):
+        # Debe llamarse con self._lock tomado.
+        # emparejado: (tramo, km_ruta, sentido, parada) ya calculado, si no se pasa emparejador
+        codigos = self._codigos
+        slot = self._slots.get(id_bus)
+        nuevo = slot is None
+        if nuevo:
+            slot = self._slot_nuevo(id_bus)
+            empresa_ant = ruta_ant = cubeta_ant = None
+        else:
+            empresa_ant = self.empresa[slot]
+            ruta_ant = self.ruta[slot]
+            cubeta_ant = self.cubeta[slot]
+        codigo = codigos.get(empresa)
+        self.empresa[slot] = self._codigo(empresa) if codigo is None else codigo
+        self.ruta[slot] = ruta
+        self.lat[slot] = lat
+        self.lon[slot] = lon
+        self.vel[slot] = vel
+        self.timestamp[slot] = timestamp
+        if emparejador is not None:
+            if nuevo or self.empresa[slot] != empresa_ant or ruta != ruta_ant:
+                emparejado = emparejador.emparejar_bus(empresa, ruta, lat, lon, SIN_INDICE, math.nan, 0)
+            else:
+                emparejado = emparejador.emparejar_bus(empresa, ruta, lat, lon,
+                                                       self.tramo[slot], self.km_ruta[slot], self.sentido[slot])
+        if emparejado is None:
+            self.tramo[slot] = SIN_INDICE
+            self.km_ruta[slot] = math.nan
+            self.sentido[slot] = 0
+        else:
+            self.tramo[slot], self.km_ruta[slot], self.sentido[slot], parada = emparejado
+            if ultima_parada_index is None:
+                ultima_parada_index = parada
+        self.ultima_parada[slot] = SIN_INDICE if ultima_parada_index is None else ultima_parada_index
+        codigo = codigos.get(estado)
+        self.estado[slot] = self._codigo(estado) if codigo is None else codigo
+        codigo = codigos.get(proxima_parada)
+        self.proxima_parada[slot] = self._codigo(proxima_parada) if codigo is None else codigo
+        self._indexar(id_bus, slot, nuevo, empresa_ant, ruta_ant, cubeta_ant)
+        self._marcar_cambio(id_bus, slot, seq)
+        return slot
+
+    def replicar(self, cambios, secuencia, completo=False):
+        """
+        Aplica cambios ya resueltos en otro almacén (estado_compartido.py) conservando su secuencia.
+        cambios: [(seq, id_bus, registro)] en orden de seq; registro es None para una eliminación o
+                 (empresa, ruta, lat, lon, vel, timestamp, ultima_parada_index, estado, proxima_parada,
+                 emparejado) con emparejado = (tramo, km_ruta, sentido, parada) o None
+        secuencia: última secuencia del origen (puede ser mayor que el último seq de cambios)
+        completo: los cambios son el estado completo (p. ej. al reconstruir o restaurar); un cliente
+                  con una secuencia anterior recibe todo, ya que no hay historial de eliminaciones
+        Retorna el conjunto de (empresa, ruta) afectadas.
+        """
+        rutas = set()
+        with self._lock:
+            for seq, id_bus, registro in cambios:
+                slot = self._slots.get(id_bus)
+                if slot is not None:
+                    rutas.add((self._textos[self.empresa[slot]], self.ruta[slot]))
+                if registro is None:
+                    if slot is not None:
+                        self._liberar(id_bus, seq)
+                    continue
+                empresa, ruta, lat, lon, vel, timestamp, ultima_parada_index, estado, proxima_parada, emparejado = registro
+                self._escribir(id_bus, empresa, ruta, lat, lon, vel, timestamp, ultima_parada_index,
+                               estado, proxima_parada, None, emparejado, seq)
+                rutas.add((empresa, ruta))
+            if secuencia > self.secuencia:
+                self.secuencia = secuencia
+            if completo:
+                self._seq_compactado = self.secuencia
+        return rutas
+
+    def registros(self, desde=0):
+        """
+        Cambios posteriores a la secuencia `desde` en el formato de replicar() (persistencia_buses.py).
+        Retorna (secuencia, completo, [(seq, id_bus, registro)] en orden de seq, [ids eliminados]).
+        Con completo = True (desde 0 o fuera del historial) trae todos los buses y ninguna eliminación.
+        """
+        with self._lock:
+            completo = desde <= 0 or desde < self._seq_compactado or desde > self.secuencia
+            if completo:
+                desde = 0
+            textos = self._textos
+            cambiados = []
+            slot = self._ultimo
+            while slot != NINGUNO and self.seq[slot] > desde:
+                tramo = self.tramo[slot]
+                ultima = self.ultima_parada[slot]
+                ultima = None if ultima == SIN_INDICE else ultima
+                cambiados.append((self.seq[slot], self._ids[slot], (
+                    textos[self.empresa[slot]], self.ruta[slot], self.lat[slot], self.lon[slot], self.vel[slot],
+                    self.timestamp[slot], ultima, textos[self.estado[slot]], textos[self.proxima_parada[slot]],
+                    None if tramo == SIN_INDICE else (tramo, self.km_ruta[slot], self.sentido[slot], ultima)
+                )))
+                slot = self._anterior[slot]
+            cambiados.reverse()
+
+            eliminados = []
+            if not completo:
+                for seq, id_bus in reversed(self._eliminados):
+                    if seq <= desde:
+                        break
+                    if id_bus not in self._slots:
+                        eliminados.append(id_bus)
+            return self.secuencia, completo, cambiados, eliminados
+
+    def cursor(self, id_bus):
+        """(empresa, ruta, tramo, km_ruta, sentido) del último emparejamiento del bus, o None si no existe"""
+        with self._lock:
+            slot = self._slots.get(id_bus)
+            if slot is None:
+                return None
+            return (self._textos[self.empresa[slot]], self.ruta[slot],
+                    self.tramo[slot], self.km_ruta[slot], self.sentido[slot])
+
+    def modificar(self, id_bus, **campos):
+        """Actualiza solo algunos campos de un bus existente. Retorna False si el bus no existe."""
+        with self._lock:
+            slot = self._slots.get(id_bus)
+            if slot is None:
+                return False
+            empresa_ant, ruta_ant, cubeta_ant = self.empresa[slot], self.ruta[slot], self.cubeta[slot]
+            for campo, valor in campos.items():
+                if campo in ("empresa", "estado", "proxima_parada"):
+                    getattr(self, campo)[slot] = self._codigo(valor)
+                elif campo == "ultima_parada_index":
+                    self.ultima_parada[slot] = SIN_INDICE if valor is None else valor
+                else:
+                    getattr(self, campo)[slot] = valor
+            self._indexar(id_bus, slot, False, empresa_ant, ruta_ant, cubeta_ant)
+            self._marcar_cambio(id_bus, slot)
+            return True
+
+    def eliminar(self, id_bus):
+        """Quita un bus. Retorna False si no existía."""
+        with self._lock:
+            return self._liberar(id_bus)
+
+    def _liberar(self, id_bus, seq=None):
+        # Debe llamarse con self._lock tomado
+        slot = self._slots.pop(id_bus, None)
+        if slot is None:
+            return False
+        self._quitar_de(self._por_ruta, (self.empresa[slot], self.ruta[slot]), id_bus)
+        self._quitar_de(self._cubetas, self.cubeta[slot], id_bus)
+        self._quitar_de(self._celdas, (self.fila[slot], self.col[slot]), id_bus)
+        self._ids[slot] = None
+        self._libres.append(slot)
+
+        if seq is None:
+            self.secuencia += 1
+            seq = self.secuencia
+        elif seq > self.secuencia:
+            self.secuencia = seq
+        self._desenlazar(slot)
+        self._eliminados.append((seq, id_bus))
+        if len(self._eliminados) > self.max_eliminados:
+            self._seq_compactado = self._eliminados.popleft()[0]
+        return True
+
+    def limpiar(self):
+        with self._lock:
+            for id_bus in list(self._slots):
+                self._liberar(id_bus)
+
+    # ------------------------------------------------------
+    # Expiración
+    # ------------------------------------------------------
+    def _desalojar_mas_antiguo(self):
+        # Debe llamarse con self._lock tomado
+        if not self._cubetas:
+            return
+        cubeta = min(self._cubetas)
+        id_bus = next(iter(self._cubetas[cubeta]))
+        self._liberar(id_bus)
+        self._desalojados += 1
+
+    def expirar(self, ahora=None):
+        """
+        Elimina los buses cuyo último reporte es anterior a ahora - ttl_segundos.
+        Solo visita las cubetas completamente vencidas (trabajo proporcional a lo expirado);
+        un bus puede sobrevivir hasta ancho_cubeta segundos de más.
+        Retorna la lista de ids eliminados.
+        """
+        if ahora is None:
+            ahora = time.time()
+        # La cubeta c cubre [c * ancho, (c + 1) * ancho): vencida si (c + 1) * ancho <= ahora - ttl
+        limite = (ahora - self.ttl_segundos) // self.ancho_cubeta - 1
+        eliminados = []
+        with self._lock:
+            for cubeta in [c for c in self._cubetas if c <= limite]:
+                for id_bus in list(self._cubetas.get(cubeta, ())):
+                    self._liberar(id_bus)
+                    eliminados.append(id_bus)
+            self._expirados += len(eliminados)
+        return eliminados
+
+    def iniciar_expiracion(self, intervalo=None, al_expirar=None):
+        """
+        Inicia el hilo que llama expirar() cada `intervalo` segundos (por defecto ancho_cubeta).
+        al_expirar: función opcional que recibe la lista de ids eliminados
+        """
+        if self._hilo_expiracion is not None and self._hilo_expiracion.is_alive():
+            return
+        intervalo = intervalo or self.ancho_cubeta
+
+        def ciclo():
+            while True:
+                time.sleep(intervalo)
+                eliminados = self.expirar()
+                if eliminados and al_expirar is not None:
+                    al_expirar(eliminados)
+
+        self._hilo_expiracion = threading.Thread(target=ciclo, name="buses-expiracion", daemon=True)
+        self._hilo_expiracion.start()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "buses": len(self._slots),
+                "max_buses": self.max_buses,
+                "ttl_segundos": self.ttl_segundos,
+                "cubetas": len(self._cubetas),
+                "rutas_con_buses": len(self._por_ruta),
+                "celdas_ocupadas": len(self._celdas),
+                "expirados": self._expirados,
+                "desalojados_por_capacidad": self._desalojados,
+                "secuencia": self.secuencia
+            }
+
+    # ------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, id_bus):
+        return id_bus in self._slots
+
+    def ids(self):
+        with self._lock:
+            return list(self._slots)
+
+    def _dict(self, id_bus, slot):
+        bus = {
+            "empresa": self._textos[self.empresa[slot]],
+            "ruta": self.ruta[slot],
+            "lat": self.lat[slot],
+            "lon": self.lon[slot],
+            "vel": self.vel[slot],
+            "timestamp": self.timestamp[slot]
+        }
+        if self.ultima_parada[slot] != SIN_INDICE:
+            bus["ultima_parada_index"] = self.ultima_parada[slot]
+        if self.tramo[slot] != SIN_INDICE:
+            bus["km_ruta"] = round(self.km_ruta[slot], 3)
+            bus["sentido"] = self.sentido[slot]
+        if self.estado[slot]:
+            bus["estado"] = self._textos[self.estado[slot]]
+        if self.proxima_parada[slot]:
+            bus["proxima_parada"] = self._textos[self.proxima_parada[slot]]
+        return bus
+
+    def obtener(self, id_bus):
+        """Retorna una copia del bus como dict (mismas claves que el antiguo BUS_POSITIONS) o None"""
+        with self._lock:
+            slot = self._slots.get(id_bus)
+            return None if slot is None else self._dict(id_bus, slot)
+
+    def buses_en_ruta(self, empresa, ruta):
+        """Lista de (id_bus, dict) de los buses vigentes de una empresa/ruta"""
+        limite = time.time() - self.ttl_segundos
+        with self._lock:
+            miembros = self._por_ruta.get((self._codigos.get(empresa), ruta), ())
+            return [
+                (id_bus, self._dict(id_bus, self._slots[id_bus]))
+                for id_bus in miembros
+                if self.timestamp[self._slots[id_bus]] > limite
+            ]
+
+    def _json_bus(self, id_bus, slot):
+        # Mismo orden de claves que jsonify (ordenadas alfabéticamente)
+        partes = ['{"empresa":', self._textos_json[self.empresa[slot]]]
+        if self.estado[slot]:
+            partes.append(',"estado":')
+            partes.append(self._textos_json[self.estado[slot]])
+        partes.append(',"id":%s' % json.dumps(id_bus))
+        emparejado = self.tramo[slot] != SIN_INDICE
+        if emparejado:
+            partes.append(',"km_ruta":%s' % _numero_json(round(self.km_ruta[slot], 3)))
+        partes.append(',"lat":%s,"lon":%s' % (_numero_json(self.lat[slot]), _numero_json(self.lon[slot])))
+        if self.proxima_parada[slot]:
+            partes.append(',"proxima_parada":')
+            partes.append(self._textos_json[self.proxima_parada[slot]])
+        partes.append(',"ruta":%d' % self.ruta[slot])
+        if emparejado:
+            partes.append(',"sentido":%d' % self.sentido[slot])
+        partes.append(',"timestamp":%s' % _numero_json(self.timestamp[slot]))
+        if self.ultima_parada[slot] != SIN_INDICE:
+            partes.append(',"ultima_parada_index":%d' % self.ultima_parada[slot])
+        partes.append(',"vel":%s}' % _numero_json(self.vel[slot]))
+        return "".join(partes)
+
+    def json_activos(self, ahora, ttl_segundos=None):
+        """Arreglo JSON (texto) con los buses actualizados en los últimos ttl_segundos"""
+        limite = ahora - (self.ttl_segundos if ttl_segundos is None else ttl_segundos)
+        with self._lock:
+            timestamp = self.timestamp
+            return "[" + ",".join(
+                self._json_bus(id_bus, slot)
+                for id_bus, slot in self._slots.items()
+                if timestamp[slot] > limite
+            ) + "]"
+
+    def _cambios(self, desde, limite):
+        # Debe llamarse con self._lock tomado.
+        # Retorna (completo, [(id_bus, slot)] vigentes cambiados, [ids eliminados])
+        if desde <= 0 or desde < self._seq_compactado or desde > self.secuencia:
+            timestamp = self.timestamp
+            return True, [(id_bus, slot) for id_bus, slot in self._slots.items() if timestamp[slot] > limite], []
+
+        cambiados = []
+        slot = self._ultimo
+        while slot != NINGUNO and self.seq[slot] > desde:
+            if self.timestamp[slot] > limite:
+                cambiados.append((self._ids[slot], slot))
+            slot = self._anterior[slot]
+
+        eliminados = []
+        for seq, id_bus in reversed(self._eliminados):
+            if seq <= desde:
+                break
+            # Si volvió a aparecer después, ya viene entre los cambiados
+            if id_bus not in self._slots:
+                eliminados.append(id_bus)
+        return False, cambiados, eliminados
+
+    def json_cambios(self, desde, ahora):
+        """
+        Objeto JSON (texto) con los cambios posteriores a la secuencia `desde`:
+            {"seq": ultima_secuencia, "completo": false, "buses": [cambiados], "eliminados": [ids]}
+        Si `desde` es 0, es más antiguo que el historial conservado o mayor que la secuencia
+        actual (p. ej. el servidor se reinició), retorna el estado completo con "completo": true.
+        """
+        with self._lock:
+            completo, cambiados, eliminados = self._cambios(desde, ahora - self.ttl_segundos)
+            return '{"seq":%d,"completo":%s,"buses":[%s],"eliminados":[%s]}' % (
+                self.secuencia,
+                "true" if completo else "false",
+                ",".join(self._json_bus(id_bus, slot) for id_bus, slot in cambiados),
+                ",".join(json.dumps(id_bus) for id_bus in eliminados))
+
+    def cambios(self, desde, ahora):
+        """
+        Igual que json_cambios pero sin armar el objeto, para quien necesita filtrar:
+        retorna (seq, completo, [(id_bus, empresa, ruta, lat, lon, json_bus)], [ids eliminados]).
+        """
+        with self._lock:
+            completo, cambiados, eliminados = self._cambios(desde, ahora - self.ttl_segundos)
+            textos = self._textos
+            return self.secuencia, completo, [
+                (id_bus, textos[self.empresa[slot]], self.ruta[slot], self.lat[slot], self.lon[slot],
+                 self._json_bus(id_bus, slot))
+                for id_bus, slot in cambiados
+            ], eliminados
+
+    # ------------------------------------------------------
+    # Consultas espaciales
+    # ------------------------------------------------------
+    def _en_rectangulo(self, lat_min, lon_min, lat_max, lon_max, limite):
+        # Debe llamarse con self._lock tomado. Retorna [(id_bus, slot)] vigentes dentro del rectángulo.
+        f0, f1 = int(lat_min // self._celda_lat), int(lat_max // self._celda_lat)
+        c0, c1 = int(lon_min // self._celda_lon), int(lon_max // self._celda_lon)
+        if (f1 - f0 + 1) * (c1 - c0 + 1) <= len(self._celdas):
+            celdas = (
+                self._celdas.get((fila, col))
+                for fila in range(f0, f1 + 1)
+                for col in range(c0, c1 + 1)
+            )
+        else:
+            # Rectángulo más grande que la zona ocupada: recorrer solo las celdas con buses
+            celdas = (
+                miembros for (fila, col), miembros in self._celdas.items()
+                if f0 <= fila <= f1 and c0 <= col <= c1
+            )
+        resultado = []
+        for miembros in celdas:
+            if not miembros:
+                continue
+            for id_bus in miembros:
+                slot = self._slots[id_bus]
+                if (lat_min <= self.lat[slot] <= lat_max and lon_min <= self.lon[slot] <= lon_max
+                        and self.timestamp[slot] > limite):
+                    resultado.append((id_bus, slot))
+        return resultado
+
+    def _cercanos(self, lat, lon, k, radio_km, limite):
+        # Debe llamarse con self._lock tomado. Retorna [(distancia_km, id_bus, slot)] ordenada.
+        # Recorre anillos de celdas alrededor del punto hasta que los no visitados no puedan
+        # estar más cerca que el k-ésimo encontrado. Los candidatos se comparan con la
+        # distancia plana (equirectangular, error < 0,1 % a escala de ciudad) y solo los k
+        # elegidos se calculan con haversine.
+        fila0 = int(lat // self._celda_lat)
+        col0 = int(lon // self._celda_lon)
+        km_lat = KM_POR_GRADO
+        km_lon = KM_POR_GRADO * math.cos(math.radians(lat))
+        # Distancia plana mínima por cada anillo de celdas
+        km_por_anillo = self.celda_km * min(1.0, math.cos(math.radians(lat)) / self._cos_ref)
+        radio2 = math.inf if radio_km is None else (radio_km * 1.001) ** 2
+        lats, lons, timestamps, slots, celdas = self.lat, self.lon, self.timestamp, self._slots, self._celdas
+
+        encontrados = []   # (distancia² plana, id_bus, slot)
+        vistos = 0
+        total = len(slots)
+        r = 0
+        while vistos < total:
+            if r == 0:
+                anillo = [(fila0, col0)]
+            elif (2 * r + 1) ** 2 > len(celdas):
+                # Flota dispersa: hay menos celdas ocupadas que celdas por recorrer, revisar las ocupadas que faltan
+                anillo = [
+                    (fila, col) for fila, col in celdas
+                    if max(abs(fila - fila0), abs(col - col0)) >= r
+                ]
+                r = math.inf
+            else:
+                anillo = [(fila0 - r, c) for c in range(col0 - r, col0 + r + 1)]
+                anillo += [(fila0 + r, c) for c in range(col0 - r, col0 + r + 1)]
+                anillo += [(f, col0 - r) for f in range(fila0 - r + 1, fila0 + r)]
+                anillo += [(f, col0 + r) for f in range(fila0 - r + 1, fila0 + r)]
+            for celda in anillo:
+                miembros = celdas.get(celda)
+                if not miembros:
+                    continue
+                vistos += len(miembros)
+                for id_bus in miembros:
+                    slot = slots[id_bus]
+                    if timestamps[slot] > limite:
+                        dy = (lats[slot] - lat) * km_lat
+                        dx = (lons[slot] - lon) * km_lon
+                        d2 = dx * dx + dy * dy
+                        if d2 <= radio2:
+                            encontrados.append((d2, id_bus, slot))
+
+            if r == math.inf:
+                break
+            # Todo bus no visitado está al menos a r celdas completas en latitud o longitud
+            cota2 = (r * km_por_anillo) ** 2
+            if cota2 >= radio2:
+                break
+            if len(encontrados) >= k and heapq.nsmallest(k, encontrados)[-1][0] <= cota2:
+                break
+            r += 1
+
+        resultado = []
+        for _, id_bus, slot in heapq.nsmallest(k, encontrados):
+            d = _distancia_km(lat, lon, lats[slot], lons[slot])
+            if radio_km is None or d <= radio_km:
+                resultado.append((d, id_bus, slot))
+        resultado.sort()
+        return resultado
+
+    def json_en_rectangulo(self, lat_min, lon_min, lat_max, lon_max, ahora):
+        """Arreglo JSON (texto) con los buses vigentes dentro del rectángulo"""
+        with self._lock:
+            dentro = self._en_rectangulo(lat_min, lon_min, lat_max, lon_max, ahora - self.ttl_segundos)
+            return "[" + ",".join(self._json_bus(id_bus, slot) for id_bus, slot in dentro) + "]"
+
+    def json_cercanos(self, lat, lon, k, ahora, radio_km=None):
+        """
+        Arreglo JSON (texto) con los k buses vigentes más cercanos al punto (opcionalmente
+        a menos de radio_km), ordenados por distancia y con "distancia_km" en cada bus.
+        """
+        with self._lock:
+            cercanos = self._cercanos(lat, lon, k, radio_km, ahora - self.ttl_segundos)
+            return "[" + ",".join(
+                '{"distancia_km":%s,%s' % (_numero_json(round(d, 3)), self._json_bus(id_bus, slot)[1:])
+                for d, id_bus, slot in cercanos
+            ) + "]"
+
+
+def _numero_json(valor):
+    """Número para el JSON armado a mano: NaN e infinito no son JSON válido y se escriben como null"""
+    return repr(valor) if math.isfinite(valor) else "null"
+
+
+def _distancia_km(lat1, lon1, lat2, lon2):
+    """Haversine (misma fórmula que distancia_haversine de server.py)"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
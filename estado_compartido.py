@@ -0,0 +1,613 @@
+"""
+Estado de los buses compartido entre procesos (varios workers en un mismo host).
+
+El estado vive en un archivo mapeado en memoria (por ejemplo en /dev/shm) con
+registros de tamaño fijo, uno por bus. Todos los workers escriben y leen ahí
+sin pasar por la red:
+
+    cabecera      magia, versión, capacidad, tamaño del anillo, secuencia, ...
+    registros     capacidad x REGISTRO (versión seqlock + campos del bus)
+    anillo        tam_anillo x CAMBIO (seq, registro, tipo, id_bus)
+    libres        capacidad x int32, pila de registros liberados
+    indice        tabla hash id_bus -> registro + 1 (0 vacío, -1 borrado)
+
+Escritura: bajo un candado de archivo (flock) se ubica o reserva el registro
+del bus, se escribe con el protocolo seqlock (versión impar mientras se
+escribe, par al terminar) y se agrega el cambio al anillo con la siguiente
+secuencia global. El emparejamiento con la ruta y el armado de los datos se
+hacen antes de tomar el candado, así que lo costoso corre en paralelo en
+cada proceso y el tramo serializado es de unos pocos microsegundos.
+
+Lectura: cada proceso mantiene un AlmacenBuses propio como réplica local (con
+sus índices por ruta, grilla, cubetas y JSON) y antes de cada consulta aplica
+los cambios del anillo posteriores a la última secuencia que vio, leyendo cada
+registro sin candado: si la versión cambió durante la lectura, la repite (una
+versión impar que no avanza es de un escritor que murió a mitad de escritura y
+se repara bajo el candado). Los
+números de secuencia son los globales, así que /api/buses?since= funciona
+aunque cada consulta la atienda otro worker. Si un proceso quedó más atrás
+que el anillo, reconstruye la réplica recorriendo los registros.
+
+Requiere un sistema POSIX (fcntl.flock). Con un solo proceso conviene usar
+AlmacenBuses directamente.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from estado_buses import AlmacenBuses, SIN_INDICE, SIN_MARCA
+
+MAGIA = b"RYBC"
+VERSION = 1
+CABECERA = struct.Struct("<4sB3xIIqIII")   # magia, versión, capacidad, tam_anillo, secuencia, usados, libres, borrados
+TAM_CABECERA = 64
+OFFSET_SECUENCIA = 16
+OFFSET_USADOS = 24
+
+VERSION_REGISTRO = struct.Struct("<Q")
+# seq, lat, lon, vel, timestamp, marca, km_ruta, ruta, ultima_parada, tramo, ocupado, sentido,
+# id_bus, empresa, estado, proxima_parada (textos en UTF-8 rellenos con ceros)
+DATOS_REGISTRO = struct.Struct("<q6d3iBb2x32s32s24s64s")
+TAM_REGISTRO = VERSION_REGISTRO.size + DATOS_REGISTRO.size
+LARGO_ID = 32
+LARGOS_TEXTO = {"empresa": 32, "estado": 24, "proxima_parada": 64}
+
+CAMBIO = struct.Struct("<qiB3x32s")   # seq, registro, tipo, id_bus
+ESCRITURA = 1
+ELIMINACION = 2
+
+# Segundos con la versión de un registro impar y sin cambios antes de suponer que su escritor murió
+ESPERA_ESCRITOR = 0.05
+
+INDICE_VACIO = 0
+INDICE_BORRADO = -1
+
+DTYPE_REGISTRO = np.dtype([
+    ("version", "<u8"), ("seq", "<i8"), ("lat", "<f8"), ("lon", "<f8"), ("vel", "<f8"), ("timestamp", "<f8"),
+    ("marca", "<f8"), ("km_ruta", "<f8"), ("ruta", "<i4"), ("ultima_parada", "<i4"), ("tramo", "<i4"),
+    ("ocupado", "u1"), ("sentido", "i1"), ("relleno", "V2"), ("id", "S32"), ("empresa", "S32"),
+    ("estado", "S24"), ("proxima_parada", "S64"),
+])
+assert DTYPE_REGISTRO.itemsize == TAM_REGISTRO
+
+
+def _a_bytes(texto, largo):
+    # None -> b""; textos más largos que el campo se recortan sin partir un carácter
+    if texto is None:
+        return b""
+    datos = str(texto).encode("utf-8")
+    if len(datos) > largo:
+        datos = datos[:largo].decode("utf-8", "ignore").encode("utf-8")
+    return datos
+
+
+def _a_texto(datos):
+    datos = datos.rstrip(b"\0")
+    return datos.decode("utf-8") if datos else None
+
+
+def _id_bytes(id_bus):
+    datos = str(id_bus).encode("utf-8")
+    if not datos or len(datos) > LARGO_ID:
+        raise ValueError(f"idBus vacío o de más de {LARGO_ID} bytes: {id_bus!r}")
+    return datos
+
+
+class AlmacenBusesCompartido:
+    def __init__(self, archivo, ttl_segundos=300, max_buses=50000, ancho_cubeta=10, max_eliminados=10000,
+                 celda_km=0.25, lat_ref=0.0, tam_anillo=None, al_replicar=None):
+        """
+        archivo: ruta del segmento compartido (se crea si no existe; mejor en /dev/shm)
+        max_buses: capacidad del segmento; al superarla se elimina el bus con el reporte más antiguo
+        tam_anillo: cambios recordados en el anillo (por defecto 4 x max_buses); un proceso que
+                    se atrasa más que esto reconstruye su réplica completa
+        al_replicar: función opcional que recibe el conjunto de (empresa, ruta) con cambios
+                     aplicados a la réplica local (p. ej. para marcar el tablero de llegadas)
+        Los demás parámetros son los de AlmacenBuses.
+        """
+        import fcntl   # solo POSIX
+        self._fcntl = fcntl
+        self.archivo = archivo
+        self.ttl_segundos = ttl_segundos
+        self.max_buses = max_buses
+        self.ancho_cubeta = ancho_cubeta
+        self.tam_anillo = tam_anillo or 4 * max_buses
+        self.al_replicar = al_replicar
+        self._opciones_replica = dict(ttl_segundos=ttl_segundos, max_buses=2 * max_buses, ancho_cubeta=ancho_cubeta,
+                                      max_eliminados=max_eliminados, celda_km=celda_km, lat_ref=lat_ref)
+
+        self._tam_indice = 1
+        while self._tam_indice < 2 * max_buses:
+            self._tam_indice *= 2
+        self._off_registros = TAM_CABECERA
+        self._off_anillo = self._off_registros + max_buses * TAM_REGISTRO
+        self._off_libres = self._off_anillo + self.tam_anillo * CAMBIO.size
+        self._off_indice = self._off_libres + max_buses * 4
+        tamano = self._off_indice + self._tam_indice * 4
+
+        self._fd = os.open(archivo, os.O_RDWR | os.O_CREAT, 0o600)
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            actual = os.fstat(self._fd).st_size
+            if actual == 0:
+                os.ftruncate(self._fd, tamano)
+                os.pwrite(self._fd, CABECERA.pack(MAGIA, VERSION, max_buses, self.tam_anillo, 0, 0, 0, 0), 0)
+            else:
+                magia, version, capacidad, anillo = CABECERA.unpack(os.pread(self._fd, CABECERA.size, 0))[:4]
+                if magia != MAGIA or version != VERSION:
+                    raise ValueError(f"{archivo} no es un segmento de buses compartido")
+                if (capacidad, anillo) != (max_buses, self.tam_anillo) or actual != tamano:
+                    raise ValueError(f"{archivo} se creó con capacidad {capacidad} y anillo {anillo}: "
+                                     f"borrarlo o usar la misma configuración en todos los workers")
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+        self._mm = mmap.mmap(self._fd, tamano)
+        vista = memoryview(self._mm)
+        self._libres = vista[self._off_libres:self._off_indice].cast("i")
+        self._indice = vista[self._off_indice:tamano].cast("i")
+        self._registros = np.frombuffer(self._mm, dtype=DTYPE_REGISTRO, count=max_buses, offset=self._off_registros)
+
+        self._lock_escritura = threading.Lock()
+        self._lock_sync = threading.Lock()
+        self._aplicada = 0
+        self._resincronizaciones = 0
+        self._expirados = 0
+        self._desalojados = 0
+        self._reparados = 0
+        self._hilos = {}   # { nombre: (función, intervalo) } para reiniciarlos tras un fork
+        self.replica = AlmacenBuses(**self._opciones_replica)
+        self._resincronizar()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._tras_fork)
+
+    def _tras_fork(self):
+        # Los flock son del descriptor abierto: cada proceso necesita el suyo. Los hilos no sobreviven al fork.
+        self._fd = os.open(self.archivo, os.O_RDWR)
+        self._lock_escritura = threading.Lock()
+        self._lock_sync = threading.Lock()
+        hilos, self._hilos = self._hilos, {}
+        for nombre, (funcion, intervalo) in hilos.items():
+            self._iniciar_hilo(nombre, funcion, intervalo)
+
+    # ------------------------------------------------------
+    # Segmento
+    # ------------------------------------------------------
+    def _bloquear(self):
+        self._lock_escritura.acquire()
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+
+    def _desbloquear(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+        self._lock_escritura.release()
+
+    def _cabecera(self):
+        return CABECERA.unpack_from(self._mm, 0)
+
+    def _secuencia(self):
+        return struct.unpack_from("<q", self._mm, OFFSET_SECUENCIA)[0]
+
+    def _offset(self, registro):
+        return self._off_registros + registro * TAM_REGISTRO
+
+    def _leer(self, registro, con_candado=False):
+        # Lectura seqlock: sin candado, se repite si un escritor modificó el registro mientras tanto.
+        # Una escritura dura microsegundos: una versión impar que no cambia en ESPERA_ESCRITOR es de un
+        # escritor que murió a mitad de escritura (su flock ya se liberó) y se repara con el candado tomado.
+        # con_candado: el llamador ya tiene el candado de escritura, así que una versión impar nunca avanzará
+        offset = self._offset(registro)
+        mm = self._mm
+        impar = None   # (versión impar vista, desde cuándo)
+        while True:
+            antes = VERSION_REGISTRO.unpack_from(mm, offset)[0]
+            if antes & 1:
+                if con_candado:
+                    return self._reparar(registro)
+                if impar is None or impar[0] != antes:
+                    impar = (antes, time.monotonic())
+                elif time.monotonic() - impar[1] > ESPERA_ESCRITOR:
+                    self._bloquear()
+                    try:
+                        return self._reparar(registro)
+                    finally:
+                        self._desbloquear()
+                time.sleep(0)
+                continue
+            datos = DATOS_REGISTRO.unpack_from(mm, offset + VERSION_REGISTRO.size)
+            if VERSION_REGISTRO.unpack_from(mm, offset)[0] == antes:
+                return datos
+
+    def _reparar(self, registro):
+        # Debe llamarse con el candado de escritura tomado: ningún escritor vivo está a mitad de escritura.
+        # Los datos quedan como los dejó el escritor muerto; el próximo reporte del bus los reemplaza.
+        offset = self._offset(registro)
+        version = VERSION_REGISTRO.unpack_from(self._mm, offset)[0]
+        if version & 1:
+            VERSION_REGISTRO.pack_into(self._mm, offset, version + 1)
+            self._reparados += 1
+        return DATOS_REGISTRO.unpack_from(self._mm, offset + VERSION_REGISTRO.size)
+
+    def _escribir_registro(self, registro, datos):
+        # Debe llamarse con el candado de escritura tomado. "| 1" deja la versión impar aunque un
+        # escritor anterior haya muerto con ella impar, y al terminar siempre queda par.
+        offset = self._offset(registro)
+        version = VERSION_REGISTRO.unpack_from(self._mm, offset)[0] | 1
+        VERSION_REGISTRO.pack_into(self._mm, offset, version)
+        DATOS_REGISTRO.pack_into(self._mm, offset + VERSION_REGISTRO.size, *datos)
+        VERSION_REGISTRO.pack_into(self._mm, offset, version + 1)
+
+    def _publicar(self, registro, tipo, datos):
+        # Debe llamarse con el candado de escritura tomado. Escribe el registro con la siguiente secuencia
+        # y después agrega el cambio al anillo: un lector que ve la entrada ya encuentra el registro escrito.
+        seq = self._secuencia() + 1
+        datos[0] = seq
+        self._escribir_registro(registro, datos)
+        CAMBIO.pack_into(self._mm, self._off_anillo + (seq % self.tam_anillo) * CAMBIO.size,
+                         seq, registro, tipo, datos[12])
+        struct.pack_into("<q", self._mm, OFFSET_SECUENCIA, seq)
+
+    def _buscar(self, id_b):
+        # Debe llamarse con el candado de escritura tomado.
+        # Retorna (registro o None, posición del índice donde está o donde insertarlo)
+        mascara = self._tam_indice - 1
+        posicion = zlib.crc32(id_b) & mascara
+        hueco = None
+        indice = self._indice
+        while True:
+            valor = indice[posicion]
+            if valor == INDICE_VACIO:
+                return None, posicion if hueco is None else hueco
+            if valor == INDICE_BORRADO:
+                if hueco is None:
+                    hueco = posicion
+            elif self._registros["id"][valor - 1] == id_b:
+                return valor - 1, posicion
+            posicion = (posicion + 1) & mascara
+
+    def _reservar(self):
+        # Debe llamarse con el candado de escritura tomado. Retorna un registro libre.
+        magia, version, capacidad, anillo, seq, usados, libres, borrados = self._cabecera()
+        if libres:
+            libres -= 1
+            struct.pack_into("<I", self._mm, OFFSET_USADOS + 4, libres)
+            return self._libres[libres]
+        if usados < capacidad:
+            struct.pack_into("<I", self._mm, OFFSET_USADOS, usados + 1)
+            return usados
+        # Lleno: se elimina el bus con el reporte más antiguo
+        registros = self._registros[:usados]
+        timestamps = np.where(registros["ocupado"] == 1, registros["timestamp"], np.inf)
+        self._eliminar_registro(int(np.argmin(timestamps)))
+        self._desalojados += 1
+        return self._reservar()
+
+    def _eliminar_registro(self, registro):
+        # Debe llamarse con el candado de escritura tomado
+        datos = list(self._leer(registro, con_candado=True))
+        datos[12] = datos[12].rstrip(b"\0")
+        _, posicion = self._buscar(datos[12])
+        self._indice[posicion] = INDICE_BORRADO
+        datos[10] = 0   # ocupado
+        self._publicar(registro, ELIMINACION, datos)
+
+        magia, version, capacidad, anillo, seq, usados, libres, borrados = self._cabecera()
+        self._libres[libres] = registro
+        borrados += 1
+        struct.pack_into("<II", self._mm, OFFSET_USADOS + 4, libres + 1, borrados)
+        if borrados > capacidad // 2:
+            self._reconstruir_indice(usados)
+
+    def _reconstruir_indice(self, usados):
+        # Debe llamarse con el candado de escritura tomado: elimina las marcas de borrado del índice
+        indice = self._indice
+        for posicion in range(self._tam_indice):
+            indice[posicion] = INDICE_VACIO
+        mascara = self._tam_indice - 1
+        for registro in np.flatnonzero(self._registros["ocupado"][:usados] == 1):
+            posicion = zlib.crc32(self._registros["id"][registro]) & mascara
+            while indice[posicion] != INDICE_VACIO:
+                posicion = (posicion + 1) & mascara
+            indice[posicion] = int(registro) + 1
+        struct.pack_into("<I", self._mm, OFFSET_USADOS + 8, 0)
+
+    # ------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------
+    def _emparejar(self, emparejador, id_bus, empresa, ruta, lat, lon):
+        # Fuera del candado: el cursor del bus se toma de la réplica local (solo acota la búsqueda)
+        if emparejador is None:
+            return None
+        previo = self.replica.cursor(id_bus)
+        if previo is None or previo[0] != empresa or previo[1] != ruta:
+            return emparejador.emparejar_bus(empresa, ruta, lat, lon, SIN_INDICE, math.nan, 0)
+        return emparejador.emparejar_bus(empresa, ruta, lat, lon, *previo[2:])
+
+    def _datos(self, id_b, empresa, ruta, lat, lon, vel, timestamp, ultima_parada_index, estado, proxima_parada,
+               emparejado):
+        if emparejado is None:
+            tramo, km_ruta, sentido = SIN_INDICE, math.nan, 0
+        else:
+            tramo, km_ruta, sentido, parada = emparejado
+            if ultima_parada_index is None:
+                ultima_parada_index = parada
+        return [0, lat, lon, vel, timestamp, SIN_MARCA, km_ruta, ruta,
+                SIN_INDICE if ultima_parada_index is None else ultima_parada_index, tramo, 1, sentido, id_b,
+                _a_bytes(empresa, LARGOS_TEXTO["empresa"]), _a_bytes(estado, LARGOS_TEXTO["estado"]),
+                _a_bytes(proxima_parada, LARGOS_TEXTO["proxima_parada"])]
+
+    def _guardar(self, datos, marca):
+        # Debe llamarse con el candado de escritura tomado. Retorna False si la marca es repetida.
+        id_b = datos[12]
+        registro, posicion = self._buscar(id_b)
+        if registro is None:
+            registro = self._reservar()
+            _, posicion = self._buscar(id_b)   # el desalojo pudo cambiar el índice
+            if self._indice[posicion] == INDICE_BORRADO:
+                struct.pack_into("<I", self._mm, OFFSET_USADOS + 8, self._cabecera()[7] - 1)
+            self._indice[posicion] = registro + 1
+        else:
+            anterior = self._registros["marca"][registro]
+            if marca is not None and marca <= anterior:
+                return False
+            datos[5] = anterior
+        if marca is not None:
+            datos[5] = marca
+        self._publicar(registro, ESCRITURA, datos)
+        return True
+
+    def actualizar(self, id_bus, empresa, ruta, lat, lon, vel, timestamp,
+                   ultima_parada_index=None, estado=None, proxima_parada=None, emparejador=None):
+        """Igual que AlmacenBuses.actualizar"""
+        emparejado = self._emparejar(emparejador, id_bus, empresa, ruta, lat, lon)
+        datos = self._datos(_id_bytes(id_bus), empresa, ruta, lat, lon, vel, timestamp,
+                            ultima_parada_index, estado, proxima_parada, emparejado)
+        self._bloquear()
+        try:
+            self._guardar(datos, None)
+        finally:
+            self._desbloquear()
+
+    def actualizar_lote(self, reportes, timestamp, emparejador=None):
+        """Igual que AlmacenBuses.actualizar_lote (la marca repetida se controla contra el segmento)"""
+        preparados = [
+            (self._datos(_id_bytes(id_bus), empresa, ruta, lat, lon, vel, timestamp, None, None, None,
+                         self._emparejar(emparejador, id_bus, empresa, ruta, lat, lon)), marca)
+            for id_bus, empresa, ruta, lat, lon, vel, marca in reportes
+        ]
+        self._bloquear()
+        try:
+            return [self._guardar(datos, marca) for datos, marca in preparados]
+        finally:
+            self._desbloquear()
+
+    def modificar(self, id_bus, **campos):
+        """Igual que AlmacenBuses.modificar"""
+        posiciones = {"lat": 1, "lon": 2, "vel": 3, "timestamp": 4, "ruta": 7, "ultima_parada_index": 8}
+        id_b = _id_bytes(id_bus)
+        self._bloquear()
+        try:
+            registro, _ = self._buscar(id_b)
+            if registro is None:
+                return False
+            datos = list(self._leer(registro, con_candado=True))
+            for campo, valor in campos.items():
+                if campo in LARGOS_TEXTO:
+                    datos[{"empresa": 13, "estado": 14, "proxima_parada": 15}[campo]] = \
+                        _a_bytes(valor, LARGOS_TEXTO[campo])
+                elif campo == "ultima_parada_index":
+                    datos[8] = SIN_INDICE if valor is None else valor
+                else:
+                    datos[posiciones[campo]] = valor
+            datos[12] = id_b
+            self._publicar(registro, ESCRITURA, datos)
+            return True
+        finally:
+            self._desbloquear()
+
+    def eliminar(self, id_bus):
+        """Quita un bus. Retorna False si no existía."""
+        self._bloquear()
+        try:
+            registro, _ = self._buscar(_id_bytes(id_bus))
+            if registro is None:
+                return False
+            self._eliminar_registro(registro)
+            return True
+        finally:
+            self._desbloquear()
+
+    def limpiar(self):
+        self._bloquear()
+        try:
+            usados = self._cabecera()[5]
+            for registro in np.flatnonzero(self._registros["ocupado"][:usados] == 1):
+                self._eliminar_registro(int(registro))
+        finally:
+            self._desbloquear()
+
+    # ------------------------------------------------------
+    # Expiración
+    # ------------------------------------------------------
+    def expirar(self, ahora=None):
+        """Elimina del segmento los buses sin reportes en ttl_segundos. Retorna la lista de ids eliminados."""
+        if ahora is None:
+            ahora = time.time()
+        eliminados = []
+        self._bloquear()
+        try:
+            usados = self._cabecera()[5]
+            registros = self._registros[:usados]
+            vencidos = np.flatnonzero((registros["ocupado"] == 1) & (registros["timestamp"] <= ahora - self.ttl_segundos))
+            for registro in vencidos:
+                eliminados.append(_a_texto(registros["id"][registro]))
+                self._eliminar_registro(int(registro))
+            self._expirados += len(eliminados)
+        finally:
+            self._desbloquear()
+        return eliminados
+
+    def _iniciar_hilo(self, nombre, funcion, intervalo):
+        def ciclo():
+            while True:
+                time.sleep(intervalo)
+                funcion()
+
+        self._hilos[nombre] = (funcion, intervalo)
+        threading.Thread(target=ciclo, name=nombre, daemon=True).start()
+
+    def iniciar_expiracion(self, intervalo=None, al_expirar=None):
+        """Como AlmacenBuses.iniciar_expiracion; cualquier worker puede expirar (lo hace bajo el candado)"""
+        if "buses-expiracion" in self._hilos:
+            return
+
+        def expirar():
+            eliminados = self.expirar()
+            if eliminados and al_expirar is not None:
+                al_expirar(eliminados)
+
+        self._iniciar_hilo("buses-expiracion", expirar, intervalo or self.ancho_cubeta)
+
+    def iniciar_replicacion(self, intervalo=0.1):
+        """
+        Inicia un hilo que aplica a la réplica local los cambios de los otros procesos cada
+        `intervalo` segundos, para que al_replicar se entere aunque este proceso no reciba consultas.
+        """
+        if "buses-replicacion" not in self._hilos:
+            self._iniciar_hilo("buses-replicacion", self.sincronizar, intervalo)
+
+    # ------------------------------------------------------
+    # Réplica local
+    # ------------------------------------------------------
+    def _registro_replica(self, datos):
+        (_, lat, lon, vel, timestamp, _, km_ruta, ruta, ultima, tramo, _, sentido, _,
+         empresa, estado, proxima_parada) = datos
+        emparejado = None if tramo == SIN_INDICE else (tramo, km_ruta, sentido, ultima)
+        return (_a_texto(empresa), ruta, lat, lon, vel, timestamp, None if ultima == SIN_INDICE else ultima,
+                _a_texto(estado), _a_texto(proxima_parada), emparejado)
+
+    def sincronizar(self):
+        """Aplica a la réplica local los cambios publicados desde la última sincronización"""
+        rutas = None
+        with self._lock_sync:
+            cabeza = self._secuencia()
+            if cabeza == self._aplicada:
+                return
+            desde = self._aplicada + 1
+            if cabeza - desde >= self.tam_anillo:
+                rutas = self._resincronizar()
+            else:
+                entradas = [
+                    CAMBIO.unpack_from(self._mm, self._off_anillo + (seq % self.tam_anillo) * CAMBIO.size)
+                    for seq in range(desde, cabeza + 1)
+                ]
+                # Si mientras se leía el anillo un escritor dio la vuelta, algunas entradas pueden estar pisadas
+                if self._secuencia() - desde >= self.tam_anillo:
+                    rutas = self._resincronizar()
+                else:
+                    cambios = []
+                    for seq, registro, tipo, id_b in entradas:
+                        id_bus = _a_texto(id_b)
+                        if tipo == ELIMINACION:
+                            cambios.append((seq, id_bus, None))
+                            continue
+                        datos = self._leer(registro)
+                        # Si el registro ya cambió, su entrada más nueva viene después en el anillo
+                        if datos[0] == seq and datos[12].rstrip(b"\0") == id_b.rstrip(b"\0"):
+                            cambios.append((seq, id_bus, self._registro_replica(datos)))
+                    rutas = self.replica.replicar(cambios, cabeza)
+                    self._aplicada = cabeza
+        if rutas and self.al_replicar is not None:
+            self.al_replicar(rutas)
+
+    def _resincronizar(self):
+        # Debe llamarse con self._lock_sync tomado: reconstruye la réplica desde los registros
+        cabeza = self._secuencia()
+        usados = self._cabecera()[5]
+        cambios = []
+        for registro in range(usados):
+            datos = self._leer(registro)
+            if datos[10]:
+                cambios.append((datos[0], _a_texto(datos[12]), self._registro_replica(datos)))
+        cambios.sort(key=lambda cambio: cambio[0])
+        replica = AlmacenBuses(**self._opciones_replica)
+        rutas = replica.replicar(cambios, cabeza, completo=True)
+        self.replica = replica
+        self._aplicada = cabeza
+        self._resincronizaciones += 1
+        return rutas
+
+    # ------------------------------------------------------
+    # Lectura (réplica local al día)
+    # ------------------------------------------------------
+    @property
+    def secuencia(self):
+        self.sincronizar()
+        return self.replica.secuencia
+
+    def __len__(self):
+        self.sincronizar()
+        return len(self.replica)
+
+    def __contains__(self, id_bus):
+        self.sincronizar()
+        return id_bus in self.replica
+
+    def ids(self):
+        self.sincronizar()
+        return self.replica.ids()
+
+    def texto(self, codigo):
+        return self.replica.texto(codigo)
+
+    def obtener(self, id_bus):
+        self.sincronizar()
+        return self.replica.obtener(id_bus)
+
+    def buses_en_ruta(self, empresa, ruta):
+        self.sincronizar()
+        return self.replica.buses_en_ruta(empresa, ruta)
+
+    def json_activos(self, ahora, ttl_segundos=None):
+        self.sincronizar()
+        return self.replica.json_activos(ahora, ttl_segundos)
+
+    def json_cambios(self, desde, ahora):
+        self.sincronizar()
+        return self.replica.json_cambios(desde, ahora)
+
+    def cambios(self, desde, ahora):
+        self.sincronizar()
+        return self.replica.cambios(desde, ahora)
+
+    def json_en_rectangulo(self, lat_min, lon_min, lat_max, lon_max, ahora):
+        self.sincronizar()
+        return self.replica.json_en_rectangulo(lat_min, lon_min, lat_max, lon_max, ahora)
+
+    def json_cercanos(self, lat, lon, k, ahora, radio_km=None):
+        self.sincronizar()
+        return self.replica.json_cercanos(lat, lon, k, ahora, radio_km)
+
+    def estadisticas(self):
+        self.sincronizar()
+        datos = self.replica.estadisticas()
+        magia, version, capacidad, anillo, seq, usados, libres, borrados = self._cabecera()
+        datos.update({
+            "max_buses": capacidad,
+            "expirados": self._expirados,
+            "desalojados_por_capacidad": self._desalojados,
+            "compartido": {
+                "archivo": self.archivo,
+                "pid": os.getpid(),
+                "registros_usados": usados - libres,
+                "tam_anillo": anillo,
+                "resincronizaciones": self._resincronizaciones,
+                "registros_reparados": self._reparados
+            }
+        })
+        return datos
@@ -0,0 +1,136 @@
+"""
+Estimación estática de muchos pares origen/destino en una sola pasada NumPy.
+
+Las paradas de todas las rutas se guardan en matrices (rutas x paradas),
+rellenando las rutas cortas. Para un bloque de N pares se calcula haversine
+contra todas las paradas a la vez, se toma la parada más cercana de cada ruta
+y la distancia sobre la ruta sale de la tabla acumulada de cada una (TablaRuta).
+Reproduce las reglas del método estático de /api/estimate-route.
+"""
+import numpy as np
+
+RADIO_TIERRA_KM = 6371
+
+# Elementos (pares x rutas x paradas) procesados por bloque, acota la memoria
+ELEMENTOS_POR_BLOQUE = 1 << 21
+
+
+def distancia_haversine_np(lat1, lon1, lat2, lon2):
+    """Versión vectorizada de distancia_haversine (grados -> km), admite broadcasting"""
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) ** 2
+    return RADIO_TIERRA_KM * 2 * np.arcsin(np.sqrt(a))
+
+
+class EstimadorLote:
+    def __init__(self, rutas, tablas, radio_km=1.0, velocidad_kmh=20.0, minutos_por_parada=2):
+        """
+        rutas: { empresa: { numeroRuta: [paradas] } } (mismo formato que RUTAS_DATABASE)
+        tablas: { (empresa, numeroRuta): TablaRuta }
+        """
+        self.radio_km = radio_km
+        self.velocidad_kmh = velocidad_kmh
+        self.minutos_por_parada = minutos_por_parada
+
+        self.rutas = []      # [(empresa, numeroRuta)]
+        self.paradas = []    # [[parada]] por ruta
+        for empresa, rutas_dict in rutas.items():
+            for num, paradas in rutas_dict.items():
+                if paradas:
+                    self.rutas.append((empresa, num))
+                    self.paradas.append(paradas)
+        self.posicion = {clave: i for i, clave in enumerate(self.rutas)}
+
+        n_rutas = len(self.rutas)
+        n_max = max((len(p) for p in self.paradas), default=1)
+        self.lat = np.zeros((n_rutas, n_max))
+        self.lon = np.zeros((n_rutas, n_max))
+        self.orden = np.zeros((n_rutas, n_max), dtype=np.int64)
+        self.acumulado_km = np.zeros((n_rutas, n_max))
+        self.relleno = np.ones((n_rutas, n_max), dtype=bool)
+        for r, paradas in enumerate(self.paradas):
+            n = len(paradas)
+            self.lat[r, :n] = [p['lat'] for p in paradas]
+            self.lon[r, :n] = [p['lon'] for p in paradas]
+            self.orden[r, :n] = [p['orden'] for p in paradas]
+            self.relleno[r, :n] = False
+            self.acumulado_km[r, :n] = tablas[self.rutas[r]].acumulado_km
+
+        self.filas_por_bloque = max(1, ELEMENTOS_POR_BLOQUE // max(1, n_rutas * n_max))
+
+    def _mas_cercanas(self, lat, lon):
+        """Para N puntos: (distancia, columna) de la parada más cercana de cada ruta, matrices N x rutas"""
+        d = distancia_haversine_np(lat[:, None, None], lon[:, None, None], self.lat[None], self.lon[None])
+        d[:, self.relleno] = np.inf
+        col = d.argmin(axis=2)
+        return np.take_along_axis(d, col[:, :, None], axis=2)[:, :, 0], col
+
+    def estimar(self, origen_lat, origen_lon, destino_lat, destino_lon, ruta_fija=None):
+        """
+        Estima un lote de pares. Los argumentos son secuencias de igual largo N.
+        ruta_fija: secuencia de índices de ruta (posicion[(empresa, num)]) o -1 para buscar la mejor.
+        Retorna una lista de N tuplas:
+            (True, empresa, numeroRuta, paradaOrigen, paradaDestino, distancia_km, tiempo_minutos)
+            (False, codigo_http, mensaje)
+        """
+        resultados = []
+        n = len(origen_lat)
+        for inicio in range(0, n, self.filas_por_bloque):
+            fin = min(n, inicio + self.filas_por_bloque)
+            fija = None if ruta_fija is None else np.asarray(ruta_fija[inicio:fin], dtype=np.int64)
+            resultados.extend(self._estimar_bloque(
+                np.asarray(origen_lat[inicio:fin], dtype=float), np.asarray(origen_lon[inicio:fin], dtype=float),
+                np.asarray(destino_lat[inicio:fin], dtype=float), np.asarray(destino_lon[inicio:fin], dtype=float),
+                fija
+            ))
+        return resultados
+
+    def _estimar_bloque(self, o_lat, o_lon, d_lat, d_lon, fija):
+        n = len(o_lat)
+        if not self.rutas:
+            return [(False, 404, "No se encontró una ruta válida cerca de los puntos seleccionados")] * n
+
+        dist_o, col_o = self._mas_cercanas(o_lat, o_lon)
+        dist_d, col_d = self._mas_cercanas(d_lat, d_lon)
+        filas_ruta = np.arange(len(self.rutas))[None, :]
+        orden_o = self.orden[filas_ruta, col_o]
+        orden_d = self.orden[filas_ruta, col_d]
+        # calcular_distancia_entre_paradas indexa por orden (paradas[orden - 1])
+        km = self.acumulado_km[filas_ruta, orden_d - 1] - self.acumulado_km[filas_ruta, orden_o - 1]
+
+        cerca = (dist_o <= self.radio_km) & (dist_d <= self.radio_km)
+        valida = cerca & (orden_o <= orden_d)
+        mejor = np.where(valida, km, np.inf).argmin(axis=1)
+        if fija is None:
+            fija = np.full(n, -1)
+        ruta = np.where(fija >= 0, fija, mejor)
+
+        filas = np.arange(n)
+        km_sel = km[filas, ruta]
+        o_sel = orden_o[filas, ruta]
+        d_sel = orden_d[filas, ruta]
+        tiempo = np.rint(km_sel / self.velocidad_kmh * 60.0 + np.abs(d_sel - o_sel) * self.minutos_por_parada)
+        cerca_sel = cerca[filas, ruta]
+        valida_sel = valida[filas, ruta]
+        col_o_sel = col_o[filas, ruta]
+        col_d_sel = col_d[filas, ruta]
+
+        resultados = []
+        for i in range(n):
+            r = int(ruta[i])
+            if not valida_sel[i]:
+                if fija[i] < 0:
+                    resultados.append((False, 404, "No se encontró una ruta válida cerca de los puntos seleccionados"))
+                elif not cerca_sel[i]:
+                    resultados.append((False, 400, "Los puntos están muy lejos de la ruta"))
+                else:
+                    resultados.append((False, 400, "El orden de paradas sugiere que el destino está antes que el origen en la ruta"))
+                continue
+            empresa, num = self.rutas[r]
+            paradas = self.paradas[r]
+            resultados.append((
+                True, empresa, num, paradas[col_o_sel[i]], paradas[col_d_sel[i]],
+                float(km_sel[i]), int(tiempo[i])
+            ))
+        return resultados
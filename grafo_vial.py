@@ -0,0 +1,218 @@
+"""
+Grafo vial compacto para el ruteo local (ver ruteo_local.py).
+
+El grafo se guarda como arreglos de adyacencia (formato CSR): las aristas que
+salen del nodo n son las posiciones inicio[n] .. inicio[n + 1] - 1 de los
+arreglos de aristas. Los nodos son solo cruces y extremos de vías; los puntos
+intermedios de cada vía se guardan aparte como la forma de la arista, para
+devolver la geometría sin agrandar la búsqueda.
+
+Archivo (little-endian):
+
+    cabecera      <4sBxxxIII  magia b"RYGV", versión, nodos, aristas, puntos de forma
+    lat, lon      float32 x nodos
+    inicio        uint32 x (nodos + 1)
+    destino       uint32 x aristas
+    metros        float32 x aristas
+    segundos      float32 x aristas
+    forma_inicio  uint32 x (aristas + 1)
+    forma_lat     float32 x puntos
+    forma_lon     float32 x puntos
+
+En Popayán el paso de float32 es de ~2,6 cm en la latitud (2,4°) y de ~0,85 m
+en la longitud (-76,6°); el error de redondeo es la mitad, menor que el de un
+GPS y que el ancho de una calle.
+
+Conversión desde un extracto OSM en XML (por ejemplo exportado de
+openstreetmap.org o convertido con ``osmium cat popayan.pbf -o popayan.osm``):
+
+    python grafo_vial.py popayan.osm grafo_popayan.bin
+"""
+import math
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+
+MAGIA = b"RYGV"
+VERSION = 1
+CABECERA = struct.Struct("<4sBxxxIII")
+
+# Velocidad (km/h) por tipo de vía cuando el OSM no trae maxspeed
+VELOCIDADES_KMH = {
+    "motorway": 80, "trunk": 60, "primary": 50, "secondary": 40, "tertiary": 35,
+    "motorway_link": 50, "trunk_link": 40, "primary_link": 35, "secondary_link": 30, "tertiary_link": 30,
+    "unclassified": 30, "residential": 25, "living_street": 10, "service": 15,
+}
+
+
+def _distancia_m(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 6371000 * 2 * math.asin(math.sqrt(a))
+
+
+class GrafoVial:
+    def __init__(self, lat, lon, inicio, destino, metros, segundos, forma_inicio, forma_lat, forma_lon):
+        """Arreglos ya en formato CSR (ver el docstring del módulo); se guardan como listas"""
+        self.lat = list(lat)
+        self.lon = list(lon)
+        self.inicio = list(inicio)
+        self.destino = list(destino)
+        self.metros = list(metros)
+        self.segundos = list(segundos)
+        self.forma_inicio = list(forma_inicio)
+        self.forma_lat = list(forma_lat)
+        self.forma_lon = list(forma_lon)
+
+    @property
+    def num_nodos(self):
+        return len(self.lat)
+
+    @property
+    def num_aristas(self):
+        return len(self.destino)
+
+    # ------------------------------------------------------
+    # Construcción
+    # ------------------------------------------------------
+    @classmethod
+    def desde_aristas(cls, nodos, aristas):
+        """
+        nodos: [(lat, lon)]
+        aristas: [(origen, destino, metros, segundos, [(lat, lon) intermedios])] dirigidas
+        """
+        aristas = sorted(aristas, key=lambda a: a[0])
+        inicio = [0] * (len(nodos) + 1)
+        for arista in aristas:
+            inicio[arista[0] + 1] += 1
+        for n in range(len(nodos)):
+            inicio[n + 1] += inicio[n]
+        forma_inicio = [0]
+        forma_lat = []
+        forma_lon = []
+        for arista in aristas:
+            for lat, lon in arista[4]:
+                forma_lat.append(lat)
+                forma_lon.append(lon)
+            forma_inicio.append(len(forma_lat))
+        return cls(
+            [n[0] for n in nodos], [n[1] for n in nodos], inicio,
+            [a[1] for a in aristas], [a[2] for a in aristas], [a[3] for a in aristas],
+            forma_inicio, forma_lat, forma_lon
+        )
+
+    @classmethod
+    def desde_osm_xml(cls, archivo, velocidades_kmh=None):
+        """
+        Construye el grafo de un extracto OSM en XML. Solo usa las vías con highway
+        de velocidades_kmh; respeta oneway (yes/1/true/-1 y rotondas) y maxspeed numérico.
+        """
+        velocidades_kmh = velocidades_kmh or VELOCIDADES_KMH
+        coordenadas = {}   # { id_osm: (lat, lon) }
+        vias = []          # [(ids_osm, sentido, km/h)] sentido: 1, -1 o 0 (doble)
+        for _, elemento in ET.iterparse(archivo, events=("end",)):
+            if elemento.tag == "node":
+                coordenadas[elemento.get("id")] = (float(elemento.get("lat")), float(elemento.get("lon")))
+                elemento.clear()
+            elif elemento.tag == "way":
+                etiquetas = {t.get("k"): t.get("v") for t in elemento.iter("tag")}
+                tipo = etiquetas.get("highway")
+                if tipo in velocidades_kmh:
+                    oneway = etiquetas.get("oneway", "")
+                    if oneway in ("yes", "1", "true") or etiquetas.get("junction") == "roundabout":
+                        sentido = 1
+                    elif oneway == "-1":
+                        sentido = -1
+                    else:
+                        sentido = 0
+                    try:
+                        kmh = float(etiquetas.get("maxspeed", "").split()[0])
+                    except (ValueError, IndexError):
+                        kmh = velocidades_kmh[tipo]
+                    vias.append(([nd.get("ref") for nd in elemento.iter("nd")], sentido, kmh))
+                elemento.clear()
+
+        # Un punto es nodo del grafo si es extremo de una vía o lo comparten varias
+        usos = {}
+        for ids, _, _ in vias:
+            for id_osm in ids:
+                usos[id_osm] = usos.get(id_osm, 0) + 1
+        indices = {}
+        nodos = []
+        aristas = []
+        for ids, sentido, kmh in vias:
+            ids = [i for i in ids if i in coordenadas]
+            if len(ids) < 2:
+                continue
+            tramo = [ids[0]]
+            for posicion, id_osm in enumerate(ids[1:], 1):
+                tramo.append(id_osm)
+                if usos[id_osm] < 2 and posicion < len(ids) - 1:
+                    continue
+                extremos = []
+                for extremo in (tramo[0], tramo[-1]):
+                    if extremo not in indices:
+                        indices[extremo] = len(nodos)
+                        nodos.append(coordenadas[extremo])
+                    extremos.append(indices[extremo])
+                puntos = [coordenadas[i] for i in tramo]
+                metros = sum(_distancia_m(*p1, *p2) for p1, p2 in zip(puntos, puntos[1:]))
+                segundos = metros / (kmh / 3.6)
+                if sentido >= 0:
+                    aristas.append((extremos[0], extremos[1], metros, segundos, puntos[1:-1]))
+                if sentido <= 0:
+                    aristas.append((extremos[1], extremos[0], metros, segundos, puntos[-2:0:-1]))
+                tramo = [id_osm]
+        return cls.desde_aristas(nodos, aristas)
+
+    # ------------------------------------------------------
+    # Archivo
+    # ------------------------------------------------------
+    def guardar(self, archivo):
+        with open(archivo, "wb") as f:
+            f.write(CABECERA.pack(MAGIA, VERSION, self.num_nodos, self.num_aristas, len(self.forma_lat)))
+            for tipo, valores in (("f", self.lat), ("f", self.lon), ("I", self.inicio), ("I", self.destino),
+                                  ("f", self.metros), ("f", self.segundos), ("I", self.forma_inicio),
+                                  ("f", self.forma_lat), ("f", self.forma_lon)):
+                arreglo = array(tipo, valores)
+                if sys.byteorder != "little":
+                    arreglo.byteswap()
+                arreglo.tofile(f)
+
+    @classmethod
+    def cargar(cls, archivo):
+        """Lee un grafo guardado con guardar(). Lanza ValueError si el archivo no es válido."""
+        with open(archivo, "rb") as f:
+            datos = f.read()
+        if len(datos) < CABECERA.size:
+            raise ValueError("Archivo de grafo incompleto")
+        magia, version, nodos, aristas, puntos = CABECERA.unpack_from(datos)
+        if magia != MAGIA or version != VERSION:
+            raise ValueError("Formato de grafo desconocido")
+
+        posicion = CABECERA.size
+        arreglos = []
+        for tipo, cantidad in (("f", nodos), ("f", nodos), ("I", nodos + 1), ("I", aristas), ("f", aristas),
+                               ("f", aristas), ("I", aristas + 1), ("f", puntos), ("f", puntos)):
+            arreglo = array(tipo)
+            largo = cantidad * arreglo.itemsize
+            if posicion + largo > len(datos):
+                raise ValueError("Archivo de grafo truncado")
+            arreglo.frombytes(datos[posicion:posicion + largo])
+            if sys.byteorder != "little":
+                arreglo.byteswap()
+            # float32 -> 6 decimales (~10 cm), para no devolver coordenadas como -76.61100006103516
+            arreglos.append([round(v, 6) for v in arreglo] if tipo == "f" else arreglo)
+            posicion += largo
+        return cls(*arreglos)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Uso: python grafo_vial.py extracto.osm grafo.bin")
+        sys.exit(1)
+    grafo = GrafoVial.desde_osm_xml(sys.argv[1])
+    grafo.guardar(sys.argv[2])
+    print(f"Grafo guardado en {sys.argv[2]}: {grafo.num_nodos} nodos, {grafo.num_aristas} aristas")
@@ -0,0 +1,87 @@
+"""
+Índice espacial (grilla) sobre todas las paradas de RUTAS_DATABASE.
+
+Cada parada se ubica en una celda de ``celda_km`` de lado. Una consulta por
+radio solo revisa las celdas que cubren el círculo buscado, en lugar de
+calcular haversine contra todas las paradas de todas las rutas.
+"""
+import math
+
+KM_POR_GRADO = 111.195  # km por grado de latitud (R = 6371 km)
+
+
+class IndiceParadas:
+    def __init__(self, rutas, distancia, celda_km=0.5):
+        """
+        rutas: { empresa: { numeroRuta: [paradas] } } (mismo formato que RUTAS_DATABASE)
+        distancia: función (lat1, lon1, lat2, lon2) -> km
+        celda_km: lado de la celda de la grilla
+        """
+        self._distancia = distancia
+        self._celdas = {}    # { (fila, col): [(lat, lon, idx_ruta, empresa, numeroRuta, parada)] }
+        self.rutas = []      # [(empresa, numeroRuta)] en orden de carga
+        self.total_paradas = 0
+
+        lats = [p['lat'] for rutas_dict in rutas.values() for paradas in rutas_dict.values() for p in paradas]
+        lat_ref = sum(lats) / len(lats) if lats else 0.0
+        self._celda_lat = celda_km / KM_POR_GRADO
+        self._celda_lon = celda_km / (KM_POR_GRADO * max(math.cos(math.radians(lat_ref)), 0.01))
+        self._cos_ref = math.cos(math.radians(lat_ref))
+
+        for empresa, rutas_dict in rutas.items():
+            for num, paradas in rutas_dict.items():
+                idx_ruta = len(self.rutas)
+                self.rutas.append((empresa, num))
+                for parada in paradas:
+                    celda = self._celda(parada['lat'], parada['lon'])
+                    self._celdas.setdefault(celda, []).append(
+                        (parada['lat'], parada['lon'], idx_ruta, empresa, num, parada)
+                    )
+                    self.total_paradas += 1
+
+    def _celda(self, lat, lon):
+        return (int(math.floor(lat / self._celda_lat)), int(math.floor(lon / self._celda_lon)))
+
+    def _candidatas(self, lat, lon, radio_km):
+        # Margen extra en longitud por si la consulta está lejos de la latitud de referencia
+        dlat = radio_km / KM_POR_GRADO
+        dlon = radio_km / (KM_POR_GRADO * max(min(self._cos_ref, math.cos(math.radians(lat))), 0.01))
+        f0, c0 = self._celda(lat - dlat, lon - dlon)
+        f1, c1 = self._celda(lat + dlat, lon + dlon)
+        celdas = self._celdas
+        for fila in range(f0, f1 + 1):
+            for col in range(c0, c1 + 1):
+                entradas = celdas.get((fila, col))
+                if entradas:
+                    yield from entradas
+
+    def paradas_cercanas(self, lat, lon, radio_km):
+        """
+        Todas las paradas a menos de radio_km del punto.
+        Retorna: lista de (distancia_km, empresa, numeroRuta, parada) ordenada por distancia
+        """
+        resultado = []
+        for p_lat, p_lon, idx_ruta, empresa, num, parada in self._candidatas(lat, lon, radio_km):
+            d = self._distancia(lat, lon, p_lat, p_lon)
+            if d <= radio_km:
+                resultado.append((d, idx_ruta, parada['orden'], empresa, num, parada))
+        resultado.sort(key=lambda x: x[:3])
+        return [(d, empresa, num, parada) for d, _, _, empresa, num, parada in resultado]
+
+    def mas_cercana_por_ruta(self, lat, lon, radio_km):
+        """
+        Parada más cercana de cada ruta que tenga alguna parada a menos de radio_km.
+        Retorna: { (empresa, numeroRuta): (distancia_km, parada) } en el orden de carga de las rutas
+        """
+        mejores = {}   # { idx_ruta: (distancia, orden, parada) }
+        for p_lat, p_lon, idx_ruta, _, _, parada in self._candidatas(lat, lon, radio_km):
+            d = self._distancia(lat, lon, p_lat, p_lon)
+            if d > radio_km:
+                continue
+            actual = mejores.get(idx_ruta)
+            if actual is None or (d, parada['orden']) < actual[:2]:
+                mejores[idx_ruta] = (d, parada['orden'], parada)
+        return {
+            self.rutas[idx]: (mejores[idx][0], mejores[idx][2])
+            for idx in sorted(mejores)
+        }
@@ -0,0 +1,223 @@
+"""
+Métricas en el formato de texto de Prometheus (contadores, histogramas de
+buckets fijos y medidores), pensadas para dejarse en los caminos calientes.
+
+Registrar un valor no toma locks: cada hilo suma en su propio fragmento
+(un dict guardado en un threading.local) y solo el primer registro de un
+hilo toma el lock del registro para anotar el fragmento. Al exponer
+(GET /metrics) se suman los fragmentos de todos los hilos; los de hilos ya
+terminados se pliegan en un acumulado para que los servidores que crean un
+hilo por petición no dejen fragmentos sueltos.
+
+Los medidores no se registran: se calculan con una función al exponer
+(tamaño del almacén de buses, estado del cortocircuito, ...).
+
+Cada proceso tiene sus propias métricas: con varios workers cada uno expone
+las suyas.
+"""
+import bisect
+import math
+import threading
+
+# Límites de los buckets de latencia en segundos (de 0.5 ms a 10 s)
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _numero(valor):
+    if isinstance(valor, float):
+        if math.isinf(valor):
+            return "+Inf" if valor > 0 else "-Inf"
+        if math.isnan(valor):
+            return "NaN"
+        return repr(valor)
+    return str(int(valor))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=None):
+    partes = ['%s="%s"' % (n, _escapar(v)) for n, v in zip(nombres, valores)]
+    if extra is not None:
+        partes.append('%s="%s"' % extra)
+    return "{%s}" % ",".join(partes) if partes else ""
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, registro, nombre, ayuda, etiquetas):
+        self._registro = registro
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+
+    def _cabecera(self):
+        return ["# HELP %s %s" % (self.nombre, self.ayuda.replace("\\", "\\\\").replace("\n", "\\n")),
+                "# TYPE %s %s" % (self.nombre, self.tipo)]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, etiquetas=()):
+        """Suma valor (>= 0). etiquetas: tupla de valores en el orden de los nombres declarados"""
+        datos = self._registro._fragmento()
+        clave = (self, etiquetas)
+        datos[clave] = datos.get(clave, 0) + valor
+
+    def _exponer(self, valores):
+        if not valores and not self.etiquetas:
+            valores = {(): 0}   # sin etiquetas la serie existe desde el arranque
+        lineas = self._cabecera()
+        for etiquetas, valor in sorted(valores.items()):
+            lineas.append("%s%s %s" % (self.nombre, _etiquetas(self.etiquetas, etiquetas), _numero(valor)))
+        return lineas
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, registro, nombre, ayuda, etiquetas, limites):
+        super().__init__(registro, nombre, ayuda, etiquetas)
+        self.limites = tuple(sorted(limites))
+
+    def observar(self, valor, etiquetas=()):
+        """Registra una observación. etiquetas: tupla de valores en el orden de los nombres declarados"""
+        datos = self._registro._fragmento()
+        clave = (self, etiquetas)
+        celdas = datos.get(clave)
+        if celdas is None:
+            # Una celda por bucket, una para +Inf y la suma de las observaciones al final
+            celdas = datos[clave] = [0] * (len(self.limites) + 1) + [0.0]
+        celdas[bisect.bisect_left(self.limites, valor)] += 1
+        celdas[-1] += valor
+
+    def _exponer(self, valores):
+        if not valores and not self.etiquetas:
+            valores = {(): [0] * (len(self.limites) + 1) + [0.0]}
+        lineas = self._cabecera()
+        for etiquetas, celdas in sorted(valores.items()):
+            acumulado = 0
+            for limite, cantidad in zip(self.limites + (math.inf,), celdas):
+                acumulado += cantidad
+                lineas.append("%s_bucket%s %d" % (
+                    self.nombre, _etiquetas(self.etiquetas, etiquetas, ("le", _numero(float(limite)))), acumulado))
+            sufijo = _etiquetas(self.etiquetas, etiquetas)
+            lineas.append("%s_sum%s %s" % (self.nombre, sufijo, _numero(celdas[-1])))
+            lineas.append("%s_count%s %d" % (self.nombre, sufijo, acumulado))
+        return lineas
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def __init__(self, registro, nombre, ayuda, etiquetas, funcion):
+        super().__init__(registro, nombre, ayuda, etiquetas)
+        self._funcion = funcion
+
+    def _exponer(self, _):
+        valor = self._funcion()
+        valores = valor if isinstance(valor, dict) else {(): valor}
+        lineas = self._cabecera()
+        for etiquetas, valor in sorted(valores.items()):
+            if valor is not None:
+                lineas.append("%s%s %s" % (self.nombre, _etiquetas(self.etiquetas, etiquetas), _numero(valor)))
+        return lineas
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._fragmentos = []     # [(hilo, datos)] de hilos que registraron algo
+        self._acumulado = {}      # fragmentos de hilos terminados, ya sumados
+        self._max_fragmentos = 64
+        self._metricas = []
+
+    # ------------------------------------------------------
+    # Declaración
+    # ------------------------------------------------------
+    def _declarar(self, metrica):
+        if any(m.nombre == metrica.nombre for m in self._metricas):
+            raise ValueError(f"Métrica repetida: {metrica.nombre}")
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._declarar(Contador(self, nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LATENCIA):
+        return self._declarar(Histograma(self, nombre, ayuda, etiquetas, limites))
+
+    def medidor(self, nombre, ayuda, funcion, etiquetas=()):
+        """funcion() retorna un número, o { tupla_de_etiquetas: número } si se declaran etiquetas"""
+        return self._declarar(Medidor(self, nombre, ayuda, etiquetas, funcion))
+
+    # ------------------------------------------------------
+    # Fragmentos por hilo
+    # ------------------------------------------------------
+    def _fragmento(self):
+        try:
+            return self._local.datos
+        except AttributeError:
+            pass
+        datos = {}
+        with self._lock:
+            self._fragmentos.append((threading.current_thread(), datos))
+            if len(self._fragmentos) > self._max_fragmentos:
+                self._plegar_terminados()
+                self._max_fragmentos = max(64, 2 * len(self._fragmentos))
+        self._local.datos = datos
+        return datos
+
+    def _plegar_terminados(self):
+        # Debe llamarse con self._lock tomado. Un hilo terminado ya no escribe en su fragmento.
+        vivos = []
+        for hilo, datos in self._fragmentos:
+            if hilo.is_alive():
+                vivos.append((hilo, datos))
+            else:
+                _sumar(self._acumulado, datos)
+        self._fragmentos = vivos
+
+    # ------------------------------------------------------
+    # Exposición
+    # ------------------------------------------------------
+    def valores(self):
+        """{ metrica: { etiquetas: valor } } sumando todos los hilos (valor: número o celdas del histograma)"""
+        with self._lock:
+            self._plegar_terminados()
+            totales = {}
+            _sumar(totales, self._acumulado)
+            fragmentos = [datos for _, datos in self._fragmentos]
+        for datos in fragmentos:
+            _sumar(totales, datos)
+        por_metrica = {}
+        for (metrica, etiquetas), valor in totales.items():
+            por_metrica.setdefault(metrica, {})[etiquetas] = valor
+        return por_metrica
+
+    def exponer(self):
+        """Texto para GET /metrics (formato de exposición de Prometheus 0.0.4)"""
+        valores = self.valores()
+        lineas = []
+        for metrica in self._metricas:
+            try:
+                lineas.extend(metrica._exponer(valores.get(metrica, {})))
+            except Exception as e:   # un medidor que falla no debe tumbar el resto
+                lineas.append("# %s no disponible: %s" % (metrica.nombre, _escapar(e)))
+        return "\n".join(lineas) + "\n"
+
+
+def _sumar(destino, datos):
+    # datos.copy() es atómico: el hilo dueño puede estar agregando claves mientras tanto
+    for clave, valor in datos.copy().items():
+        if isinstance(valor, list):
+            previo = destino.get(clave)
+            destino[clave] = list(valor) if previo is None else [a + b for a, b in zip(previo, valor)]
+        else:
+            destino[clave] = destino.get(clave, 0) + valor
@@ -0,0 +1,354 @@
+"""
+Snapshot y registro de escritura anticipada (WAL) del estado de los buses,
+para que un reinicio o un despliegue no deje a los usuarios sin buses hasta
+que los teléfonos vuelvan a reportar.
+
+En el directorio configurado se guardan dos archivos:
+
+    buses.snap   estado completo al momento del último snapshot (un bloque)
+    buses.wal    bloques con los cambios posteriores, uno por confirmación
+
+Un hilo de fondo pide al almacén los cambios desde la última secuencia
+guardada (AlmacenBuses.registros) cada ``intervalo`` segundos y los agrega al
+WAL como un solo bloque con un solo fsync (group commit): las peticiones no
+esperan al disco y una ráfaga de miles de reportes cuesta una escritura. Cada
+``intervalo_snapshot`` segundos (o cuando el WAL supera ``max_bytes_wal``) se
+escribe un snapshot nuevo (archivo temporal + fsync + rename) y se vacía el WAL.
+
+Formato de un bloque (little-endian):
+
+    cabecera   <4sBxxxqdII  magia b"RYBW", versión, secuencia del almacén, creado, largo, crc32 del cuerpo
+    cuerpo     <III         cantidad de textos, registros y eliminados
+               textos       por cada uno: largo (uint16) + UTF-8; se referencian desde 1 (0 = sin valor)
+               registros    <IIIIqiiib3xddddd  id, empresa, estado, próxima parada (textos), seq, ruta,
+                            última parada, tramo, sentido, lat, lon, vel, timestamp, km_ruta
+               eliminados   <I por cada id eliminado (texto)
+
+Al arrancar, cargar() aplica el snapshot y los bloques del WAL con secuencia
+posterior, descarta los buses sin reportes dentro del TTL y trunca el WAL en
+el primer bloque incompleto o corrupto (el que se estaba escribiendo al caer).
+"""
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIA = b"RYBW"
+VERSION = 1
+CABECERA = struct.Struct("<4sBxxxqdII")
+CONTEOS = struct.Struct("<III")
+LARGO_TEXTO = struct.Struct("<H")
+REGISTRO = struct.Struct("<IIIIqiiib3xddddd")
+ELIMINADO = struct.Struct("<I")
+SIN_INDICE = -1
+
+try:
+    import fcntl
+except ImportError:   # Windows: sin candado entre procesos
+    fcntl = None
+
+
+def codificar_bloque(secuencia, cambiados, eliminados, creado=None):
+    """
+    cambiados: [(seq, id_bus, registro)] en el formato de AlmacenBuses.registros()
+    eliminados: [id_bus]
+    Retorna los bytes del bloque.
+    """
+    indices = {None: 0}
+    textos = []
+
+    def indice(texto):
+        posicion = indices.get(texto)
+        if posicion is None:
+            codificado = texto.encode("utf-8")
+            if len(codificado) > 0xFFFF:
+                raise ValueError("Texto demasiado largo para el snapshot de buses")
+            posicion = indices[texto] = len(textos) + 1
+            textos.append(codificado)
+        return posicion
+
+    registros = bytearray()
+    for seq, id_bus, (empresa, ruta, lat, lon, vel, timestamp, ultima, estado, proxima,
+                      emparejado) in cambiados:
+        tramo, km_ruta, sentido = (SIN_INDICE, math.nan, 0) if emparejado is None else emparejado[:3]
+        registros += REGISTRO.pack(
+            indice(id_bus), indice(empresa), indice(estado), indice(proxima), seq, ruta,
+            SIN_INDICE if ultima is None else ultima, tramo, sentido, lat, lon, vel, timestamp, km_ruta
+        )
+    ids_eliminados = b"".join(ELIMINADO.pack(indice(id_bus)) for id_bus in eliminados)
+
+    partes = [CONTEOS.pack(len(textos), len(cambiados), len(eliminados))]
+    for codificado in textos:
+        partes.append(LARGO_TEXTO.pack(len(codificado)))
+        partes.append(codificado)
+    partes.append(bytes(registros))
+    partes.append(ids_eliminados)
+    cuerpo = b"".join(partes)
+    cabecera = CABECERA.pack(MAGIA, VERSION, secuencia, time.time() if creado is None else creado,
+                             len(cuerpo), zlib.crc32(cuerpo))
+    return cabecera + cuerpo
+
+
+def leer_bloques(datos):
+    """
+    Recorre los bloques de `datos` (bytes) sin decodificar los registros.
+    Genera (secuencia, textos, registros, eliminados, fin): textos es la lista del bloque (textos[0] = None),
+    registros y eliminados son memoryviews para REGISTRO.iter_unpack y ELIMINADO.iter_unpack, y fin la
+    posición siguiente al bloque. Se detiene sin error en el primer bloque incompleto o corrupto.
+    """
+    vista = memoryview(datos)
+    posicion = 0
+    while posicion + CABECERA.size <= len(datos):
+        magia, version, secuencia, _, largo, crc = CABECERA.unpack_from(vista, posicion)
+        inicio = posicion + CABECERA.size
+        fin = inicio + largo
+        if magia != MAGIA or version != VERSION or fin > len(datos) or zlib.crc32(vista[inicio:fin]) != crc:
+            return
+        num_textos, num_registros, _ = CONTEOS.unpack_from(vista, inicio)
+        p = inicio + CONTEOS.size
+        textos = [None]
+        for _ in range(num_textos):
+            largo_texto = LARGO_TEXTO.unpack_from(vista, p)[0]
+            p += LARGO_TEXTO.size
+            textos.append(str(vista[p:p + largo_texto], "utf-8"))
+            p += largo_texto
+        fin_registros = p + num_registros * REGISTRO.size
+        yield secuencia, textos, vista[p:fin_registros], vista[fin_registros:fin], fin
+        posicion = fin
+
+
+def registro_de(textos, campos):
+    """Tupla de REGISTRO -> (seq, id_bus, registro) en el formato de AlmacenBuses.registros()"""
+    (id_b, empresa, estado, proxima, seq, ruta, ultima, tramo, sentido, lat, lon, vel, timestamp,
+     km_ruta) = campos
+    ultima = None if ultima == SIN_INDICE else ultima
+    return seq, textos[id_b], (
+        textos[empresa], ruta, lat, lon, vel, timestamp, ultima, textos[estado], textos[proxima],
+        None if tramo == SIN_INDICE else (tramo, km_ruta, sentido, ultima)
+    )
+
+
+def _fsync_directorio(directorio):
+    # Hace durable el rename del snapshot (no disponible en Windows)
+    try:
+        fd = os.open(directorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class PersistenciaBuses:
+    def __init__(self, almacen, directorio, intervalo=0.2, intervalo_snapshot=60.0,
+                 max_bytes_wal=64 * 1024 * 1024, log=print):
+        """
+        almacen: AlmacenBuses a persistir (usa registros() y replicar())
+        directorio: carpeta de buses.snap y buses.wal (se crea si no existe)
+        intervalo: segundos entre confirmaciones del WAL (lo que se pierde como mucho si el proceso cae)
+        intervalo_snapshot: segundos entre snapshots completos
+        max_bytes_wal: tamaño del WAL que fuerza un snapshot antes de tiempo
+        """
+        self.almacen = almacen
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self.intervalo_snapshot = intervalo_snapshot
+        self.max_bytes_wal = max_bytes_wal
+        self._log = log
+        os.makedirs(directorio, exist_ok=True)
+        self._archivo_snapshot = os.path.join(directorio, "buses.snap")
+        self._archivo_wal = os.path.join(directorio, "buses.wal")
+
+        self._lock = threading.Lock()
+        self._wal = None
+        self._candado = None
+        self._seq = 0                 # última secuencia del almacén ya escrita
+        self._seq_snapshot = None     # secuencia del último snapshot escrito
+        self._ultimo_snapshot = time.time()
+        self._bytes_wal = 0
+        self._bloques_wal = 0
+        self._snapshots = 0
+        self._ultima_confirmacion_ms = None
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def tomar_directorio(self):
+        """
+        Candado exclusivo sobre el directorio: retorna False si otro proceso ya lo usa
+        (p. ej. otro worker de gunicorn), en cuyo caso este no debe persistir.
+        """
+        if fcntl is None:
+            return True
+        self._candado = open(os.path.join(self.directorio, "buses.lock"), "wb")
+        try:
+            fcntl.flock(self._candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._candado.close()
+            self._candado = None
+            return False
+        return True
+
+    # ------------------------------------------------------
+    # Arranque
+    # ------------------------------------------------------
+    def _leer(self, archivo):
+        try:
+            with open(archivo, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return b""
+
+    def cargar(self, ahora=None):
+        """
+        Restaura en el almacén (recién creado) el snapshot y la cola del WAL, sin los buses
+        cuyo último reporte es anterior a ahora - ttl_segundos. Retorna un dict con el resumen.
+        """
+        inicio = time.perf_counter()
+        if ahora is None:
+            ahora = time.time()
+        snapshot = next(leer_bloques(self._leer(self._archivo_snapshot)), None)
+        secuencia = snapshot[0] if snapshot is not None else 0
+        datos_wal = self._leer(self._archivo_wal)
+        valido = 0
+        posteriores = []
+        for bloque in leer_bloques(datos_wal):
+            valido = bloque[4]
+            # Los bloques con secuencia <= la del snapshot ya están incluidos (cayó antes de vaciar el WAL)
+            if bloque[0] > secuencia:
+                posteriores.append(bloque)
+        if posteriores:
+            secuencia = posteriores[-1][0]
+
+        # Del bloque más nuevo al más viejo: solo se decodifica la última versión de cada bus
+        limite = ahora - self.almacen.ttl_segundos
+        vistos = set()
+        vigentes = []
+        descartados = 0
+        for _, textos, registros, eliminados, _ in posteriores[::-1] + ([snapshot] if snapshot else []):
+            for (indice,) in ELIMINADO.iter_unpack(eliminados):
+                vistos.add(textos[indice])
+            for campos in REGISTRO.iter_unpack(registros):
+                id_bus = textos[campos[0]]
+                if id_bus in vistos:
+                    continue
+                vistos.add(id_bus)
+                if campos[12] <= limite:   # timestamp
+                    descartados += 1
+                else:
+                    vigentes.append(registro_de(textos, campos))
+        vigentes.sort(key=lambda cambio: cambio[0])
+        if secuencia:
+            # secuencia + 1: un cliente con ?since= del proceso anterior recibe el estado completo
+            self.almacen.replicar(vigentes, secuencia + 1, completo=True)
+
+        self._wal = open(self._archivo_wal, "ab")
+        if valido < len(datos_wal):
+            self._log(f"⚠️ WAL de buses cortado en el byte {valido} de {len(datos_wal)} (escritura incompleta)")
+            self._wal.truncate(valido)
+        self._bytes_wal = valido
+        self._bloques_wal = len(posteriores)
+        self._seq = self.almacen.secuencia
+        self._seq_snapshot = self._seq
+        return {
+            "buses": len(vigentes),
+            "descartados_por_ttl": descartados,
+            "bloques_wal": len(posteriores),
+            "secuencia": secuencia,
+            "ms": round((time.perf_counter() - inicio) * 1000, 1)
+        }
+
+    # ------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------
+    def confirmar(self):
+        """Escribe en el WAL todos los cambios pendientes como un bloque con un fsync (o un snapshot si toca)"""
+        with self._lock:
+            if self._wal is None:
+                raise RuntimeError("PersistenciaBuses.cargar() no se ha llamado")
+            vencido = time.time() - self._ultimo_snapshot >= self.intervalo_snapshot
+            if (vencido or self._bytes_wal >= self.max_bytes_wal) and self.almacen.secuencia != self._seq_snapshot:
+                self._snapshot()
+                return
+            if self.almacen.secuencia == self._seq:
+                return
+            inicio = time.perf_counter()
+            secuencia, completo, cambiados, eliminados = self.almacen.registros(self._seq)
+            if completo:
+                # Más eliminaciones de las que recuerda el almacén: el WAL ya no alcanza
+                self._snapshot(secuencia, cambiados)
+                return
+            bloque = codificar_bloque(secuencia, cambiados, eliminados)
+            self._wal.write(bloque)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._seq = secuencia
+            self._bytes_wal += len(bloque)
+            self._bloques_wal += 1
+            self._ultima_confirmacion_ms = round((time.perf_counter() - inicio) * 1000, 2)
+
+    def snapshot(self):
+        """Escribe un snapshot completo ahora y vacía el WAL"""
+        with self._lock:
+            self._snapshot()
+
+    def _snapshot(self, secuencia=None, cambiados=None):
+        # Debe llamarse con self._lock tomado
+        if cambiados is None:
+            secuencia, _, cambiados, _ = self.almacen.registros(0)
+        temporal = self._archivo_snapshot + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(codificar_bloque(secuencia, cambiados, []))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self._archivo_snapshot)
+        _fsync_directorio(self.directorio)
+        # Todo lo del WAL ya está en el snapshot; si el proceso cae antes de esto, cargar() salta esos bloques
+        self._wal.truncate(0)
+        os.fsync(self._wal.fileno())
+        self._seq = self._seq_snapshot = secuencia
+        self._ultimo_snapshot = time.time()
+        self._bytes_wal = 0
+        self._bloques_wal = 0
+        self._snapshots += 1
+
+    def iniciar(self):
+        """Inicia el hilo que llama confirmar() cada `intervalo` segundos"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+
+        def ciclo():
+            while not self._detener.wait(self.intervalo):
+                try:
+                    self.confirmar()
+                except Exception as e:
+                    self._log(f"⚠️ Error guardando el estado de los buses: {str(e)}")
+
+        self._hilo = threading.Thread(target=ciclo, name="buses-persistencia", daemon=True)
+        self._hilo.start()
+
+    def cerrar(self):
+        """Detiene el hilo y confirma lo pendiente (al apagar el servidor)"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+        if self._wal is not None:
+            self.confirmar()
+            self._wal.close()
+            self._wal = None
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "directorio": self.directorio,
+                "secuencia_guardada": self._seq,
+                "bloques_wal": self._bloques_wal,
+                "bytes_wal": self._bytes_wal,
+                "snapshots": self._snapshots,
+                "segundos_desde_snapshot": round(time.time() - self._ultimo_snapshot, 1),
+                "ultima_confirmacion_ms": self._ultima_confirmacion_ms
+            }
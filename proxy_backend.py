@@ -0,0 +1,383 @@
+"""
+Cliente del backend para los proxies del dashboard.
+
+Todas las consultas comparten una requests.Session con pool de conexiones
+keep-alive. Las respuestas GET se guardan con un TTL por ruta y, si varios
+visores piden lo mismo al mismo tiempo, solo uno consulta al backend y el
+resto espera ese resultado (single-flight). Así la carga sobre el backend no
+crece con el número de visores abiertos.
+
+Si el backend falla y hay una copia vencida en cache, se entrega esa copia.
+
+Las posiciones de los buses no pasan por ese cache: cada visor pide ?since= con su
+propia secuencia y las consultas no coincidirían nunca. RetransmisorBuses abre una
+sola conexión al stream SSE del backend, mantiene una réplica de los buses y responde
+desde ella a todos los visores, por stream o por sondeo.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class _Vuelo:
+    """Consulta en curso que otros hilos pueden esperar"""
+    __slots__ = ("listo", "resultado", "error")
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class ProxyBackend:
+    def __init__(self, url_base, ttl_por_ruta=None, pool_conexiones=20, timeout=2, max_entradas=256):
+        """
+        url_base: URL del servidor API (ej. http://localhost:3002)
+        ttl_por_ruta: { "/api/...": segundos } vigencia del cache de cada ruta GET (0 = sin cache)
+        pool_conexiones: conexiones keep-alive hacia el backend
+        timeout: segundos por consulta
+        max_entradas: respuestas guardadas (LRU); cada combinación de parámetros es una entrada
+        """
+        self.url_base = url_base.rstrip("/")
+        self.ttl_por_ruta = dict(ttl_por_ruta or {})
+        self.timeout = timeout
+        self.max_entradas = max_entradas
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=pool_conexiones, pool_maxsize=pool_conexiones)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # { clave: (vence, (codigo_http, cuerpo, content_type)) }
+        self._vuelos = {}             # { clave: _Vuelo }
+
+        self._hits = 0
+        self._misses = 0
+        self._agrupadas = 0
+        self._obsoletas = 0
+        self._errores = 0
+        self._consultas = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+        self._latencia_ultima = 0.0
+
+    # ------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------
+    def get(self, ruta, params=None):
+        """
+        GET cacheado y agrupado. Retorna (codigo_http, cuerpo_bytes, content_type).
+        Lanza requests.RequestException si el backend no responde y no hay copia en cache.
+        """
+        clave = (ruta, tuple(sorted(params.items())) if params else ())
+        ttl = self.ttl_por_ruta.get(ruta, 0)
+        with self._lock:
+            entrada = self._cache.get(clave)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self._cache.move_to_end(clave)
+                self._hits += 1
+                return entrada[1]
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self._misses += 1
+            else:
+                self._agrupadas += 1
+
+        if not lider:
+            if not vuelo.listo.wait(self.timeout + 1):
+                raise requests.Timeout(f"Sin respuesta del backend para {ruta}")
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            resultado = self._consultar("GET", ruta, params=params)
+        except requests.RequestException as e:
+            with self._lock:
+                del self._vuelos[clave]
+                entrada = self._cache.get(clave)
+                if entrada is not None:
+                    self._obsoletas += 1
+            if entrada is None:
+                vuelo.error = e
+                vuelo.listo.set()
+                raise
+            vuelo.resultado = entrada[1]
+            vuelo.listo.set()
+            return entrada[1]
+
+        with self._lock:
+            del self._vuelos[clave]
+            if ttl > 0 and resultado[0] == 200:
+                self._cache[clave] = (time.monotonic() + ttl, resultado)
+                self._cache.move_to_end(clave)
+                while len(self._cache) > self.max_entradas:
+                    self._cache.popitem(last=False)
+        vuelo.resultado = resultado
+        vuelo.listo.set()
+        return resultado
+
+    def post(self, ruta, json=None):
+        """POST sin cache por la sesión compartida. Retorna (codigo_http, cuerpo_bytes, content_type)."""
+        return self._consultar("POST", ruta, json=json)
+
+    def stream(self, ruta, params=None, timeout_lectura=None):
+        """
+        Abre una respuesta en streaming (el llamador debe cerrarla).
+        timeout_lectura: segundos sin recibir datos antes de cortar (None = sin límite)
+        """
+        return self.session.get(self.url_base + ruta, params=params, stream=True,
+                                timeout=(self.timeout, timeout_lectura))
+
+    def _consultar(self, metodo, ruta, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.session.request(metodo, self.url_base + ruta, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errores += 1
+            raise
+        duracion = time.perf_counter() - inicio
+        with self._lock:
+            self._consultas += 1
+            self._latencia_total += duracion
+            self._latencia_ultima = duracion
+            if duracion > self._latencia_max:
+                self._latencia_max = duracion
+        tipo = respuesta.headers.get("Content-Type", "application/json")
+        return respuesta.status_code, respuesta.content, tipo
+
+    def estadisticas(self):
+        with self._lock:
+            pedidos = self._hits + self._misses + self._agrupadas
+            return {
+                "backend": self.url_base,
+                "ttl_por_ruta": self.ttl_por_ruta,
+                "entradas": len(self._cache),
+                "hits": self._hits,
+                "misses": self._misses,
+                "agrupadas": self._agrupadas,
+                "obsoletas_servidas": self._obsoletas,
+                "errores_backend": self._errores,
+                "tasa_acierto": round((self._hits + self._agrupadas) / pedidos, 4) if pedidos else 0.0,
+                "consultas_backend": self._consultas,
+                "latencia_backend_ms": {
+                    "promedio": round(self._latencia_total / self._consultas * 1000, 2) if self._consultas else 0.0,
+                    "max": round(self._latencia_max * 1000, 2),
+                    "ultima": round(self._latencia_ultima * 1000, 2)
+                }
+            }
+
+
+class Visor:
+    """Posición de un visor del stream en la réplica"""
+    __slots__ = ("seq", "epoca")
+
+    def __init__(self):
+        self.seq = 0
+        self.epoca = -1    # distinta de la réplica: el primer mensaje trae el estado completo
+
+
+class RetransmisorBuses:
+    def __init__(self, proxy, ruta="/api/buses/stream", max_eliminados=10000, reintento=2.0,
+                 timeout_lectura=60.0, inactividad=60.0, log=print):
+        """
+        proxy: ProxyBackend cuya sesión abre el stream
+        ruta: stream SSE del backend (evento "buses", formato de /api/buses?since=)
+        max_eliminados: eliminaciones recordadas; un visor más atrasado recibe el estado completo
+        reintento: segundos de espera antes de reconectar tras un error
+        timeout_lectura: segundos sin datos (ni latidos) del backend antes de reconectar
+        inactividad: segundos sin visores ni consultas tras los que se cierra la conexión
+        """
+        self.proxy = proxy
+        self.ruta = ruta
+        self.max_eliminados = max_eliminados
+        self.reintento = reintento
+        self.timeout_lectura = timeout_lectura
+        self.inactividad = inactividad
+        self._log = log
+
+        self._cambio = threading.Condition()
+        self._buses = OrderedDict()     # { id_bus: (seq, json_bus) } en orden de seq
+        self._eliminados = deque()      # (seq, id_bus)
+        self._seq = 0
+        self._seq_compactado = 0        # antes de esta secuencia no hay historial de eliminaciones
+        self._epoca = 0                 # sube con cada estado completo recibido del backend
+        self._sincronizado = False
+        self._visores = 0
+        self._ultimo_uso = time.monotonic()
+        self._hilo = None
+        self._ultimo_mensaje = (None, None)
+
+        self._conexiones = 0
+        self._eventos = 0
+        self._errores = 0
+        self._consultas = 0
+
+    # ------------------------------------------------------
+    # Visores
+    # ------------------------------------------------------
+    def suscribir(self):
+        with self._cambio:
+            self._visores += 1
+            self._iniciar()
+        return Visor()
+
+    def cancelar(self, visor):
+        with self._cambio:
+            self._visores -= 1
+            self._ultimo_uso = time.monotonic()
+
+    def siguiente(self, visor, timeout):
+        """
+        Espera hasta `timeout` segundos un cambio posterior a lo que ya recibió el visor.
+        Retorna el mensaje (texto JSON) o None si no hubo cambios en ese tiempo.
+        """
+        with self._cambio:
+            hay_cambios = self._cambio.wait_for(
+                lambda: self._sincronizado and (visor.epoca != self._epoca or visor.seq != self._seq), timeout)
+            if not hay_cambios:
+                return None
+            desde = visor.seq if visor.epoca == self._epoca else 0
+            visor.seq = self._seq
+            visor.epoca = self._epoca
+            return self._mensaje(desde)
+
+    def cambios_desde(self, desde):
+        """
+        Cambios posteriores a la secuencia `desde` con el formato de /api/buses?since=.
+        Retorna None mientras la réplica no tenga el estado del backend.
+        """
+        with self._cambio:
+            self._ultimo_uso = time.monotonic()
+            self._consultas += 1
+            self._iniciar()
+            if not self._sincronizado:
+                return None
+            return self._mensaje(desde)
+
+    def estadisticas(self):
+        with self._cambio:
+            return {
+                "conectado": self._sincronizado,
+                "visores": self._visores,
+                "buses": len(self._buses),
+                "seq": self._seq,
+                "conexiones_backend": self._conexiones,
+                "eventos_backend": self._eventos,
+                "errores_backend": self._errores,
+                "consultas": self._consultas
+            }
+
+    def _mensaje(self, desde):
+        # Debe llamarse con self._cambio tomado. Los visores sincronizados piden lo mismo: se arma una vez.
+        completo = desde <= 0 or desde < self._seq_compactado or desde > self._seq
+        clave = (0 if completo else desde, self._seq, self._epoca)
+        if self._ultimo_mensaje[0] == clave:
+            return self._ultimo_mensaje[1]
+        if completo:
+            buses = [texto for _, texto in self._buses.values()]
+            eliminados = []
+        else:
+            buses = []
+            for seq, texto in reversed(self._buses.values()):
+                if seq <= desde:
+                    break
+                buses.append(texto)
+            buses.reverse()
+            eliminados = []
+            for seq, id_bus in reversed(self._eliminados):
+                if seq <= desde:
+                    break
+                if id_bus not in self._buses:
+                    eliminados.append(json.dumps(id_bus))
+        mensaje = '{"seq":%d,"completo":%s,"buses":[%s],"eliminados":[%s]}' % (
+            self._seq, "true" if completo else "false", ",".join(buses), ",".join(eliminados))
+        self._ultimo_mensaje = (clave, mensaje)
+        return mensaje
+
+    # ------------------------------------------------------
+    # Conexión con el backend
+    # ------------------------------------------------------
+    def _iniciar(self):
+        # Debe llamarse con self._cambio tomado
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._ejecutar, name="buses-retransmision", daemon=True)
+            self._hilo.start()
+
+    def _inactivo(self):
+        # Debe llamarse con self._cambio tomado
+        return self._visores <= 0 and time.monotonic() - self._ultimo_uso > self.inactividad
+
+    def _ejecutar(self):
+        while True:
+            with self._cambio:
+                if self._inactivo():
+                    # Sin nadie mirando se suelta la conexión; el próximo visor la vuelve a abrir
+                    self._hilo = None
+                    return
+            try:
+                self._escuchar()
+            except Exception as e:
+                with self._cambio:
+                    self._errores += 1
+                self._log(f"⚠️ Stream de buses del backend interrumpido: {e}")
+            with self._cambio:
+                self._sincronizado = False
+            time.sleep(self.reintento)
+
+    def _escuchar(self):
+        respuesta = self.proxy.stream(self.ruta, timeout_lectura=self.timeout_lectura)
+        try:
+            respuesta.raise_for_status()
+            with self._cambio:
+                self._conexiones += 1
+            evento = None
+            datos = []
+            for linea in respuesta.iter_lines(chunk_size=None):
+                if linea:
+                    if linea.startswith(b"event:"):
+                        evento = linea[6:].strip()
+                    elif linea.startswith(b"data:"):
+                        datos.append(linea[5:].strip())
+                    continue
+                # Línea vacía: fin del evento (o de un latido)
+                if evento == b"buses" and datos:
+                    self._aplicar(json.loads(b"\n".join(datos)))
+                evento = None
+                datos = []
+                with self._cambio:
+                    if self._inactivo():
+                        return
+        finally:
+            respuesta.close()
+
+    def _aplicar(self, mensaje):
+        seq = mensaje["seq"]
+        buses = [(bus["id"], json.dumps(bus, separators=(",", ":"))) for bus in mensaje["buses"]]
+        with self._cambio:
+            if mensaje["completo"]:
+                self._buses = OrderedDict((id_bus, (seq, texto)) for id_bus, texto in buses)
+                self._eliminados.clear()
+                self._seq_compactado = seq
+                self._epoca += 1
+            else:
+                for id_bus, texto in buses:
+                    self._buses.pop(id_bus, None)
+                    self._buses[id_bus] = (seq, texto)
+                for id_bus in mensaje["eliminados"]:
+                    if self._buses.pop(id_bus, None) is not None:
+                        self._eliminados.append((seq, id_bus))
+                while len(self._eliminados) > self.max_eliminados:
+                    self._seq_compactado = self._eliminados.popleft()[0]
+            self._seq = seq
+            self._sincronizado = True
+            self._eventos += 1
+            self._cambio.notify_all()
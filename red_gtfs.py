@@ -0,0 +1,380 @@
+"""
+Red de rutas desde un feed GTFS, con cache binario compilado.
+
+Convierte un feed GTFS (carpeta o .zip) a las estructuras que usan los
+endpoints:
+
+    rutas     { empresa: { numeroRuta: [ {nombre, lat, lon, orden}, ... ] } }  (formato de RUTAS_DATABASE)
+    tarifas   { empresa: precio }                                              (formato de TARIFAS)
+
+- empresa: agency_name de agency.txt.
+- numeroRuta: route_short_name si es un número; si no (o si se repite en la
+  empresa) el siguiente número libre de la empresa.
+- paradas: las del viaje de trips.txt con más paradas en stop_times.txt
+  (sentido direction_id 0 si el feed lo informa), en orden de stop_sequence.
+- tarifas: el menor precio de fare_attributes.txt de cada empresa, por
+  agency_id o por las rutas de fare_rules.txt.
+
+stop_times.txt se lee dos veces en streaming (primero cuenta paradas por
+viaje, luego solo guarda las de los viajes elegidos) para no cargar feeds
+grandes en memoria.
+
+El resultado se guarda en un archivo binario versionado (little-endian):
+
+    cabecera   <4sBxxx8sIIIII   magia b"RYGT", versión, huella del feed, cantidad de textos,
+                                rutas, paradas, tarifas, bytes de textos
+    textos     uint32 x (textos + 1) inicios, UTF-8 concatenado
+    rutas      uint32 x rutas (id GTFS), uint32 x rutas (empresa), int32 x rutas (número),
+               uint32 x (rutas + 1) inicio de paradas
+    paradas    uint32 x paradas (nombre), float64 x paradas (lat), float64 x paradas (lon)
+    tarifas    uint32 x tarifas (empresa), float64 x tarifas (precio)
+
+Cada sección empieza alineada a 8 bytes. Al arrancar, cargar_red() mapea el
+archivo (mmap) y arma los dicts directamente desde los arreglos. La huella (tamaño y
+fecha de modificación de los archivos del feed) invalida el cache cuando
+cambia el feed, y la versión cuando cambia el formato.
+
+Compilar el cache a mano (p. ej. en el build del despliegue):
+
+    python red_gtfs.py feed_popayan.zip [red_popayan.bin]
+"""
+import csv
+import hashlib
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+import zipfile
+from array import array
+
+MAGIA = b"RYGT"
+VERSION = 2
+CABECERA = struct.Struct("<4sBxxx8sIIIII")
+ARCHIVOS = ("agency.txt", "stops.txt", "routes.txt", "trips.txt", "stop_times.txt",
+            "fare_attributes.txt", "fare_rules.txt")
+
+
+# ------------------------------------------------------
+# Lectura del feed
+# ------------------------------------------------------
+class _Feed:
+    """Acceso a los archivos de un feed en carpeta o .zip"""
+
+    def __init__(self, origen):
+        self.origen = origen
+        self._zip = zipfile.ZipFile(origen) if zipfile.is_zipfile(origen) else None
+        if self._zip is not None:
+            # Algunos feeds traen los archivos dentro de una carpeta del .zip
+            self._nombres = {os.path.basename(n): n for n in self._zip.namelist()}
+
+    def existe(self, nombre):
+        if self._zip is not None:
+            return nombre in self._nombres
+        return os.path.exists(os.path.join(self.origen, nombre))
+
+    def filas(self, nombre):
+        """Genera un dict por fila (vacío si el archivo no existe)"""
+        if not self.existe(nombre):
+            return
+        if self._zip is not None:
+            archivo = io.TextIOWrapper(self._zip.open(self._nombres[nombre]), encoding="utf-8-sig", newline="")
+        else:
+            archivo = open(os.path.join(self.origen, nombre), encoding="utf-8-sig", newline="")
+        with archivo:
+            lector = csv.reader(archivo)
+            columnas = [c.strip() for c in next(lector, [])]
+            for fila in lector:
+                if fila:
+                    yield dict(zip(columnas, fila))
+
+    def cerrar(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def huella_feed(origen):
+    """Identifica la versión del feed por tamaño y fecha de modificación de sus archivos (8 bytes)"""
+    partes = []
+    if os.path.isdir(origen):
+        for nombre in ARCHIVOS:
+            ruta = os.path.join(origen, nombre)
+            if os.path.exists(ruta):
+                info = os.stat(ruta)
+                partes.append(f"{nombre}:{info.st_size}:{info.st_mtime_ns}")
+    else:
+        info = os.stat(origen)
+        partes.append(f"{info.st_size}:{info.st_mtime_ns}")
+    return hashlib.blake2b("|".join(partes).encode("utf-8"), digest_size=8).digest()
+
+
+def _precio(texto):
+    precio = float(texto)
+    return int(precio) if precio.is_integer() else precio
+
+
+def leer_gtfs(origen):
+    """Lee y convierte un feed GTFS (carpeta o .zip). Lanza ValueError si le faltan archivos obligatorios."""
+    feed = _Feed(origen)
+    try:
+        for nombre in ("stops.txt", "routes.txt", "trips.txt", "stop_times.txt"):
+            if not feed.existe(nombre):
+                raise ValueError(f"El feed GTFS {origen} no tiene {nombre}")
+
+        agencias = {f.get("agency_id", ""): f["agency_name"] for f in feed.filas("agency.txt")}
+        agencia_unica = next(iter(agencias.values())) if len(agencias) == 1 else None
+        paradas = {
+            f["stop_id"]: (f.get("stop_name") or f["stop_id"], float(f["stop_lat"]), float(f["stop_lon"]))
+            for f in feed.filas("stops.txt")
+            if f.get("stop_lat") and f.get("stop_lon")
+        }
+        rutas_gtfs = []   # [(route_id, empresa, nombre corto)] en el orden del archivo
+        for f in feed.filas("routes.txt"):
+            empresa = agencias.get(f.get("agency_id", ""), agencia_unica) or f.get("agency_id") or "GTFS"
+            rutas_gtfs.append((f["route_id"], empresa, (f.get("route_short_name") or "").strip()))
+        viajes = {
+            f["trip_id"]: (f["route_id"], f.get("direction_id", ""))
+            for f in feed.filas("trips.txt")
+        }
+
+        # Primera pasada: paradas por viaje, para elegir el viaje más completo de cada ruta
+        conteo = {}
+        for f in feed.filas("stop_times.txt"):
+            trip_id = f["trip_id"]
+            conteo[trip_id] = conteo.get(trip_id, 0) + 1
+        elegidos = {}   # { route_id: (prioridad, paradas, trip_id) }
+        for trip_id, cantidad in conteo.items():
+            viaje = viajes.get(trip_id)
+            if viaje is None:
+                continue
+            candidato = (viaje[1] in ("", "0"), cantidad)
+            actual = elegidos.get(viaje[0])
+            if actual is None or candidato > actual[:2]:
+                elegidos[viaje[0]] = candidato + (trip_id,)
+        viaje_de_ruta = {route_id: elegido[2] for route_id, elegido in elegidos.items()}
+
+        # Segunda pasada: solo las paradas de los viajes elegidos
+        buscados = set(viaje_de_ruta.values())
+        secuencias = {trip_id: [] for trip_id in buscados}
+        for f in feed.filas("stop_times.txt"):
+            if f["trip_id"] in buscados and f["stop_id"] in paradas:
+                secuencias[f["trip_id"]].append((int(f["stop_sequence"]), f["stop_id"]))
+
+        # Números de ruta: primero los nombres cortos numéricos, luego el siguiente libre de la empresa
+        usados = {}
+        numeros = {}
+        for route_id, empresa, corto in rutas_gtfs:
+            if route_id in viaje_de_ruta and corto.isdigit() and int(corto) not in usados.setdefault(empresa, set()):
+                numeros[route_id] = int(corto)
+                usados[empresa].add(int(corto))
+        for route_id, empresa, corto in rutas_gtfs:
+            if route_id in viaje_de_ruta and route_id not in numeros:
+                numero = max(usados.setdefault(empresa, set()), default=0) + 1
+                numeros[route_id] = numero
+                usados[empresa].add(numero)
+
+        red = RedGTFS()
+        for route_id, empresa, _ in rutas_gtfs:
+            trip_id = viaje_de_ruta.get(route_id)
+            if trip_id is None:
+                continue
+            secuencia = sorted(secuencias[trip_id])
+            if len(secuencia) < 2:
+                continue
+            numero = numeros[route_id]
+            red.rutas.setdefault(empresa, {})[numero] = [
+                {"nombre": paradas[stop_id][0], "lat": paradas[stop_id][1], "lon": paradas[stop_id][2],
+                 "orden": orden}
+                for orden, (_, stop_id) in enumerate(secuencia, 1)
+            ]
+            red.ids_ruta[(empresa, numero)] = route_id
+
+        # Tarifas: la menor de cada empresa (tarifa base)
+        empresa_de_ruta = {route_id: empresa for route_id, empresa, _ in rutas_gtfs}
+        precios = {f["fare_id"]: (_precio(f["price"]), f.get("agency_id", "")) for f in feed.filas("fare_attributes.txt")}
+        candidatas = []
+        for fare_id, (precio, agency_id) in precios.items():
+            if agency_id:
+                candidatas.append((agencias.get(agency_id, agency_id), precio))
+            elif agencia_unica is not None:
+                candidatas.append((agencia_unica, precio))
+        for f in feed.filas("fare_rules.txt"):
+            if f.get("fare_id") in precios and f.get("route_id") in empresa_de_ruta:
+                candidatas.append((empresa_de_ruta[f["route_id"]], precios[f["fare_id"]][0]))
+        for empresa, precio in candidatas:
+            if empresa in red.rutas and (empresa not in red.tarifas or precio < red.tarifas[empresa]):
+                red.tarifas[empresa] = precio
+        return red
+    finally:
+        feed.cerrar()
+
+
+# ------------------------------------------------------
+# Red y cache binario
+# ------------------------------------------------------
+def _alinear(posicion):
+    return (posicion + 7) & ~7
+
+
+def _vista(datos, posicion, tipo, cantidad):
+    # Vista sin copia sobre el mapeo (con copia si la máquina no es little-endian)
+    largo = cantidad * array(tipo).itemsize
+    if sys.byteorder == "little":
+        return datos[posicion:posicion + largo].cast(tipo), posicion + largo
+    arreglo = array(tipo)
+    arreglo.frombytes(datos[posicion:posicion + largo])
+    arreglo.byteswap()
+    return arreglo, posicion + largo
+
+
+class RedGTFS:
+    def __init__(self):
+        self.rutas = {}        # { empresa: { numeroRuta: [paradas] } }
+        self.tarifas = {}      # { empresa: precio }
+        self.ids_ruta = {}     # { (empresa, numeroRuta): route_id del feed }
+        self.desde_cache = False
+
+    def resumen(self):
+        return {
+            "empresas": len(self.rutas),
+            "rutas": sum(len(r) for r in self.rutas.values()),
+            "paradas": sum(len(p) for r in self.rutas.values() for p in r.values()),
+            "desde_cache": self.desde_cache
+        }
+
+    def guardar(self, archivo, huella):
+        """Escribe el cache binario (archivo temporal + rename, para no dejar un cache a medias)"""
+        textos = []
+        indices = {}
+
+        def indice(texto):
+            posicion = indices.get(texto)
+            if posicion is None:
+                posicion = indices[texto] = len(textos)
+                textos.append(texto.encode("utf-8"))
+            return posicion
+
+        ids, empresas, numeros, inicio_paradas = [], [], [], [0]
+        nombres, lats, lons = [], [], []
+        for empresa, rutas_dict in self.rutas.items():
+            for numero, paradas in rutas_dict.items():
+                ids.append(indice(self.ids_ruta.get((empresa, numero), "")))
+                empresas.append(indice(empresa))
+                numeros.append(numero)
+                for parada in paradas:
+                    nombres.append(indice(parada["nombre"]))
+                    lats.append(parada["lat"])
+                    lons.append(parada["lon"])
+                inicio_paradas.append(len(nombres))
+        tarifas_empresa = [indice(empresa) for empresa in self.tarifas]
+        tarifas_precio = [float(precio) for precio in self.tarifas.values()]
+        inicio_textos = [0]
+        for codificado in textos:
+            inicio_textos.append(inicio_textos[-1] + len(codificado))
+
+        # Temporal propio de cada proceso: varios workers pueden compilar el mismo cache a la vez
+        temporal = f"{archivo}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(CABECERA.pack(MAGIA, VERSION, huella, len(textos), len(numeros), len(nombres),
+                                 len(tarifas_empresa), inicio_textos[-1]))
+            secciones = [("I", inicio_textos), (None, b"".join(textos)), ("I", ids), ("I", empresas), ("i", numeros),
+                         ("I", inicio_paradas), ("I", nombres), ("d", lats), ("d", lons),
+                         ("I", tarifas_empresa), ("d", tarifas_precio)]
+            for tipo, valores in secciones:
+                f.write(b"\0" * (_alinear(f.tell()) - f.tell()))
+                if tipo is None:
+                    f.write(valores)
+                    continue
+                arreglo = array(tipo, valores)
+                if sys.byteorder != "little":
+                    arreglo.byteswap()
+                arreglo.tofile(f)
+        os.replace(temporal, archivo)
+
+    @classmethod
+    def cargar(cls, archivo, huella=None):
+        """
+        Mapea un cache escrito con guardar(). Retorna None si no existe, es de otra versión o su
+        huella no coincide con `huella` (si se pasa); lanza ValueError si está truncado.
+        """
+        try:
+            with open(archivo, "rb") as f:
+                datos = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, ValueError):   # ValueError: archivo vacío
+            return None
+        if len(datos) < CABECERA.size:
+            return None
+        magia, version, huella_cache, num_textos, num_rutas, num_paradas, num_tarifas, bytes_textos = \
+            CABECERA.unpack_from(datos)
+        if magia != MAGIA or version != VERSION or (huella is not None and huella_cache != huella):
+            return None
+
+        try:
+            posicion = CABECERA.size
+            inicio_textos, posicion = _vista(datos, _alinear(posicion), "I", num_textos + 1)
+            posicion = _alinear(posicion)
+            blob = datos[posicion:posicion + bytes_textos]
+            posicion += bytes_textos
+            textos = [str(blob[inicio_textos[i]:inicio_textos[i + 1]], "utf-8") for i in range(num_textos)]
+            arreglos = []
+            for tipo, cantidad in (("I", num_rutas), ("I", num_rutas), ("i", num_rutas), ("I", num_rutas + 1),
+                                   ("I", num_paradas), ("d", num_paradas), ("d", num_paradas),
+                                   ("I", num_tarifas), ("d", num_tarifas)):
+                arreglo, posicion = _vista(datos, _alinear(posicion), tipo, cantidad)
+                if len(arreglo) != cantidad:
+                    raise ValueError(f"Cache GTFS truncado: {archivo}")
+                arreglos.append(arreglo)
+        except (TypeError, IndexError) as e:
+            raise ValueError(f"Cache GTFS inválido: {archivo} ({e})")
+        (ids, empresas, numeros, inicio_paradas, nombres, lats, lons,
+         tarifas_empresa, tarifas_precio) = arreglos
+
+        red = cls()
+        red.desde_cache = True
+        nombres = nombres.tolist()
+        lats = lats.tolist()
+        lons = lons.tolist()
+        for r in range(num_rutas):
+            empresa = textos[empresas[r]]
+            numero = numeros[r]
+            inicio, fin = inicio_paradas[r], inicio_paradas[r + 1]
+            red.rutas.setdefault(empresa, {})[numero] = [
+                {"nombre": textos[nombres[p]], "lat": lats[p], "lon": lons[p], "orden": p - inicio + 1}
+                for p in range(inicio, fin)
+            ]
+            red.ids_ruta[(empresa, numero)] = textos[ids[r]]
+        for empresa, precio in zip(tarifas_empresa, tarifas_precio):
+            red.tarifas[textos[empresa]] = int(precio) if precio.is_integer() else precio
+        return red
+
+
+def cargar_red(origen, cache=None):
+    """
+    Red del feed `origen` usando el cache `cache` (por defecto origen + ".rutaya.bin"):
+    si el cache existe y corresponde al feed se mapea; si no, se lee el feed y se escribe el cache.
+    """
+    cache = cache or origen.rstrip("/\\") + ".rutaya.bin"
+    huella = huella_feed(origen)
+    try:
+        red = RedGTFS.cargar(cache, huella)
+    except ValueError:
+        red = None
+    if red is None:
+        red = leer_gtfs(origen)
+        red.guardar(cache, huella)
+    return red
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Uso: python red_gtfs.py feed.zip|carpeta_gtfs [cache.bin]")
+        sys.exit(1)
+    inicio = time.perf_counter()
+    origen = sys.argv[1]
+    destino = sys.argv[2] if len(sys.argv) == 3 else origen.rstrip("/\\") + ".rutaya.bin"
+    red = leer_gtfs(origen)
+    red.guardar(destino, huella_feed(origen))
+    resumen = red.resumen()
+    print(f"Cache guardado en {destino}: {resumen['empresas']} empresas, {resumen['rutas']} rutas, "
+          f"{resumen['paradas']} paradas ({time.perf_counter() - inicio:.1f} s)")
@@ -0,0 +1,130 @@
+"""
+Versión inmutable de la red de rutas y de todo lo que se deriva de ella.
+
+Una RedRutas reúne las paradas, las tarifas y las estructuras derivadas
+(tablas acumuladas, índice espacial de paradas, estimador por lotes,
+emparejador GPS y tablero de llegadas). Se construye completa a un lado y el
+servidor la publica reemplazando una sola referencia (server.RED_VIGENTE):
+cada consulta lee esa referencia una vez al empezar y termina con la misma
+versión aunque entretanto se publique otra; las consultas nuevas ven la nueva.
+Nadie espera a que termine una recarga.
+
+Una RedRutas no se modifica después de construirla: para mover una parada o
+cambiar una tarifa se construye una versión nueva.
+"""
+import math
+import numbers
+import time
+
+from indice_paradas import IndiceParadas
+from estimacion_lote import EstimadorLote
+from tablas_rutas import construir_tablas
+from emparejamiento_rutas import EmparejadorRutas
+
+
+class RedRutas:
+    """Red de rutas publicada: rutas, tarifas y estructuras derivadas de una misma versión"""
+
+    def __init__(self, rutas, tarifas, distancia, version=1, origen=None, crear_tablero=None):
+        """
+        rutas: { empresa: { numeroRuta: [paradas] } } (se copia: cambios posteriores al
+               diccionario recibido no afectan a esta versión)
+        tarifas: { empresa: precio }
+        distancia: función (lat1, lon1, lat2, lon2) -> km
+        version: número de versión (creciente en cada recarga)
+        origen: de dónde salieron las rutas ("server.py", "gtfs", "admin", ...)
+        crear_tablero: función(tablas) -> TableroLlegadas, o None para no crear tablero
+        """
+        inicio = time.perf_counter()
+        self.rutas = {
+            empresa: {num: [dict(parada) for parada in paradas] for num, paradas in rutas_dict.items()}
+            for empresa, rutas_dict in rutas.items()
+        }
+        self.tarifas = dict(tarifas)
+        self.tablas = construir_tablas(self.rutas, distancia)
+        self.tablas_por_lista = {id(t.paradas): t for t in self.tablas.values()}
+        self.indice = IndiceParadas(self.rutas, distancia)
+        self.lote = EstimadorLote(self.rutas, self.tablas)
+        self.emparejador = EmparejadorRutas(self.tablas)
+        self.tablero = crear_tablero(self.tablas) if crear_tablero is not None else None
+        self.version = version
+        self.origen = origen
+        self.creada = time.time()
+        self.ms_construccion = (time.perf_counter() - inicio) * 1000
+
+    def resumen(self):
+        return {
+            "version": self.version,
+            "origen": self.origen,
+            "empresas": len(self.rutas),
+            "rutas": len(self.tablas),
+            "paradas": sum(len(t.paradas) for t in self.tablas.values()),
+            "creada": self.creada,
+            "construccion_ms": round(self.ms_construccion, 1)
+        }
+
+
+def _numero(valor, campo, minimo=None, maximo=None):
+    """float finito de un valor JSON, dentro de [minimo, maximo] si se indican. Lanza ValueError."""
+    if isinstance(valor, bool) or not isinstance(valor, numbers.Real):
+        raise ValueError(f"{campo} debe ser numérico")
+    try:
+        numero = float(valor)
+    except OverflowError:
+        numero = math.inf
+    if not math.isfinite(numero):
+        raise ValueError(f"{campo} debe ser un número finito")
+    if minimo is not None and numero < minimo:
+        raise ValueError(f"{campo} debe ser mayor o igual a {minimo:g}" if maximo is None else
+                         f"{campo} debe estar entre {minimo:g} y {maximo:g}")
+    if maximo is not None and numero > maximo:
+        raise ValueError(f"{campo} debe estar entre {minimo:g} y {maximo:g}")
+    return numero
+
+
+def normalizar_rutas(rutas):
+    """
+    Valida rutas recibidas como JSON: { empresa: { "numeroRuta": [ {nombre, lat, lon}, ... ] } }.
+    Los números de ruta llegan como texto y se convierten a int; "orden" se reasigna 1..n
+    según la posición en la lista. Lanza ValueError con el primer problema encontrado.
+    """
+    if not isinstance(rutas, dict) or not rutas:
+        raise ValueError("'rutas' debe ser un objeto { empresa: { numeroRuta: [paradas] } } no vacío")
+    normalizadas = {}
+    for empresa, rutas_dict in rutas.items():
+        if not isinstance(rutas_dict, dict) or not rutas_dict:
+            raise ValueError(f"La empresa {empresa} no tiene rutas")
+        normalizadas[empresa] = {}
+        for num, paradas in rutas_dict.items():
+            try:
+                numero = int(num)
+            except (TypeError, ValueError):
+                raise ValueError(f"Número de ruta inválido: {empresa} {num}") from None
+            if not isinstance(paradas, list) or len(paradas) < 2:
+                raise ValueError(f"La ruta {empresa} {num} necesita al menos dos paradas")
+            lista = []
+            for orden, parada in enumerate(paradas, start=1):
+                if not isinstance(parada, dict) or not isinstance(parada.get("nombre"), str):
+                    raise ValueError(f"Parada {orden} de {empresa} {num}: falta nombre")
+                lista.append({
+                    "nombre": parada["nombre"],
+                    "lat": _numero(parada.get("lat"), f"lat de la parada {orden} de {empresa} {num}", -90, 90),
+                    "lon": _numero(parada.get("lon"), f"lon de la parada {orden} de {empresa} {num}", -180, 180),
+                    "orden": orden
+                })
+            normalizadas[empresa][numero] = lista
+    return normalizadas
+
+
+def normalizar_tarifas(tarifas):
+    """
+    Valida tarifas recibidas como JSON: { empresa: precio }. Lanza ValueError.
+    Igual que en red_gtfs: un precio entero queda como int y uno con fracción se conserva como float.
+    """
+    if not isinstance(tarifas, dict):
+        raise ValueError("'tarifas' debe ser un objeto { empresa: precio }")
+    normalizadas = {}
+    for empresa, precio in tarifas.items():
+        precio = _numero(precio, f"tarifa de {empresa}", 0)
+        normalizadas[empresa] = int(precio) if precio.is_integer() else precio
+    return normalizadas
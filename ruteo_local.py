@@ -0,0 +1,265 @@
+"""
+Motor de ruteo local sobre un GrafoVial, alternativa al OSRM público.
+
+Responde las mismas consultas que ClienteOSRM (ruta, disponible, en_paralelo)
+y con el mismo dict (distancia_km, tiempo_minutos, geometria GeoJSON), así
+que server.py puede usar uno u otro según RUTEO_BACKEND sin cambiar nada más.
+
+Origen y destino se ajustan al nodo más cercano (grilla de celdas, igual que
+los demás índices espaciales) y la ruta más rápida se busca con A*. La
+heurística usa puntos de referencia (ALT): al cargar el grafo se calcula el
+tiempo desde y hacia unos pocos nodos alejados entre sí, y por la desigualdad
+triangular |t(L, destino) - t(L, v)| acota por debajo el tiempo de v al
+destino. Es mucho más ajustada que la línea recta a velocidad máxima (que en
+una ciudad con avenidas rápidas y calles lentas subestima a la mitad) y por
+eso la búsqueda explora pocos nodos. Cada consulta usa los 4 puntos que mejor
+acotan su par origen/destino.
+"""
+import asyncio
+import heapq
+import math
+import threading
+
+from grafo_vial import GrafoVial
+from indice_paradas import KM_POR_GRADO
+
+MARCAS_POR_CONSULTA = 4
+
+
+class MotorRutasLocal:
+    def __init__(self, grafo, celda_km=0.25, max_ajuste_km=1.0, marcas=8):
+        """
+        grafo: GrafoVial
+        celda_km: lado de las celdas del índice de nodos
+        max_ajuste_km: un origen o destino más lejos que esto de cualquier nodo no tiene ruta
+        marcas: puntos de referencia de la heurística (cada uno cuesta dos Dijkstra al cargar)
+        """
+        self.grafo = grafo
+        self.celda_km = celda_km
+        self.max_ajuste_km = max_ajuste_km
+
+        lats = grafo.lat
+        lat_ref = sum(lats) / len(lats) if lats else 0.0
+        self._m_lat = KM_POR_GRADO * 1000
+        self._m_lon = self._m_lat * math.cos(math.radians(lat_ref))
+        self._celda_lat = celda_km / KM_POR_GRADO
+        self._celda_lon = celda_km / (KM_POR_GRADO * max(math.cos(math.radians(lat_ref)), 0.01))
+        self._celdas = {}   # { (fila, col): [nodo] }
+        for nodo, (lat, lon) in enumerate(zip(grafo.lat, grafo.lon)):
+            self._celdas.setdefault(self._celda(lat, lon), []).append(nodo)
+
+        # Origen de cada arista, para reconstruir el camino desde la arista de llegada
+        self._origen = [0] * grafo.num_aristas
+        for nodo in range(grafo.num_nodos):
+            for arista in range(grafo.inicio[nodo], grafo.inicio[nodo + 1]):
+                self._origen[arista] = nodo
+        # Grafo invertido (CSR) para los tiempos hacia cada punto de referencia
+        self._inicio_inv = [0] * (grafo.num_nodos + 1)
+        for destino in grafo.destino:
+            self._inicio_inv[destino + 1] += 1
+        for nodo in range(grafo.num_nodos):
+            self._inicio_inv[nodo + 1] += self._inicio_inv[nodo]
+        posiciones = self._inicio_inv[:-1]
+        self._origen_inv = [0] * grafo.num_aristas
+        self._segundos_inv = [0.0] * grafo.num_aristas
+        for arista, destino in enumerate(grafo.destino):
+            self._origen_inv[posiciones[destino]] = self._origen[arista]
+            self._segundos_inv[posiciones[destino]] = grafo.segundos[arista]
+            posiciones[destino] += 1
+
+        self._desde_marca = []   # [tiempos desde la marca a cada nodo]
+        self._hacia_marca = []   # [tiempos de cada nodo hasta la marca]
+        self._elegir_marcas(marcas)
+        self._cero = [0.0] * grafo.num_nodos
+
+        self._lock = threading.Lock()
+        self._consultas = 0
+        self._sin_ruta = 0
+        self._explorados = 0
+
+    def _dijkstra(self, fuente, inicio, vecinos, pesos):
+        tiempos = [math.inf] * self.grafo.num_nodos
+        tiempos[fuente] = 0.0
+        frontera = [(0.0, fuente)]
+        while frontera:
+            tiempo, nodo = heapq.heappop(frontera)
+            if tiempo > tiempos[nodo]:
+                continue
+            for arista in range(inicio[nodo], inicio[nodo + 1]):
+                vecino = vecinos[arista]
+                nuevo = tiempo + pesos[arista]
+                if nuevo < tiempos[vecino]:
+                    tiempos[vecino] = nuevo
+                    heapq.heappush(frontera, (nuevo, vecino))
+        return tiempos
+
+    def _elegir_marcas(self, cantidad):
+        # La primera marca es el nodo más lejano del nodo 0; cada una de las siguientes, el nodo
+        # con mayor tiempo de ida y vuelta hasta la marca ya elegida más cercana
+        g = self.grafo
+        if g.num_nodos == 0:
+            return
+        lejania = [t if t < math.inf else -1.0 for t in self._dijkstra(0, g.inicio, g.destino, g.segundos)]
+        for _ in range(cantidad):
+            marca = max(range(g.num_nodos), key=lejania.__getitem__)
+            if lejania[marca] <= 0:
+                break
+            desde = self._dijkstra(marca, g.inicio, g.destino, g.segundos)
+            hacia = self._dijkstra(marca, self._inicio_inv, self._origen_inv, self._segundos_inv)
+            self._desde_marca.append(desde)
+            self._hacia_marca.append(hacia)
+            for nodo in range(g.num_nodos):
+                ida_vuelta = desde[nodo] + hacia[nodo]
+                if ida_vuelta < lejania[nodo]:
+                    lejania[nodo] = ida_vuelta
+
+    def _cotas(self, origen, destino):
+        # Las MARCAS_POR_CONSULTA marcas con mejor cota para el par, como (desde, desde[destino], hacia, hacia[destino]).
+        # Solo sirven marcas que el destino alcanza en ambos sentidos; se completa con cotas nulas.
+        candidatas = []
+        for desde, hacia in zip(self._desde_marca, self._hacia_marca):
+            if desde[destino] < math.inf and hacia[destino] < math.inf:
+                cota = max(desde[destino] - desde[origen], hacia[origen] - hacia[destino])
+                candidatas.append((cota, desde, hacia))
+        candidatas.sort(key=lambda c: c[0], reverse=True)
+        cotas = [(desde, desde[destino], hacia, hacia[destino])
+                 for _, desde, hacia in candidatas[:MARCAS_POR_CONSULTA]]
+        while len(cotas) < MARCAS_POR_CONSULTA:
+            cotas.append((self._cero, 0.0, self._cero, 0.0))
+        return cotas
+
+    @classmethod
+    def desde_archivo(cls, archivo, **opciones):
+        return cls(GrafoVial.cargar(archivo), **opciones)
+
+    def _celda(self, lat, lon):
+        return int(lat // self._celda_lat), int(lon // self._celda_lon)
+
+    def nodo_mas_cercano(self, lat, lon):
+        """Retorna (nodo, distancia_m) del nodo más cercano a menos de max_ajuste_km, o (None, None)"""
+        fila0, col0 = self._celda(lat, lon)
+        max_anillo = int(math.ceil(self.max_ajuste_km / self.celda_km)) + 1
+        mejor, mejor_d2 = None, math.inf
+        for r in range(max_anillo + 1):
+            for fila in range(fila0 - r, fila0 + r + 1):
+                paso = 1 if fila in (fila0 - r, fila0 + r) else 2 * r
+                for col in range(col0 - r, col0 + r + 1, max(paso, 1)):
+                    for nodo in self._celdas.get((fila, col), ()):
+                        dy = (self.grafo.lat[nodo] - lat) * self._m_lat
+                        dx = (self.grafo.lon[nodo] - lon) * self._m_lon
+                        d2 = dx * dx + dy * dy
+                        if d2 < mejor_d2:
+                            mejor, mejor_d2 = nodo, d2
+            # Los anillos siguientes están al menos a r celdas completas
+            if mejor is not None and mejor_d2 <= (r * self.celda_km * 1000) ** 2:
+                break
+        if mejor is None or mejor_d2 > (self.max_ajuste_km * 1000) ** 2:
+            return None, None
+        return mejor, math.sqrt(mejor_d2)
+
+    def _buscar(self, origen, destino):
+        # A* por tiempo. Retorna (aristas del camino o None si no hay camino, nodos explorados).
+        g = self.grafo
+        inicio, destinos, segundos = g.inicio, g.destino, g.segundos
+        (d1, d1t, h1, h1t), (d2, d2t, h2, h2t), (d3, d3t, h3, h3t), (d4, d4t, h4, h4t) = self._cotas(origen, destino)
+
+        costo = [math.inf] * g.num_nodos
+        costo[origen] = 0.0
+        llegada = {origen: -1}   # { nodo: arista por la que se llegó }
+        cerrados = bytearray(g.num_nodos)
+        explorados = 0
+        frontera = [(0.0, origen)]
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while frontera:
+            _, nodo = heappop(frontera)
+            if nodo == destino:
+                break
+            if cerrados[nodo]:
+                continue
+            cerrados[nodo] = 1
+            explorados += 1
+            base = costo[nodo]
+            for arista in range(inicio[nodo], inicio[nodo + 1]):
+                vecino = destinos[arista]
+                nuevo = base + segundos[arista]
+                if nuevo < costo[vecino]:
+                    costo[vecino] = nuevo
+                    llegada[vecino] = arista
+                    # Cota inferior del tiempo restante (desigualdad triangular con cada marca)
+                    restante = max(d1t - d1[vecino], h1[vecino] - h1t, d2t - d2[vecino], h2[vecino] - h2t,
+                                   d3t - d3[vecino], h3[vecino] - h3t, d4t - d4[vecino], h4[vecino] - h4t)
+                    heappush(frontera, (nuevo + restante, vecino))
+        else:
+            return None, explorados
+
+        camino = []
+        nodo = destino
+        while llegada[nodo] != -1:
+            arista = llegada[nodo]
+            camino.append(arista)
+            nodo = self._origen[arista]
+        camino.reverse()
+        return camino, explorados
+
+    def ruta(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """
+        Misma interfaz que ClienteOSRM.ruta.
+        Retorna: dict con distancia_km, tiempo_minutos y geometria (GeoJSON)
+                 None si algún extremo está lejos de la red o no hay camino
+        """
+        origen, _ = self.nodo_mas_cercano(origen_lat, origen_lon)
+        destino, _ = self.nodo_mas_cercano(destino_lat, destino_lon)
+        camino, explorados = None, 0
+        if origen is not None and destino is not None:
+            camino, explorados = ([], 0) if origen == destino else self._buscar(origen, destino)
+        with self._lock:
+            self._consultas += 1
+            self._explorados += explorados
+            if camino is None:
+                self._sin_ruta += 1
+        if camino is None:
+            return None
+
+        g = self.grafo
+        coordenadas = [[g.lon[origen], g.lat[origen]]]
+        metros = segundos = 0.0
+        for arista in camino:
+            metros += g.metros[arista]
+            segundos += g.segundos[arista]
+            for punto in range(g.forma_inicio[arista], g.forma_inicio[arista + 1]):
+                coordenadas.append([g.forma_lon[punto], g.forma_lat[punto]])
+            fin = g.destino[arista]
+            coordenadas.append([g.lon[fin], g.lat[fin]])
+        if len(coordenadas) == 1:
+            coordenadas.append(coordenadas[0])
+        return {
+            'distancia_km': round(metros / 1000, 2),
+            'tiempo_minutos': int(segundos / 60),
+            'geometria': {"type": "LineString", "coordinates": coordenadas}
+        }
+
+    async def ruta_async(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        """Para el modo ASGI: la búsqueda corre en un hilo para no frenar el bucle"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.ruta, origen_lat, origen_lon, destino_lat, destino_lon
+        )
+
+    def disponible(self, timeout=5):
+        """El grafo está en memoria: disponible si tiene nodos"""
+        return self.grafo.num_nodos > 0
+
+    def en_paralelo(self, funcion, argumentos):
+        """Misma interfaz que ClienteOSRM.en_paralelo; la búsqueda es CPU, se resuelve en orden en este hilo"""
+        return [funcion(*args) for args in argumentos]
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "backend": "local",
+                "nodos": self.grafo.num_nodos,
+                "aristas": self.grafo.num_aristas,
+                "marcas": len(self._desde_marca),
+                "consultas": self._consultas,
+                "sin_ruta": self._sin_ruta,
+                "nodos_explorados_promedio": round(self._explorados / self._consultas, 1) if self._consultas else 0.0
+            }
@@ -1,12 +1,122 @@
+import asyncio
+import atexit
+import hmac
+import json
 import math
+import os
+import random
 import time
-import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import threading
-
-
-BUS_POSITIONS = {}   # { idBus: {empresa, ruta, lat, lon, vel, timestamp} }
+from cache_osrm import CacheRutasOSRM
+from cliente_osrm import ClienteOSRM
+from ruteo_local import MotorRutasLocal
+from cortocircuito_ruteo import CortocircuitoRuteo, CircuitoAbierto, CERRADO, ABIERTO, SEMIABIERTO
+from tablero_llegadas import TableroLlegadas, NO_HAY_BUSES
+from simulador import MotorSimulacion
+from estado_buses import AlmacenBuses
+from estado_compartido import AlmacenBusesCompartido
+from persistencia_buses import PersistenciaBuses
+from red_gtfs import cargar_red, huella_feed
+from red_rutas import RedRutas, normalizar_rutas, normalizar_tarifas
+from difusion_buses import DifusorBuses
+from metricas import RegistroMetricas, TIPO_CONTENIDO as TIPO_METRICAS
+import formato_binario
+
+
+# Configuración del cache de rutas OSRM
+OSRM_CACHE_MAX_ENTRADAS = int(os.environ.get("OSRM_CACHE_MAX_ENTRADAS", 5000))
+OSRM_CACHE_TTL_SEGUNDOS = int(os.environ.get("OSRM_CACHE_TTL_SEGUNDOS", 6 * 3600))
+OSRM_CACHE_RESOLUCION = float(os.environ.get("OSRM_CACHE_RESOLUCION", 0.0005))  # grados (~55 m)
+OSRM_CACHE_ARCHIVO = os.environ.get("OSRM_CACHE_ARCHIVO")  # None -> solo en memoria
+OSRM_CACHE_MAX_ENTRADAS_DISCO = int(os.environ.get("OSRM_CACHE_MAX_ENTRADAS_DISCO", 50000))
+OSRM_CACHE_PURGA_SEGUNDOS = float(os.environ.get("OSRM_CACHE_PURGA_SEGUNDOS", 600))
+
+CACHE_OSRM = CacheRutasOSRM(
+    max_entradas=OSRM_CACHE_MAX_ENTRADAS,
+    ttl_segundos=OSRM_CACHE_TTL_SEGUNDOS,
+    resolucion=OSRM_CACHE_RESOLUCION,
+    archivo=OSRM_CACHE_ARCHIVO,
+    max_entradas_disco=OSRM_CACHE_MAX_ENTRADAS_DISCO,
+    purga_segundos=OSRM_CACHE_PURGA_SEGUNDOS
+)
+
+# Configuración del cliente OSRM (pool de conexiones keep-alive compartido)
+OSRM_URL = os.environ.get("OSRM_URL", "http://router.project-osrm.org")
+OSRM_POOL_CONEXIONES = int(os.environ.get("OSRM_POOL_CONEXIONES", 20))
+OSRM_TIMEOUT_CONEXION = float(os.environ.get("OSRM_TIMEOUT_CONEXION", 3.05))
+OSRM_TIMEOUT_LECTURA = float(os.environ.get("OSRM_TIMEOUT_LECTURA", 10))
+OSRM_HILOS = int(os.environ.get("OSRM_HILOS", 8))  # consultas de tramos en paralelo
+OSRM_CONEXIONES_ASYNC = int(os.environ.get("OSRM_CONEXIONES_ASYNC", 200))  # solo modo ASGI (servidor_asgi.py)
+
+CLIENTE_OSRM = ClienteOSRM(
+    url_base=OSRM_URL,
+    pool_conexiones=OSRM_POOL_CONEXIONES,
+    timeout_conexion=OSRM_TIMEOUT_CONEXION,
+    timeout_lectura=OSRM_TIMEOUT_LECTURA,
+    hilos=OSRM_HILOS,
+    conexiones_async=OSRM_CONEXIONES_ASYNC
+)
+
+# Backend de ruteo: "osrm" (servidor OSRM_URL) o "local" (grafo de RUTEO_GRAFO, ver grafo_vial.py)
+RUTEO_BACKEND = os.environ.get("RUTEO_BACKEND", "osrm")
+RUTEO_GRAFO = os.environ.get("RUTEO_GRAFO")
+
+# Cortocircuito de OSRM: tras N fallos o respuestas lentas seguidas se usa el método estático sin esperar
+OSRM_CORTOCIRCUITO_FALLOS = int(os.environ.get("OSRM_CORTOCIRCUITO_FALLOS", 5))
+OSRM_PRESUPUESTO_SEGUNDOS = float(os.environ.get("OSRM_PRESUPUESTO_SEGUNDOS", 2.0))      # más lento cuenta como fallo
+OSRM_CORTOCIRCUITO_ESPERA = float(os.environ.get("OSRM_CORTOCIRCUITO_ESPERA", 30))       # abierto antes de volver a probar
+OSRM_MONITOR_INTERVALO = float(os.environ.get("OSRM_MONITOR_INTERVALO", 10))             # segundos entre sondas de salud
+
+if RUTEO_BACKEND == "local":
+    if not RUTEO_GRAFO:
+        raise RuntimeError("RUTEO_BACKEND=local requiere RUTEO_GRAFO (generarlo con: python grafo_vial.py extracto.osm grafo.bin)")
+    RUTEADOR = MotorRutasLocal.desde_archivo(RUTEO_GRAFO)
+elif RUTEO_BACKEND == "osrm":
+    RUTEADOR = CortocircuitoRuteo(
+        CLIENTE_OSRM,
+        max_fallos=OSRM_CORTOCIRCUITO_FALLOS,
+        presupuesto_s=OSRM_PRESUPUESTO_SEGUNDOS,
+        espera_s=OSRM_CORTOCIRCUITO_ESPERA
+    )
+    RUTEADOR.iniciar_monitor(OSRM_MONITOR_INTERVALO)
+else:
+    raise RuntimeError(f"RUTEO_BACKEND desconocido: {RUTEO_BACKEND} (usar 'osrm' o 'local')")
+
+# Estado de los buses: { idBus: {empresa, ruta, lat, lon, vel, timestamp, ...} } en formato compacto
+BUS_TTL_SEGUNDOS = int(os.environ.get("BUS_TTL_SEGUNDOS", 300))        # sin reportes -> se elimina
+BUS_MAX_RASTREADOS = int(os.environ.get("BUS_MAX_RASTREADOS", 50000))  # al superarlo se elimina el más antiguo
+BUS_CELDA_KM = float(os.environ.get("BUS_CELDA_KM", 0.25))           # grilla para ?bbox= y ?near=
+
+# Con varios workers (gunicorn -w N) el estado se comparte en un archivo mapeado en memoria
+BUS_MEMORIA_COMPARTIDA = os.environ.get("BUS_MEMORIA_COMPARTIDA")           # p. ej. /dev/shm/rutaya-buses
+BUS_REPLICACION_INTERVALO = float(os.environ.get("BUS_REPLICACION_INTERVALO", 0.1))
+
+if BUS_MEMORIA_COMPARTIDA:
+    BUS_POSITIONS = AlmacenBusesCompartido(BUS_MEMORIA_COMPARTIDA, ttl_segundos=BUS_TTL_SEGUNDOS,
+                                           max_buses=BUS_MAX_RASTREADOS, celda_km=BUS_CELDA_KM, lat_ref=2.44)
+    BUS_POSITIONS.iniciar_replicacion(BUS_REPLICACION_INTERVALO)
+else:
+    BUS_POSITIONS = AlmacenBuses(ttl_segundos=BUS_TTL_SEGUNDOS, max_buses=BUS_MAX_RASTREADOS,
+                                 celda_km=BUS_CELDA_KM, lat_ref=2.44)   # latitud de Popayán
+BUS_POSITIONS.iniciar_expiracion()
+
+
+def _leer_intervalos_por_ruta(texto):
+    """ "TransPubenza:1=0.5,Sotracauca:3=2" -> { ("TransPubenza", 1): 0.5, ("Sotracauca", 3): 2.0 } """
+    intervalos = {}
+    for parte in filter(None, (p.strip() for p in (texto or "").split(","))):
+        clave, segundos = parte.rsplit("=", 1)
+        empresa, num = clave.rsplit(":", 1)
+        intervalos[(empresa.strip(), int(num))] = float(segundos)
+    return intervalos
+
+
+# Tablero de próximas llegadas por parada: cada ruta se recalcula como mucho una vez por intervalo
+LLEGADAS_INTERVALO_SEGUNDOS = float(os.environ.get("LLEGADAS_INTERVALO_SEGUNDOS", 1.0))
+LLEGADAS_INTERVALO_POR_RUTA = _leer_intervalos_por_ruta(os.environ.get("LLEGADAS_INTERVALO_POR_RUTA"))
+LLEGADAS_EDAD_MAXIMA = float(os.environ.get("LLEGADAS_EDAD_MAXIMA", 30))   # recálculo aunque no haya reportes
 
 # In-memory routes database
 RUTAS_DATABASE = {
@@ -66,6 +176,17 @@ TARIFAS = {
     "TransTambo": 3000
 }
 
+# Red real desde un feed GTFS (carpeta o .zip) en lugar de las rutas de ejemplo de arriba.
+# La primera carga compila un cache binario; los arranques siguientes solo lo mapean (ver red_gtfs.py).
+GTFS_RUTA = os.environ.get("GTFS_RUTA")
+GTFS_CACHE = os.environ.get("GTFS_CACHE")   # None -> GTFS_RUTA + ".rutaya.bin"
+RED_GTFS = None
+if GTFS_RUTA:
+    RED_GTFS = cargar_red(GTFS_RUTA, GTFS_CACHE)
+    RUTAS_DATABASE = RED_GTFS.rutas
+    if RED_GTFS.tarifas:   # si el feed no trae tarifas se conservan las de TARIFAS
+        TARIFAS = RED_GTFS.tarifas
+
 # Helper functions
 def distancia_haversine(lat1, lon1, lat2, lon2):
     """
@@ -80,17 +201,167 @@ def distancia_haversine(lat1, lon1, lat2, lon2):
 
 
 def encontrar_parada_mas_cercana(punto_lat, punto_lon, ruta_paradas):
-    mejores = []
+    mejor = None
     for parada in ruta_paradas:
         d = distancia_haversine(punto_lat, punto_lon, parada['lat'], parada['lon'])
-        mejores.append((d, parada))
-    mejores.sort(key=lambda x: x[0])
-    return mejores[0]  # distancia, parada
+        if mejor is None or d < mejor[0]:
+            mejor = (d, parada)
+    return mejor  # distancia, parada
+
+
+# Red de rutas vigente: paradas, tarifas y estructuras derivadas de una misma versión (ver red_rutas.py).
+# Una recarga construye la versión nueva a un lado y la publica con una sola asignación; cada consulta
+# lee RED_VIGENTE una vez y termina con esa versión. El lock solo ordena las recargas entre sí.
+RED_VIGENTE = None   # se publica al final del módulo (el tablero usa funciones definidas más abajo)
+_RECARGA_LOCK = threading.Lock()
+
+
+def red_vigente():
+    """Retorna la RedRutas vigente (leerla una vez por consulta y usar esa misma hasta el final)"""
+    return RED_VIGENTE
+
+
+def _crear_tablero(tablas):
+    return TableroLlegadas(
+        tablas, obtener_buses_en_ruta, eta_bus_en_ruta,
+        intervalo=LLEGADAS_INTERVALO_SEGUNDOS,
+        intervalo_por_ruta=LLEGADAS_INTERVALO_POR_RUTA,
+        edad_maxima=LLEGADAS_EDAD_MAXIMA
+    )
+
+
+def recargar_red(rutas=None, tarifas=None, origen="admin"):
+    """
+    Construye una nueva versión de la red y la publica.
+    rutas: { empresa: { numeroRuta: [paradas] } }; None -> volver a leer el feed de GTFS_RUTA
+    tarifas: { empresa: precio }; None -> las del feed, o las vigentes si no trae
+    Las consultas en curso no esperan ni ven una mezcla de versiones.
+    Retorna la RedRutas publicada; lanza ValueError si no hay de dónde leer las rutas.
+    """
+    global RED_VIGENTE, RED_GTFS, RUTAS_DATABASE, TARIFAS
+    with _RECARGA_LOCK:
+        red_gtfs = None
+        if rutas is None:
+            if not GTFS_RUTA:
+                raise ValueError("No hay feed GTFS configurado (GTFS_RUTA): enviar 'rutas' en el cuerpo")
+            red_gtfs = cargar_red(GTFS_RUTA, GTFS_CACHE)
+            rutas, origen = red_gtfs.rutas, "gtfs"
+            if tarifas is None and red_gtfs.tarifas:
+                tarifas = red_gtfs.tarifas
+        if not rutas:
+            raise ValueError("La red nueva no tiene rutas")
+        anterior = RED_VIGENTE
+        red = RedRutas(rutas, TARIFAS if tarifas is None else tarifas, distancia_haversine,
+                       version=1 if anterior is None else anterior.version + 1,
+                       origen=origen, crear_tablero=_crear_tablero)
+        RED_VIGENTE = red
+        if red_gtfs is not None:
+            RED_GTFS = red_gtfs
+        # Nombres anteriores, para scripts que todavía los leen (no modificarlos: usar recargar_red)
+        RUTAS_DATABASE, TARIFAS = red.rutas, red.tarifas
+    return red
+
+
+def _vigilar_gtfs(intervalo, huella):
+    """
+    Hilo: recarga la red cuando el feed de GTFS_RUTA cambia respecto de `huella` (la del feed
+    cargado) y deja de cambiar por un intervalo
+    """
+    publicada = vista = huella
+    while True:
+        time.sleep(intervalo)
+        try:
+            actual = huella_feed(GTFS_RUTA)
+        except OSError:
+            continue   # el feed se está reemplazando
+        if actual != publicada and actual == vista:   # copia terminada: igual en dos lecturas
+            publicada = actual
+            try:
+                red = recargar_red()
+                _safe_print(f"🔁 Red de rutas recargada desde {GTFS_RUTA}: versión {red.version}, "
+                            f"{len(red.tablas)} rutas ({red.ms_construccion:.0f} ms)")
+            except Exception as e:
+                _safe_print(f"❌ No se pudo recargar {GTFS_RUTA} (se conserva la versión vigente): {e}")
+        vista = actual
+
+
+def obtener_indice_paradas():
+    """Retorna el IndiceParadas vigente"""
+    return RED_VIGENTE.indice
+
+
+def obtener_tabla_ruta(empresa, numeroRuta):
+    """
+    Retorna la TablaRuta (distancia/tiempo acumulados) de una ruta, o None si no existe.
+    tabla.distancia_km(orden_o, orden_d) y tabla.tiempo_min(orden_o, orden_d) son O(1).
+    """
+    return RED_VIGENTE.tablas.get((empresa, numeroRuta))
+
+
+def obtener_estimador_lote():
+    """Retorna el EstimadorLote vigente"""
+    return RED_VIGENTE.lote
+
+
+def obtener_emparejador():
+    """Retorna el EmparejadorRutas vigente (proyección de reportes GPS sobre las rutas)"""
+    return RED_VIGENTE.emparejador
+
+
+def obtener_tablero_llegadas():
+    """Retorna el TableroLlegadas vigente"""
+    return RED_VIGENTE.tablero
+
+
+def _marcar_rutas_replicadas(rutas):
+    # Buses movidos por otros workers (memoria compartida): recalcular sus llegadas en este
+    red = RED_VIGENTE
+    if red is None:
+        return
+    for empresa, ruta in rutas:
+        red.tablero.marcar(empresa, ruta)
+
+
+if BUS_MEMORIA_COMPARTIDA:
+    BUS_POSITIONS.al_replicar = _marcar_rutas_replicadas
+
+
+def ruta_mas_cercana_a_ambos(origen_lat, origen_lon, destino_lat, destino_lon, radio_km=1.0, red=None):
+    """
+    Ruta que minimiza distancia(origen, su parada más cercana) + distancia(destino, su parada más cercana).
+    Primero busca con el índice dentro de radio_km; si el mejor total supera radio_km
+    (podría existir una ruta más lejana de un lado y mejor en suma) recorre todas las rutas.
+    red: RedRutas a consultar (None -> la vigente)
+    Retorna: (empresa, numeroRuta) o None si no hay rutas
+    """
+    red = red or RED_VIGENTE
+    indice = red.indice
+    cerca_o = indice.mas_cercana_por_ruta(origen_lat, origen_lon, radio_km)
+    cerca_d = indice.mas_cercana_por_ruta(destino_lat, destino_lon, radio_km)
+    mejor = None
+    mejor_dist = float('inf')
+    for clave, (dist_o, _) in cerca_o.items():
+        if clave in cerca_d and dist_o + cerca_d[clave][0] < mejor_dist:
+            mejor_dist = dist_o + cerca_d[clave][0]
+            mejor = clave
+    if mejor is not None and mejor_dist <= radio_km:
+        return mejor
+
+    for emp, rutas_dict in red.rutas.items():
+        for num, paradas in rutas_dict.items():
+            dist_o, _ = encontrar_parada_mas_cercana(origen_lat, origen_lon, paradas)
+            dist_d, _ = encontrar_parada_mas_cercana(destino_lat, destino_lon, paradas)
+            if dist_o + dist_d < mejor_dist:
+                mejor_dist = dist_o + dist_d
+                mejor = (emp, num)
+    return mejor
 
 
 def validar_coordenadas(lat, lon):
     if not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)):
         return False
+    if not math.isfinite(lat) or not math.isfinite(lon):
+        return False
     if lat < 2.3 or lat > 2.5:
         return False
     if lon < -76.7 or lon > -76.5:
@@ -98,43 +369,117 @@ def validar_coordenadas(lat, lon):
     return True
 
 
+def _cache_osrm_obtener(clave):
+    """Consulta CACHE_OSRM; si el cache falla cuenta como miss (no es un error de OSRM)"""
+    try:
+        return CACHE_OSRM.obtener(clave)
+    except Exception as e:
+        _safe_print(f"⚠️ Error al leer el cache OSRM: {str(e)}")
+        return None
+
+
+async def _cache_osrm_obtener_async(clave):
+    """Como _cache_osrm_obtener, pero el nivel en disco (SQLite) se consulta en un hilo, fuera del bucle"""
+    try:
+        cacheada = CACHE_OSRM.obtener_memoria(clave)
+        if cacheada is None and CACHE_OSRM.persistente:
+            cacheada = await asyncio.get_running_loop().run_in_executor(None, CACHE_OSRM.obtener_disco, clave)
+        if cacheada is None:
+            CACHE_OSRM.contar_miss()
+        return cacheada
+    except Exception as e:
+        _safe_print(f"⚠️ Error al leer el cache OSRM: {str(e)}")
+        return None
+
+
+def _cache_osrm_guardar(clave, resultado):
+    """Guarda en CACHE_OSRM; si el cache falla la ruta ya calculada se retorna igual"""
+    try:
+        CACHE_OSRM.guardar(clave, resultado)
+    except Exception as e:
+        _safe_print(f"⚠️ Error al guardar en el cache OSRM: {str(e)}")
+
+
 def calcular_ruta_osrm(origen_lat, origen_lon, destino_lat, destino_lon):
     """
-    Calcula ruta real usando OSRM API pública
+    Calcula ruta real usando el backend de ruteo (OSRM o grafo local, según RUTEO_BACKEND)
     Retorna: dict con distancia_km, tiempo_minutos, y geometría de la ruta
-             None si hay error
+             None si hay error o el cortocircuito de OSRM está abierto
+    Las respuestas exitosas se guardan en CACHE_OSRM (coordenadas ajustadas a grilla)
     """
+    clave = CACHE_OSRM.clave(origen_lat, origen_lon, destino_lat, destino_lon)
+    cacheada = _cache_osrm_obtener(clave)
+    if cacheada is not None:
+        METRICA_OSRM_CACHE.inc()
+        return cacheada
+
+    inicio = time.perf_counter()
     try:
-        # OSRM espera lon,lat (no lat,lon)
-        url = f"http://router.project-osrm.org/route/v1/driving/{origen_lon},{origen_lat};{destino_lon},{destino_lat}"
-        params = {
-            "overview": "full",
-            "geometries": "geojson",
-            "steps": "false"
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        
-        if response.status_code != 200:
-            return None
-            
-        data = response.json()
-        
-        if data.get('code') != 'Ok' or not data.get('routes'):
-            return None
-        
-        route = data['routes'][0]
-        distancia_metros = route['distance']
-        tiempo_segundos = route['duration']
-        
-        return {
-            'distancia_km': round(distancia_metros / 1000, 2),
-            'tiempo_minutos': int(tiempo_segundos / 60),
-            'geometria': route.get('geometry', None)
-        }
+        resultado = RUTEADOR.ruta(origen_lat, origen_lon, destino_lat, destino_lon)
+    except CircuitoAbierto:
+        # No salió a la red: no entra en el histograma de duración
+        METRICA_OSRM_RECHAZADAS.inc()
+        return None
     except Exception as e:
+        METRICA_OSRM_DURACION.observar(time.perf_counter() - inicio, ("error",))
         _safe_print(f"⚠️ Error al consultar OSRM: {str(e)}")
         return None
+    METRICA_OSRM_DURACION.observar(time.perf_counter() - inicio, ("ok" if resultado is not None else "sin_ruta",))
+    if resultado is not None:
+        _cache_osrm_guardar(clave, resultado)
+    return resultado
+
+
+async def calcular_ruta_osrm_async(origen_lat, origen_lon, destino_lat, destino_lon):
+    """
+    Igual que calcular_ruta_osrm, esperando a OSRM sin bloquear (modo ASGI).
+    Guardar en el cache no bloquea (la escritura a disco la hace el hilo de CACHE_OSRM).
+    """
+    clave = CACHE_OSRM.clave(origen_lat, origen_lon, destino_lat, destino_lon)
+    cacheada = await _cache_osrm_obtener_async(clave)
+    if cacheada is not None:
+        METRICA_OSRM_CACHE.inc()
+        return cacheada
+
+    inicio = time.perf_counter()
+    try:
+        resultado = await RUTEADOR.ruta_async(origen_lat, origen_lon, destino_lat, destino_lon)
+    except CircuitoAbierto:
+        METRICA_OSRM_RECHAZADAS.inc()
+        return None
+    except Exception as e:
+        METRICA_OSRM_DURACION.observar(time.perf_counter() - inicio, ("error",))
+        _safe_print(f"⚠️ Error al consultar OSRM: {str(e)}")
+        return None
+    METRICA_OSRM_DURACION.observar(time.perf_counter() - inicio, ("ok" if resultado is not None else "sin_ruta",))
+    if resultado is not None:
+        _cache_osrm_guardar(clave, resultado)
+    return resultado
+
+
+# Bucle de asyncio del modo ASGI; si está definido, los tramos del simulador se piden por ahí
+BUCLE_ASYNC = None
+
+
+def calcular_tramos_osrm(paradas):
+    """
+    Obtiene la ruta OSRM de cada tramo parada -> parada siguiente.
+    Los tramos se consultan en paralelo (los que están en cache no salen a la red): con el
+    pool de hilos de RUTEADOR, o en el modo ASGI como corutinas en BUCLE_ASYNC. No debe
+    llamarse desde el hilo del bucle (el simulador la llama desde sus hilos de preparación).
+    Retorna: lista con len(paradas) - 1 elementos (dict o None por tramo)
+    """
+    pares = [
+        (inicio['lat'], inicio['lon'], fin['lat'], fin['lon'])
+        for inicio, fin in zip(paradas, paradas[1:])
+    ]
+    if BUCLE_ASYNC is not None:
+        return asyncio.run_coroutine_threadsafe(calcular_tramos_osrm_async(pares), BUCLE_ASYNC).result()
+    return RUTEADOR.en_paralelo(calcular_ruta_osrm, pares)
+
+
+async def calcular_tramos_osrm_async(pares):
+    return list(await asyncio.gather(*(calcular_ruta_osrm_async(*par) for par in pares)))
 
 
 # Flask app
@@ -143,6 +488,72 @@ app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 
+# ==========================================================
+# Métricas (GET /metrics en formato Prometheus, ver metricas.py)
+# ==========================================================
+METRICAS = RegistroMetricas()
+METRICA_HTTP_DURACION = METRICAS.histograma(
+    "rutaya_http_duracion_segundos", "Duración de las peticiones por método y ruta", ("metodo", "ruta"))
+METRICA_HTTP_PETICIONES = METRICAS.contador(
+    "rutaya_http_peticiones_total", "Peticiones atendidas por método, ruta y código HTTP", ("metodo", "ruta", "codigo"))
+METRICA_OSRM_DURACION = METRICAS.histograma(
+    "rutaya_osrm_duracion_segundos",
+    "Consultas al backend de ruteo por resultado (ok, sin_ruta, error)", ("resultado",))
+METRICA_OSRM_CACHE = METRICAS.contador(
+    "rutaya_osrm_cache_aciertos_total", "Consultas de ruteo respondidas por CACHE_OSRM sin salir al backend")
+METRICA_OSRM_RECHAZADAS = METRICAS.contador(
+    "rutaya_osrm_rechazadas_total", "Consultas de ruteo rechazadas por el cortocircuito abierto sin salir al backend")
+METRICA_ESTIMACION = METRICAS.histograma(
+    "rutaya_estimacion_resolver_segundos",
+    "Tiempo de una estimación sin contar la consulta a OSRM (búsqueda de ruta y paradas), por método usado",
+    ("metodo",))
+METRICA_ESTIMACION_RESPALDO = METRICAS.contador(
+    "rutaya_estimacion_respaldo_total", "Estimaciones que necesitaban OSRM y usaron el método estático")
+METRICA_REPORTES_GPS = METRICAS.contador(
+    "rutaya_reportes_gps_total", "Reportes GPS recibidos por resultado (aplicado, descartado, rechazado)",
+    ("resultado",))
+METRICA_SIMULADOR_RETRASO = METRICAS.histograma(
+    "rutaya_simulador_retraso_segundos", "Atraso de cada paso del simulador respecto de su agenda")
+
+# Medidores: se calculan al exponer
+METRICAS.medidor("rutaya_buses_rastreados", "Buses en el almacén de posiciones", lambda: len(BUS_POSITIONS))
+METRICAS.medidor("rutaya_simulaciones_activas", "Buses simulados",
+                 lambda: MOTOR_SIMULACION.estadisticas()["buses"])
+METRICAS.medidor("rutaya_stream_suscriptores", "Clientes conectados a /api/buses/stream",
+                 lambda: DIFUSOR_BUSES.estadisticas()["suscriptores"])
+METRICAS.medidor("rutaya_osrm_cache_entradas", "Rutas guardadas en CACHE_OSRM",
+                 lambda: CACHE_OSRM.estadisticas()["entradas"])
+METRICAS.medidor("rutaya_osrm_cortocircuito", "Estado del cortocircuito de OSRM (1 en el estado actual)",
+                 lambda: {(estado,): int(RUTEADOR.estado == estado) for estado in (CERRADO, ABIERTO, SEMIABIERTO)}
+                 if isinstance(RUTEADOR, CortocircuitoRuteo) else {}, ("estado",))
+METRICAS.medidor("rutaya_red_version", "Versión publicada de la red de rutas", lambda: RED_VIGENTE.version)
+
+# Inicio de la petición en el entorno WSGI (el modo ASGI lo pone antes de atender sus rutas async)
+CLAVE_INICIO_PETICION = "rutaya.inicio"
+
+
+@app.before_request
+def _iniciar_medicion():
+    request.environ.setdefault(CLAVE_INICIO_PETICION, time.perf_counter())
+
+
+@app.after_request
+def _registrar_medicion(respuesta):
+    inicio = request.environ.get(CLAVE_INICIO_PETICION)
+    if inicio is not None:
+        # Por la regla de la ruta (/api/stops/<id_parada>/arrivals) y no por la URL: pocas series
+        ruta = request.url_rule.rule if request.url_rule is not None else "(sin ruta)"
+        METRICA_HTTP_DURACION.observar(time.perf_counter() - inicio, (request.method, ruta))
+        METRICA_HTTP_PETICIONES.inc(1, (request.method, ruta, str(respuesta.status_code)))
+    return respuesta
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus"""
+    return Response(METRICAS.exponer(), content_type=TIPO_METRICAS)
+
+
 def _safe_print(*args, **kwargs):
     """Print helper that avoids crashing on consoles with limited encodings (Windows cp1252)."""
     try:
@@ -156,11 +567,18 @@ def _safe_print(*args, **kwargs):
 @app.route('/api/health', methods=['GET'])
 def health():
     try:
-        empresas = list(RUTAS_DATABASE.keys())
+        red = red_vigente()
+        empresas = list(red.rutas.keys())
         return jsonify({
             "status": "online",
             "message": "Servidor funcionando correctamente",
-            "empresas_disponibles": empresas
+            "empresas_disponibles": empresas,
+            "red": red.resumen(),
+            "red_gtfs": RED_GTFS.resumen() if RED_GTFS is not None else None,
+            "buses": BUS_POSITIONS.estadisticas(),
+            "difusion": DIFUSOR_BUSES.estadisticas(),
+            "llegadas": red.tablero.estadisticas(),
+            "persistencia": PERSISTENCIA_BUSES.estadisticas() if PERSISTENCIA_BUSES is not None else None
         }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -209,7 +627,7 @@ def handle_internal_error(e):
 def listar_rutas():
     try:
         rutas = []
-        for empresa, rutas_dict in RUTAS_DATABASE.items():
+        for empresa, rutas_dict in red_vigente().rutas.items():
             for num, paradas in rutas_dict.items():
                 rutas.append({
                     "empresa": empresa,
@@ -226,200 +644,200 @@ def listar_rutas():
 @app.route('/api/routing-info', methods=['GET'])
 def routing_info():
     """Informa sobre los métodos de ruteo disponibles"""
-    # Probar si OSRM está disponible
-    osrm_disponible = False
-    try:
-        test_url = "http://router.project-osrm.org/route/v1/driving/-76.6147,2.4448;-76.6075,2.4520"
-        resp = requests.get(test_url, timeout=5)
-        osrm_disponible = (resp.status_code == 200)
-    except:
-        pass
-    
+    # Estado del monitor de salud (no consulta OSRM en cada llamada)
+    osrm_disponible = RUTEADOR.disponible()
+    if RUTEO_BACKEND == "local":
+        backend = RUTEADOR.estadisticas()
+    else:
+        backend = {"backend": "osrm", "url": OSRM_URL, "cortocircuito": RUTEADOR.estadisticas()}
+
     return jsonify({
         "metodos_disponibles": {
             "osrm": osrm_disponible,
             "estatico": True
         },
         "metodo_preferido": "osrm" if osrm_disponible else "estatico",
+        "backend_ruteo": backend,
+        "cache_osrm": CACHE_OSRM.estadisticas(),
         "mensaje": "OSRM calcula rutas reales. Estático usa rutas predefinidas."
     }), 200
 
 
-@app.route('/api/estimate-route', methods=['POST'])
-def estimate_route():
-    try:
-        payload = request.get_json(force=True)
-        # Validate required numeric fields
-        required = ['origenLat', 'origenLon', 'destinoLat', 'destinoLon']
-        for k in required:
-            if k not in payload:
-                return respuesta_error(400, "Faltan campos obligatorios: %s" % k)
-            if not isinstance(payload[k], (int, float)):
-                return respuesta_error(400, "El campo %s debe ser numérico" % k)
-
-        origenLat = payload['origenLat']
-        origenLon = payload['origenLon']
-        destinoLat = payload['destinoLat']
-        destinoLon = payload['destinoLon']
-        empresa = payload.get('empresa', '')
-        numeroRuta = payload.get('numeroRuta', 0)
-
-        # Optional fields type validation
-        if 'empresa' in payload and payload.get('empresa') is not None and not isinstance(payload.get('empresa'), str):
-            return respuesta_error(400, "El campo 'empresa' debe ser una cadena")
-
-        if 'numeroRuta' in payload and payload.get('numeroRuta') is not None:
-            if not isinstance(payload.get('numeroRuta'), int):
-                # accept float that are integers (e.g., 1.0)
-                if isinstance(payload.get('numeroRuta'), float) and payload.get('numeroRuta').is_integer():
-                    numeroRuta = int(payload.get('numeroRuta'))
-                else:
-                    return respuesta_error(400, "El campo 'numeroRuta' debe ser un entero")
-
-        # Validate ranges
-        if not validar_coordenadas(origenLat, origenLon) or not validar_coordenadas(destinoLat, destinoLon):
-            return respuesta_error(400, "Coordenadas fuera del rango válido para Popayán")
-
-        metodo_usado = "estatico"  # Default
-        
-        # Default behavior if empresa/numeroRuta not provided: try OSRM first
-        if empresa == '' or numeroRuta == 0:
-            # Intentar calcular ruta dinámica con OSRM
-            ruta_osrm = calcular_ruta_osrm(origenLat, origenLon, destinoLat, destinoLon)
-            
-            if ruta_osrm is not None:
-                # OSRM exitoso - usar ruta dinámica
-                metodo_usado = "osrm"
-                distancia_km = ruta_osrm['distancia_km']
-                tiempo_total = ruta_osrm['tiempo_minutos']
-                
-                # Encontrar la empresa/ruta más cercana para determinar tarifa
-                mejor_empresa = None
-                mejor_dist = float('inf')
-                for emp, rutas_dict in RUTAS_DATABASE.items():
-                    for num, paradas in rutas_dict.items():
-                        dist_o, _ = encontrar_parada_mas_cercana(origenLat, origenLon, paradas)
-                        dist_d, _ = encontrar_parada_mas_cercana(destinoLat, destinoLon, paradas)
-                        dist_total = dist_o + dist_d
-                        if dist_total < mejor_dist:
-                            mejor_dist = dist_total
-                            mejor_empresa = (emp, num)
-                
-                if mejor_empresa:
-                    empresa = mejor_empresa[0]
-                    numeroRuta = mejor_empresa[1]
-                else:
-                    # Usar primera empresa por defecto
-                    empresa = list(RUTAS_DATABASE.keys())[0]
-                    numeroRuta = list(RUTAS_DATABASE[empresa].keys())[0]
-                
-                # Crear paradas virtuales para compatibilidad con respuesta
-                paradaOrigen = {
-                    "nombre": f"Origen ({origenLat:.4f}, {origenLon:.4f})",
-                    "lat": origenLat,
-                    "lon": origenLon,
-                    "orden": 1
-                }
-                paradaDestino = {
-                    "nombre": f"Destino ({destinoLat:.4f}, {destinoLon:.4f})",
-                    "lat": destinoLat,
-                    "lon": destinoLon,
-                    "orden": 2
-                }
+def validar_payload_estimacion(payload):
+    """
+    Valida el cuerpo de /api/estimate-route.
+    Retorna: ((origenLat, origenLon, destinoLat, destinoLon, empresa, numeroRuta), None)
+             (None, mensaje_error) si no es válido
+    """
+    if not isinstance(payload, dict):
+        return None, "El cuerpo debe ser un objeto JSON"
+    # Validate required numeric fields
+    required = ['origenLat', 'origenLon', 'destinoLat', 'destinoLon']
+    for k in required:
+        if k not in payload:
+            return None, "Faltan campos obligatorios: %s" % k
+        if not isinstance(payload[k], (int, float)):
+            return None, "El campo %s debe ser numérico" % k
+
+    origenLat = payload['origenLat']
+    origenLon = payload['origenLon']
+    destinoLat = payload['destinoLat']
+    destinoLon = payload['destinoLon']
+    empresa = payload.get('empresa', '')
+    numeroRuta = payload.get('numeroRuta', 0)
+
+    # Optional fields type validation
+    if 'empresa' in payload and payload.get('empresa') is not None and not isinstance(payload.get('empresa'), str):
+        return None, "El campo 'empresa' debe ser una cadena"
+
+    if 'numeroRuta' in payload and payload.get('numeroRuta') is not None:
+        if not isinstance(payload.get('numeroRuta'), int):
+            # accept float that are integers (e.g., 1.0)
+            if isinstance(payload.get('numeroRuta'), float) and payload.get('numeroRuta').is_integer():
+                numeroRuta = int(payload.get('numeroRuta'))
             else:
-                # OSRM falló - usar método estático
-                _safe_print("⚠️ OSRM no disponible, usando rutas estáticas")
-                mejor_comb = None
-                for emp, rutas_dict in RUTAS_DATABASE.items():
-                    for num, paradas in rutas_dict.items():
-                        dist_o, parada_o = encontrar_parada_mas_cercana(origenLat, origenLon, paradas)
-                        dist_d, parada_d = encontrar_parada_mas_cercana(destinoLat, destinoLon, paradas)
-                        if dist_o <= 1.0 and dist_d <= 1.0 and parada_o['orden'] <= parada_d['orden']:
-                            # compute total distance along route
-                            total_km = calcular_distancia_entre_paradas(paradas, parada_o['orden'], parada_d['orden'])
-                            if mejor_comb is None or total_km < mejor_comb[0]:
-                                mejor_comb = (total_km, emp, num, parada_o, parada_d)
-                if mejor_comb is None:
-                    return respuesta_error(404, "No se encontró una ruta válida cerca de los puntos seleccionados")
-                distancia_km = mejor_comb[0]
-                empresa = mejor_comb[1]
-                numeroRuta = mejor_comb[2]
-                paradaOrigen = mejor_comb[3]
-                paradaDestino = mejor_comb[4]
-                
-                # Calcular tiempo para método estático
-                tiempo_viaje_minutos = (distancia_km / 20.0) * 60.0
-                numero_paradas = abs(paradaDestino['orden'] - paradaOrigen['orden'])
-                tiempo_paradas_minutos = numero_paradas * 2
-                tiempo_total = int(round(tiempo_viaje_minutos + tiempo_paradas_minutos))
-        else:
-            # Validate empresa
-            if empresa not in RUTAS_DATABASE:
-                return respuesta_error(404, "Empresa %s no encontrada" % empresa)
-            if numeroRuta not in RUTAS_DATABASE[empresa]:
-                return respuesta_error(404, "La ruta %d no existe para la empresa %s" % (numeroRuta, empresa))
-
-            paradas = RUTAS_DATABASE[empresa][numeroRuta]
-            dist_o, paradaOrigen = encontrar_parada_mas_cercana(origenLat, origenLon, paradas)
-            dist_d, paradaDestino = encontrar_parada_mas_cercana(destinoLat, destinoLon, paradas)
+                return None, "El campo 'numeroRuta' debe ser un entero"
 
-            if dist_o > 1.0 or dist_d > 1.0:
-                return respuesta_error(400, "Los puntos están muy lejos de la ruta")
+    # Validate ranges
+    if not validar_coordenadas(origenLat, origenLon) or not validar_coordenadas(destinoLat, destinoLon):
+        return None, "Coordenadas fuera del rango válido para Popayán"
 
-            if paradaOrigen['orden'] > paradaDestino['orden']:
-                return respuesta_error(400, "El orden de paradas sugiere que el destino está antes que el origen en la ruta")
+    return (origenLat, origenLon, destinoLat, destinoLon, empresa, numeroRuta), None
 
-            distancia_km = calcular_distancia_entre_paradas(paradas, paradaOrigen['orden'], paradaDestino['orden'])
-            
-            # Calcular tiempo para método estático
-            tiempo_viaje_minutos = (distancia_km / 20.0) * 60.0
-            numero_paradas = abs(paradaDestino['orden'] - paradaOrigen['orden'])
-            tiempo_paradas_minutos = numero_paradas * 2
-            tiempo_total = int(round(tiempo_viaje_minutos + tiempo_paradas_minutos))
 
+def necesita_osrm(datos):
+    """Sin empresa/numeroRuta la estimación intenta primero una ruta dinámica con OSRM"""
+    return datos[4] == '' or datos[5] == 0
 
-        costo = TARIFAS.get(empresa, 0)
-        distancia_km_rounded = round(distancia_km, 2)
 
-        # Build canonical success response with controlled types and fields
-        respuesta = {
-            "success": True,
-            "metodo": metodo_usado,
-            "empresa": str(empresa),
-            "numeroRuta": int(numeroRuta),
-            "paradaOrigen": {
-                "nombre": str(paradaOrigen.get('nombre', '')),
-                "lat": float(paradaOrigen.get('lat', 0.0)),
-                "lon": float(paradaOrigen.get('lon', 0.0)),
-                "orden": int(paradaOrigen.get('orden', 0))
-            },
-            "paradaDestino": {
-                "nombre": str(paradaDestino.get('nombre', '')),
-                "lat": float(paradaDestino.get('lat', 0.0)),
-                "lon": float(paradaDestino.get('lon', 0.0)),
-                "orden": int(paradaDestino.get('orden', 0))
-            },
-            "tiempoEstimadoMinutos": int(tiempo_total),
-            "distanciaKm": float(distancia_km_rounded),
-            "costo": int(costo),
-            "mensaje": f"Ruta calculada exitosamente con {metodo_usado.upper()}"
-        }
-
-        # -------------------------------------------
-        # NUEVO BLOQUE PARA ENVIAR GEOMETRÍA A ANDROID
-        # -------------------------------------------
-        if metodo_usado == "osrm" and ruta_osrm is not None and "geometria" in ruta_osrm:
-            respuesta["geometria"] = ruta_osrm["geometria"]   # GeoJSON válido
+def resolver_estimacion(datos, ruta_osrm):
+    """
+    Arma la respuesta de /api/estimate-route a partir del payload validado y de la ruta
+    OSRM ya consultada (None si no hacía falta o falló). Compartida por el servidor Flask
+    y el modo ASGI (servidor_asgi.py), que solo difieren en cómo esperan a OSRM.
+    Retorna: (codigo_http, cuerpo)
+    """
+    inicio = time.perf_counter()
+    origenLat, origenLon, destinoLat, destinoLon, empresa, numeroRuta = datos
+    red = red_vigente()   # toda la estimación con la misma versión de la red
+
+    metodo_usado = "estatico"  # Default
+
+    # Default behavior if empresa/numeroRuta not provided: try OSRM first
+    if necesita_osrm(datos):
+        if ruta_osrm is not None:
+            # OSRM exitoso - usar ruta dinámica
+            metodo_usado = "osrm"
+            distancia_km = ruta_osrm['distancia_km']
+            tiempo_total = ruta_osrm['tiempo_minutos']
+            
+            # Encontrar la empresa/ruta más cercana para determinar tarifa
+            mejor_empresa = ruta_mas_cercana_a_ambos(origenLat, origenLon, destinoLat, destinoLon, red=red)
+            
+            if mejor_empresa:
+                empresa = mejor_empresa[0]
+                numeroRuta = mejor_empresa[1]
+            else:
+                # Usar primera empresa por defecto
+                empresa = list(red.rutas.keys())[0]
+                numeroRuta = list(red.rutas[empresa].keys())[0]
+            
+            # Crear paradas virtuales para compatibilidad con respuesta
+            paradaOrigen = {
+                "nombre": f"Origen ({origenLat:.4f}, {origenLon:.4f})",
+                "lat": origenLat,
+                "lon": origenLon,
+                "orden": 1
+            }
+            paradaDestino = {
+                "nombre": f"Destino ({destinoLat:.4f}, {destinoLon:.4f})",
+                "lat": destinoLat,
+                "lon": destinoLon,
+                "orden": 2
+            }
         else:
-            respuesta["geometria"] = None
-
+            # OSRM falló - usar método estático
+            _safe_print("⚠️ OSRM no disponible, usando rutas estáticas")
+            METRICA_ESTIMACION_RESPALDO.inc()
+            mejor_comb = None
+            indice = red.indice
+            cerca_o = indice.mas_cercana_por_ruta(origenLat, origenLon, 1.0)
+            cerca_d = indice.mas_cercana_por_ruta(destinoLat, destinoLon, 1.0)
+            for (emp, num), (dist_o, parada_o) in cerca_o.items():
+                if (emp, num) not in cerca_d:
+                    continue
+                dist_d, parada_d = cerca_d[(emp, num)]
+                if parada_o['orden'] <= parada_d['orden']:
+                    # compute total distance along route
+                    paradas = red.rutas[emp][num]
+                    total_km = calcular_distancia_entre_paradas(paradas, parada_o['orden'], parada_d['orden'], red)
+                    if mejor_comb is None or total_km < mejor_comb[0]:
+                        mejor_comb = (total_km, emp, num, parada_o, parada_d)
+            if mejor_comb is None:
+                return _error_estimacion(404, "No se encontró una ruta válida cerca de los puntos seleccionados")
+            distancia_km = mejor_comb[0]
+            empresa = mejor_comb[1]
+            numeroRuta = mejor_comb[2]
+            paradaOrigen = mejor_comb[3]
+            paradaDestino = mejor_comb[4]
+            tiempo_total = tiempo_estatico_minutos(distancia_km, paradaOrigen['orden'], paradaDestino['orden'])
+    else:
+        # Validate empresa
+        if empresa not in red.rutas:
+            return _error_estimacion(404, "Empresa %s no encontrada" % empresa)
+        if numeroRuta not in red.rutas[empresa]:
+            return _error_estimacion(404, "La ruta %d no existe para la empresa %s" % (numeroRuta, empresa))
+
+        paradas = red.rutas[empresa][numeroRuta]
+        dist_o, paradaOrigen = encontrar_parada_mas_cercana(origenLat, origenLon, paradas)
+        dist_d, paradaDestino = encontrar_parada_mas_cercana(destinoLat, destinoLon, paradas)
+
+        if dist_o > 1.0 or dist_d > 1.0:
+            return _error_estimacion(400, "Los puntos están muy lejos de la ruta")
+
+        if paradaOrigen['orden'] > paradaDestino['orden']:
+            return _error_estimacion(400, "El orden de paradas sugiere que el destino está antes que el origen en la ruta")
+
+        distancia_km = calcular_distancia_entre_paradas(paradas, paradaOrigen['orden'], paradaDestino['orden'], red)
+        tiempo_total = tiempo_estatico_minutos(distancia_km, paradaOrigen['orden'], paradaDestino['orden'])
+
+
+    costo = red.tarifas.get(empresa, 0)
+    distancia_km_rounded = round(distancia_km, 2)
+    respuesta = construir_respuesta_estimacion(
+        metodo_usado, empresa, numeroRuta, paradaOrigen, paradaDestino, tiempo_total, distancia_km, red
+    )
+
+    # -------------------------------------------
+    # NUEVO BLOQUE PARA ENVIAR GEOMETRÍA A ANDROID
+    # -------------------------------------------
+    if metodo_usado == "osrm" and ruta_osrm is not None and "geometria" in ruta_osrm:
+        respuesta["geometria"] = ruta_osrm["geometria"]   # GeoJSON válido
+
+
+    # Log to console (safe printing for environments without emoji support)
+    _safe_print(f"✅ Estimación calculada ({metodo_usado.upper()}): {empresa} Ruta {numeroRuta}")
+    _safe_print(f"   Desde: {paradaOrigen['nombre']} -> Hasta: {paradaDestino['nombre']}")
+    _safe_print(f"   Tiempo: {tiempo_total} min | Distancia: {distancia_km_rounded} km | Costo: ${costo}")
+
+    METRICA_ESTIMACION.observar(time.perf_counter() - inicio, (metodo_usado,))
+    return 200, respuesta
+
+
+def _error_estimacion(codigo_http, mensaje):
+    return codigo_http, cuerpo_error(mensaje)
 
-        # Log to console (safe printing for environments without emoji support)
-        _safe_print(f"✅ Estimación calculada ({metodo_usado.upper()}): {empresa} Ruta {numeroRuta}")
-        _safe_print(f"   Desde: {paradaOrigen['nombre']} -> Hasta: {paradaDestino['nombre']}")
-        _safe_print(f"   Tiempo: {tiempo_total} min | Distancia: {distancia_km_rounded} km | Costo: ${costo}")
 
-        return jsonify(respuesta), 200
+@app.route('/api/estimate-route', methods=['POST'])
+def estimate_route():
+    try:
+        payload = request.get_json(force=True)
+        datos, error = validar_payload_estimacion(payload)
+        if error is not None:
+            return respuesta_error(400, error)
+        ruta_osrm = calcular_ruta_osrm(*datos[:4]) if necesita_osrm(datos) else None
+        codigo, cuerpo = resolver_estimacion(datos, ruta_osrm)
+        return jsonify(cuerpo), codigo
 
     except Exception as e:
         _safe_print("❌ Error interno:", str(e))
@@ -428,9 +846,13 @@ def estimate_route():
 
 # Additional helpers
 
-def calcular_distancia_entre_paradas(paradas, orden_origen, orden_destino):
+def calcular_distancia_entre_paradas(paradas, orden_origen, orden_destino, red=None):
     if orden_destino < orden_origen:
         return 0.0
+    # Rutas de la red (la vigente si no se indica): resta sobre la tabla acumulada
+    tabla = (red or RED_VIGENTE).tablas_por_lista.get(id(paradas))
+    if tabla is not None and tabla.paradas is paradas:
+        return tabla.distancia_km(orden_origen, orden_destino)
     total = 0.0
     for ord_act in range(orden_origen, orden_destino):
         p1 = paradas[ord_act - 1]
@@ -439,8 +861,45 @@ def calcular_distancia_entre_paradas(paradas, orden_origen, orden_destino):
     return total
 
 
-def respuesta_error(codigo_http, mensaje):
-    err = {
+def tiempo_estatico_minutos(distancia_km, orden_origen, orden_destino):
+    """Tiempo del método estático: 20 km/h más 2 minutos por cada parada intermedia"""
+    tiempo_viaje_minutos = (distancia_km / 20.0) * 60.0
+    numero_paradas = abs(orden_destino - orden_origen)
+    tiempo_paradas_minutos = numero_paradas * 2
+    return int(round(tiempo_viaje_minutos + tiempo_paradas_minutos))
+
+
+def construir_respuesta_estimacion(metodo_usado, empresa, numeroRuta, paradaOrigen, paradaDestino, tiempo_total, distancia_km,
+                                   red=None):
+    """Respuesta canónica de éxito de /api/estimate-route (sin geometría). red: para la tarifa (None -> la vigente)"""
+    # Build canonical success response with controlled types and fields
+    return {
+        "success": True,
+        "metodo": metodo_usado,
+        "empresa": str(empresa),
+        "numeroRuta": int(numeroRuta),
+        "paradaOrigen": {
+            "nombre": str(paradaOrigen.get('nombre', '')),
+            "lat": float(paradaOrigen.get('lat', 0.0)),
+            "lon": float(paradaOrigen.get('lon', 0.0)),
+            "orden": int(paradaOrigen.get('orden', 0))
+        },
+        "paradaDestino": {
+            "nombre": str(paradaDestino.get('nombre', '')),
+            "lat": float(paradaDestino.get('lat', 0.0)),
+            "lon": float(paradaDestino.get('lon', 0.0)),
+            "orden": int(paradaDestino.get('orden', 0))
+        },
+        "tiempoEstimadoMinutos": int(tiempo_total),
+        "distanciaKm": float(round(distancia_km, 2)),
+        "costo": int((red or RED_VIGENTE).tarifas.get(empresa, 0)),
+        "mensaje": f"Ruta calculada exitosamente con {metodo_usado.upper()}",
+        "geometria": None
+    }
+
+
+def cuerpo_error(mensaje):
+    return {
         "success": False,
         "empresa": "",
         "numeroRuta": 0,
@@ -451,7 +910,95 @@ def respuesta_error(codigo_http, mensaje):
         "costo": 0,
         "mensaje": mensaje
     }
-    return jsonify(err), codigo_http
+
+
+def respuesta_error(codigo_http, mensaje):
+    return jsonify(cuerpo_error(mensaje)), codigo_http
+
+
+# ==========================================================
+# Estimación por lotes (método estático vectorizado)
+# ==========================================================
+ESTIMACION_LOTE_BLOQUE = 1000   # pares por bloque enviado al cliente
+
+
+def _leer_lote(texto, es_ndjson):
+    """Lee el cuerpo como arreglo JSON o NDJSON (un objeto por línea)"""
+    if es_ndjson:
+        return [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+    datos = json.loads(texto)
+    if not isinstance(datos, list):
+        raise ValueError("Se esperaba un arreglo JSON")
+    return datos
+
+
+def _estimar_bloque(items):
+    """Valida y estima un bloque de payloads. Retorna la lista de respuestas (dict) en el mismo orden"""
+    red = red_vigente()
+    estimador = red.lote
+    respuestas = [None] * len(items)
+    pendientes = []   # (posicion, origenLat, origenLon, destinoLat, destinoLon, ruta_fija)
+
+    for i, item in enumerate(items):
+        datos, error = validar_payload_estimacion(item)
+        if error is not None:
+            respuestas[i] = dict(cuerpo_error(error), codigo=400)
+            continue
+        origenLat, origenLon, destinoLat, destinoLon, empresa, numeroRuta = datos
+        ruta_fija = -1
+        if not (empresa == '' or numeroRuta == 0):
+            if empresa not in red.rutas:
+                respuestas[i] = dict(cuerpo_error("Empresa %s no encontrada" % empresa), codigo=404)
+                continue
+            if numeroRuta not in red.rutas[empresa]:
+                respuestas[i] = dict(cuerpo_error("La ruta %s no existe para la empresa %s" % (numeroRuta, empresa)), codigo=404)
+                continue
+            ruta_fija = estimador.posicion[(empresa, numeroRuta)]
+        pendientes.append((i, origenLat, origenLon, destinoLat, destinoLon, ruta_fija))
+
+    if pendientes:
+        columnas = list(zip(*pendientes))
+        resultados = estimador.estimar(columnas[1], columnas[2], columnas[3], columnas[4], columnas[5])
+        for posicion, resultado in zip(columnas[0], resultados):
+            if resultado[0]:
+                _, empresa, numeroRuta, paradaOrigen, paradaDestino, distancia_km, tiempo_total = resultado
+                respuestas[posicion] = construir_respuesta_estimacion(
+                    "estatico", empresa, numeroRuta, paradaOrigen, paradaDestino, tiempo_total, distancia_km, red
+                )
+            else:
+                respuestas[posicion] = dict(cuerpo_error(resultado[2]), codigo=resultado[1])
+    return respuestas
+
+
+@app.route('/api/estimate-route/batch', methods=['POST'])
+def estimate_route_batch():
+    """
+    Estima muchos pares origen/destino con el método estático.
+    Acepta un arreglo JSON o NDJSON (Content-Type: application/x-ndjson) con el mismo
+    formato de /api/estimate-route. Cada respuesta tiene la forma de la respuesta individual
+    (los errores agregan "codigo" con el status HTTP equivalente) y se envían en el mismo
+    orden y formato de la entrada a medida que se calculan.
+    """
+    es_ndjson = request.mimetype in ("application/x-ndjson", "application/ndjson")
+    try:
+        items = _leer_lote(request.get_data(as_text=True), es_ndjson)
+    except ValueError as e:
+        return respuesta_error(400, "Cuerpo inválido: %s" % str(e))
+
+    def generar():
+        if not es_ndjson:
+            yield "["
+        for inicio in range(0, len(items), ESTIMACION_LOTE_BLOQUE):
+            bloque = _estimar_bloque(items[inicio:inicio + ESTIMACION_LOTE_BLOQUE])
+            if es_ndjson:
+                yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in bloque)
+            else:
+                yield ("," if inicio else "") + ",".join(json.dumps(r, ensure_ascii=False) for r in bloque)
+        if not es_ndjson:
+            yield "]"
+
+    mimetype = "application/x-ndjson" if es_ndjson else "application/json"
+    return Response(generar(), mimetype=mimetype)
 
 # ==========================================================
 # === BLOQUE AÑADIDO PARA ETA Y SIMULACIÓN AUTOMÁTICA  =====
@@ -471,6 +1018,7 @@ def update_bus_gps():
     required = ["idBus", "empresa", "ruta", "lat", "lon"]
     for r in required:
         if r not in data:
+            METRICA_REPORTES_GPS.inc(1, ("rechazado",))
             return jsonify({"success": False, "mensaje": f"Falta campo {r}"}), 400
 
     idBus = str(data["idBus"])
@@ -480,25 +1028,147 @@ def update_bus_gps():
     lon = float(data["lon"])
     vel = float(data.get("velocidad", 20))  # km/h por defecto 
 
-    if empresa not in RUTAS_DATABASE or ruta not in RUTAS_DATABASE[empresa]:
+    red = red_vigente()
+    if empresa not in red.rutas or ruta not in red.rutas[empresa]:
+        METRICA_REPORTES_GPS.inc(1, ("rechazado",))
         return jsonify({"success": False, "mensaje": "Empresa o ruta inválida"}), 400
 
     if not validar_coordenadas(lat, lon):
+        METRICA_REPORTES_GPS.inc(1, ("rechazado",))
         return jsonify({"success": False, "mensaje": "Coordenadas inválidas"}), 400
 
-    BUS_POSITIONS[idBus] = {
-        "empresa": empresa,
-        "ruta": ruta,
-        "lat": lat,
-        "lon": lon,
-        "vel": vel,
-        "timestamp": time.time()
-    }
+    if not math.isfinite(vel):
+        METRICA_REPORTES_GPS.inc(1, ("rechazado",))
+        return jsonify({"success": False, "mensaje": "Velocidad inválida"}), 400
+
+    BUS_POSITIONS.actualizar(idBus, empresa, ruta, lat, lon, vel, time.time(), emparejador=red.emparejador)
+    red.tablero.marcar(empresa, ruta)
+    METRICA_REPORTES_GPS.inc(1, ("aplicado",))
 
     return jsonify({
         "success": True,
         "mensaje": f"Bus {idBus} actualizado",
-        "bus": BUS_POSITIONS[idBus]
+        "bus": BUS_POSITIONS.obtener(idBus)
+    }), 200
+
+
+GPS_LOTE_BLOQUE = int(os.environ.get("GPS_LOTE_BLOQUE", 2000))   # reportes aplicados por toma del lock
+GPS_LOTE_MAX_ERRORES = 100                                      # errores detallados en la respuesta
+
+
+def _anotar_error(errores, posicion, mensaje):
+    if len(errores) < GPS_LOTE_MAX_ERRORES:
+        errores.append({"i": posicion, "mensaje": mensaje})
+
+
+def _validar_reportes_json(items, errores, rutas):
+    """Convierte y valida reportes en formato JSON contra rutas. Retorna ([reporte], [posicion]) de los válidos."""
+    reportes = []
+    posiciones = []
+    for i, item in enumerate(items):
+        try:
+            empresa = item["empresa"]
+            ruta = int(item["ruta"])
+            lat = float(item["lat"])
+            lon = float(item["lon"])
+            id_bus = str(item["idBus"])
+            vel = float(item.get("velocidad", 20))
+            marca = item.get("seq", item.get("timestamp"))
+            if marca is not None:
+                marca = float(marca)
+            if not all(math.isfinite(v) for v in (lat, lon, vel, marca) if v is not None):
+                raise ValueError("NaN o infinito")
+            rutas_empresa = rutas.get(empresa)
+        except KeyError as e:
+            _anotar_error(errores, i, "Falta campo %s" % e.args[0])
+            continue
+        except (TypeError, ValueError, AttributeError):
+            _anotar_error(errores, i, "Reporte inválido")
+            continue
+        if rutas_empresa is None or ruta not in rutas_empresa:
+            _anotar_error(errores, i, "Empresa o ruta inválida")
+        elif not validar_coordenadas(lat, lon):
+            _anotar_error(errores, i, "Coordenadas inválidas")
+        else:
+            reportes.append((id_bus, empresa, ruta, lat, lon, vel, marca))
+            posiciones.append(i)
+    return reportes, posiciones
+
+
+def _validar_reportes_binarios(decodificados, errores, rutas):
+    """Igual que _validar_reportes_json para tuplas ya tipadas por formato_binario.decodificar"""
+    reportes = []
+    posiciones = []
+    for i, reporte in enumerate(decodificados):
+        rutas_empresa = rutas.get(reporte[1])
+        if not all(math.isfinite(v) for v in reporte[3:] if v is not None):
+            # lat, lon, velocidad y seq llegan como float32/float64 y pueden ser NaN o infinito
+            _anotar_error(errores, i, "Reporte inválido")
+        elif rutas_empresa is None or reporte[2] not in rutas_empresa:
+            _anotar_error(errores, i, "Empresa o ruta inválida")
+        elif not validar_coordenadas(reporte[3], reporte[4]):
+            _anotar_error(errores, i, "Coordenadas inválidas")
+        else:
+            reportes.append(reporte)
+            posiciones.append(i)
+    return reportes, posiciones
+
+
+@app.route('/api/update-bus-gps/batch', methods=['POST'])
+def update_bus_gps_batch():
+    """
+    Ingesta masiva de reportes GPS (teléfonos o gateways de flota).
+    Acepta un arreglo JSON, NDJSON (Content-Type: application/x-ndjson) o el formato binario
+    de formato_binario.py (Content-Type: application/x-rutaya-gps). Cada reporte tiene
+    el formato de /api/update-bus-gps y puede traer "seq" o "timestamp" propios: un reporte
+    con seq/timestamp menor o igual al último aceptado de ese bus se descarta.
+    Respuesta compacta:
+        {"success": true, "recibidos": N, "aplicados": a, "descartados": d, "rechazados": r,
+         "estados": "AADE...", "errores": [{"i": posicion, "mensaje": ...}]}
+    "estados" tiene un carácter por reporte: A = aplicado, D = descartado (repetido o
+    desordenado), E = rechazado; "errores" detalla los primeros GPS_LOTE_MAX_ERRORES rechazos.
+    """
+    errores = []
+    red = red_vigente()
+    try:
+        if request.mimetype == formato_binario.TIPO_CONTENIDO:
+            decodificados = formato_binario.decodificar(request.get_data())
+            recibidos = len(decodificados)
+            reportes, posiciones = _validar_reportes_binarios(decodificados, errores, red.rutas)
+        else:
+            es_ndjson = request.mimetype in ("application/x-ndjson", "application/ndjson")
+            items = _leer_lote(request.get_data(as_text=True), es_ndjson)
+            recibidos = len(items)
+            reportes, posiciones = _validar_reportes_json(items, errores, red.rutas)
+    except ValueError as e:
+        return respuesta_error(400, "Cuerpo inválido: %s" % str(e))
+
+    estados = ["E"] * recibidos
+    ahora = time.time()
+    emparejador = red.emparejador
+    aplicados = 0
+    for inicio in range(0, len(reportes), GPS_LOTE_BLOQUE):
+        resultado = BUS_POSITIONS.actualizar_lote(reportes[inicio:inicio + GPS_LOTE_BLOQUE], ahora, emparejador)
+        for posicion, aplicado in zip(posiciones[inicio:inicio + GPS_LOTE_BLOQUE], resultado):
+            estados[posicion] = "A" if aplicado else "D"
+        aplicados += sum(resultado)
+
+    tablero = red.tablero
+    for empresa, ruta in {(reporte[1], reporte[2]) for reporte in reportes}:
+        tablero.marcar(empresa, ruta)
+
+    METRICA_REPORTES_GPS.inc(aplicados, ("aplicado",))
+    METRICA_REPORTES_GPS.inc(len(reportes) - aplicados, ("descartado",))
+    METRICA_REPORTES_GPS.inc(recibidos - len(reportes), ("rechazado",))
+
+    return jsonify({
+        "success": True,
+        "recibidos": recibidos,
+        "aplicados": aplicados,
+        "descartados": len(reportes) - aplicados,
+        "rechazados": recibidos - len(reportes),
+        "estados": "".join(estados),
+        "errores": errores
     }), 200
 
 
@@ -506,30 +1176,146 @@ def update_bus_gps():
 def get_buses():
     """
     Retorna la lista de todos los buses activos.
-    Filtra buses que no se han actualizado en los últimos 5 minutos.
+    Filtra buses que no se han actualizado en los últimos BUS_TTL_SEGUNDOS (5 minutos por defecto).
+
+    Con ?since=<seq> retorna solo los cambios posteriores a esa secuencia:
+        {"seq": N, "completo": false, "buses": [cambiados], "eliminados": [ids]}
+    Si el cliente está demasiado atrasado (o since=0) recibe el estado completo con "completo": true.
+    El cliente debe enviar el "seq" recibido en la siguiente consulta.
+
+    Consultas espaciales (responden el arreglo, desde la grilla del almacén):
+        ?bbox=lat_min,lon_min,lat_max,lon_max   buses dentro del rectángulo
+        ?near=lat,lon&k=10[&radio_km=R]         k buses más cercanos, con "distancia_km"
     """
+    if "bbox" in request.args or "near" in request.args:
+        return buses_por_zona()
+
+    desde = request.args.get("since")
+    if desde is None:
+        # El JSON se arma directamente desde el almacén compacto
+        return Response(BUS_POSITIONS.json_activos(time.time()), mimetype="application/json"), 200
+
+    try:
+        desde = int(desde)
+    except ValueError:
+        return respuesta_error(400, "El parámetro since debe ser un número entero")
+    return Response(BUS_POSITIONS.json_cambios(desde, time.time()), mimetype="application/json"), 200
+
+BUSES_CERCANOS_MAX_K = 500
+
+
+def leer_bbox(texto):
+    """'lat_min,lon_min,lat_max,lon_max' -> tupla de 4 floats, o None si es inválido"""
+    try:
+        bbox = tuple(float(v) for v in texto.split(","))
+    except ValueError:
+        return None
+    if len(bbox) != 4 or not all(math.isfinite(v) for v in bbox) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return None
+    return bbox
+
+
+def buses_por_zona():
+    """Atiende /api/buses?bbox=... y /api/buses?near=...&k=..."""
     ahora = time.time()
-    buses_activos = []
-    
-    # Copia para evitar errores de modificación durante iteración
-    for bid, datos in list(BUS_POSITIONS.items()):
-        # Si la última actualización fue hace menos de 5 minutos (300 segundos)
-        if ahora - datos['timestamp'] < 300:
-            bus_info = datos.copy()
-            bus_info['id'] = bid
-            buses_activos.append(bus_info)
-            
-    return jsonify(buses_activos), 200
+    if "bbox" in request.args:
+        bbox = leer_bbox(request.args["bbox"])
+        if bbox is None:
+            return respuesta_error(400, "bbox debe ser lat_min,lon_min,lat_max,lon_max")
+        return Response(BUS_POSITIONS.json_en_rectangulo(*bbox, ahora), mimetype="application/json"), 200
+
+    try:
+        lat, lon = (float(v) for v in request.args["near"].split(","))
+        k = int(request.args.get("k", 10))
+        radio_km = request.args.get("radio_km", type=float)
+        if not math.isfinite(lat) or not math.isfinite(lon) or (radio_km is not None and not math.isfinite(radio_km)):
+            raise ValueError("NaN o infinito")
+    except ValueError:
+        return respuesta_error(400, "near debe ser lat,lon y k un número entero")
+    if not 1 <= k <= BUSES_CERCANOS_MAX_K:
+        return respuesta_error(400, "k debe estar entre 1 y %d" % BUSES_CERCANOS_MAX_K)
+    return Response(BUS_POSITIONS.json_cercanos(lat, lon, k, ahora, radio_km), mimetype="application/json"), 200
+
+# ==========================================================
+# Persistencia del estado de los buses (snapshot + WAL) para reinicios en caliente
+# ==========================================================
+BUS_PERSISTENCIA_DIR = os.environ.get("BUS_PERSISTENCIA_DIR")                       # None -> sin persistencia
+BUS_WAL_INTERVALO = float(os.environ.get("BUS_WAL_INTERVALO", 0.2))                 # group commit
+BUS_SNAPSHOT_INTERVALO = float(os.environ.get("BUS_SNAPSHOT_INTERVALO", 60))
+
+PERSISTENCIA_BUSES = None
+# Con app.run(debug=True) el módulo también corre en el proceso que vigila los archivos: ese no persiste
+_PROCESO_RECARGADOR = __name__ == '__main__' and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
+if BUS_PERSISTENCIA_DIR and BUS_MEMORIA_COMPARTIDA:
+    _safe_print("⚠️ BUS_PERSISTENCIA_DIR se ignora con BUS_MEMORIA_COMPARTIDA (el segmento compartido ya "
+                "sobrevive al reinicio de los workers)")
+elif BUS_PERSISTENCIA_DIR and not _PROCESO_RECARGADOR:
+    PERSISTENCIA_BUSES = PersistenciaBuses(BUS_POSITIONS, BUS_PERSISTENCIA_DIR, intervalo=BUS_WAL_INTERVALO,
+                                           intervalo_snapshot=BUS_SNAPSHOT_INTERVALO, log=_safe_print)
+    if PERSISTENCIA_BUSES.tomar_directorio():
+        restaurado = PERSISTENCIA_BUSES.cargar()
+        _safe_print(f"💾 Estado de buses restaurado: {restaurado['buses']} buses "
+                    f"({restaurado['descartados_por_ttl']} vencidos descartados) en {restaurado['ms']} ms")
+        PERSISTENCIA_BUSES.iniciar()
+        atexit.register(PERSISTENCIA_BUSES.cerrar)
+    else:
+        _safe_print(f"⚠️ {BUS_PERSISTENCIA_DIR} está en uso por otro proceso: este no persiste el estado de los buses")
+        PERSISTENCIA_BUSES = None
+
+# ==========================================================
+# Difusión de posiciones por Server-Sent Events
+# ==========================================================
+STREAM_MAX_HZ = float(os.environ.get("STREAM_MAX_HZ", 2))                           # mensajes/s por suscriptor
+STREAM_MAX_PENDIENTES = int(os.environ.get("STREAM_MAX_PENDIENTES", 5000))          # luego se reenvía todo
+STREAM_MAX_SUSCRIPTORES = int(os.environ.get("STREAM_MAX_SUSCRIPTORES", 500))
+STREAM_LATIDO_SEGUNDOS = float(os.environ.get("STREAM_LATIDO_SEGUNDOS", 15))        # mantiene viva la conexión
+DIFUSOR_BUSES = DifusorBuses(BUS_POSITIONS, max_hz=STREAM_MAX_HZ, max_pendientes=STREAM_MAX_PENDIENTES,
+                             max_suscriptores=STREAM_MAX_SUSCRIPTORES, log=_safe_print)
+
+
+@app.route('/api/buses/stream', methods=['GET'])
+def stream_buses():
+    """
+    Stream SSE con los cambios de posición de los buses (evento "buses").
+    El primer mensaje trae el estado completo ("completo": true) y los siguientes solo
+    lo cambiado, con el mismo formato que /api/buses?since=.
+    Filtros opcionales: ?empresa=...&ruta=N&bbox=lat_min,lon_min,lat_max,lon_max
+    """
+    empresa = request.args.get("empresa") or None
+    ruta = request.args.get("ruta", type=int)
+    bbox = request.args.get("bbox")
+    if bbox is not None:
+        bbox = leer_bbox(bbox)
+        if bbox is None:
+            return respuesta_error(400, "bbox debe ser lat_min,lon_min,lat_max,lon_max")
+    if "ruta" in request.args and ruta is None:
+        return respuesta_error(400, "El parámetro ruta debe ser un número entero")
+
+    suscriptor = DIFUSOR_BUSES.suscribir(empresa, ruta, bbox)
+    if suscriptor is None:
+        return respuesta_error(503, "Demasiados suscriptores, intenta más tarde")
+
+    def eventos():
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                mensaje = DIFUSOR_BUSES.siguiente(suscriptor, STREAM_LATIDO_SEGUNDOS)
+                if mensaje is None:
+                    yield ": latido\n\n"
+                else:
+                    yield "event: buses\ndata: " + mensaje + "\n\n"
+        finally:
+            # Se ejecuta también cuando el cliente cierra la conexión
+            DIFUSOR_BUSES.cancelar(suscriptor)
+
+    return Response(eventos(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # ==========================================================
 # 2. Helper: Bus más cercano que pase por una ruta específica
 # ==========================================================
 def obtener_buses_en_ruta(empresa, ruta):
-    buses = []
-    for bid, datos in BUS_POSITIONS.items():
-        if datos["empresa"] == empresa and datos["ruta"] == ruta:
-            buses.append((bid, datos))
-    return buses
+    return BUS_POSITIONS.buses_en_ruta(empresa, ruta)
 
 # ==========================================================
 # 3. ETA real desde la posición del bus hacia un paradero
@@ -541,6 +1327,20 @@ def eta_bus_a_paradero(bus, parada):
     return round(eta_min, 1)
 
 
+def eta_bus_en_ruta(tabla, bus, parada):
+    """Minutos hasta que el bus llegue a la parada de su ruta, o None si ya pasó por ella"""
+    idx_parada = parada.get("orden", 0) - 1
+    if "km_ruta" in bus and idx_parada >= 0:
+        # Bus emparejado con la ruta: distancia sobre el recorrido según su sentido
+        eta = tabla.minutos_hasta(bus["km_ruta"], idx_parada + 1, bus["sentido"])
+        return None if eta is None else round(eta, 1)
+
+    # Si el bus va en una dirección y el usuario espera en una parada anterior, ya pasó.
+    if bus.get("ultima_parada_index", -1) >= idx_parada:
+        return None
+    return eta_bus_a_paradero(bus, parada)
+
+
 
 # ==========================================================
 # 4. Endpoint ETA por coordenada libre
@@ -565,18 +1365,18 @@ def eta_usuario():
     mejor = None
 
     # Buscar la mejor combinación: empresa+ruta+paradero más cercano
-    for empresa, rutasVar in RUTAS_DATABASE.items():
-        for rutaNum, paradas in rutasVar.items():
-            dist, parada = encontrar_parada_mas_cercana(userLat, userLon, paradas)
-
-            if dist < 0.8:  # Debe estar cerca del recorrido
-                if mejor is None or dist < mejor["distancia"]:
-                    mejor = {
-                        "empresa": empresa,
-                        "numeroRuta": rutaNum,
-                        "parada": parada,
-                        "distancia": dist
-                    }
+    # (solo rutas con alguna parada a menos de 0.8 km: debe estar cerca del recorrido)
+    red = red_vigente()   # índice y tablero de la misma versión
+    cercanas = red.indice.mas_cercana_por_ruta(userLat, userLon, 0.8)
+    for (empresa, rutaNum), (dist, parada) in cercanas.items():
+        if dist < 0.8:
+            if mejor is None or dist < mejor["distancia"]:
+                mejor = {
+                    "empresa": empresa,
+                    "numeroRuta": rutaNum,
+                    "parada": parada,
+                    "distancia": dist
+                }
 
     if mejor is None:
         return jsonify({"success": False, "mensaje": "No hay rutas cerca de ti"}), 404
@@ -584,11 +1384,10 @@ def eta_usuario():
     empresa = mejor["empresa"]
     ruta = mejor["numeroRuta"]
     parada = mejor["parada"]
-    idx_parada = parada.get("orden", 0) - 1
 
-    # Buses disponibles en esa ruta
-    buses = obtener_buses_en_ruta(empresa, ruta)
-    if not buses:
+    # Próximas llegadas materializadas de la ruta a esa parada
+    estado, llegadas = red.tablero.llegadas_ruta(empresa, ruta, parada.get("orden"))
+    if estado == NO_HAY_BUSES:
         return jsonify({
             "success": True,
             "empresa": empresa,
@@ -603,25 +1402,8 @@ def eta_usuario():
             "estado": "NO_HAY_BUSES"
         }), 200
 
-    # Buscar el bus con ETA más corta
-    mejorETA = None
-    mejorBusID = None
-    estado = "EN_CAMINO"
-
-    for bid, bus in buses:
-        # Determinar si el bus ya pasó
-        idx_bus = bus.get("ultima_parada_index", -1)
-        
-        # Si el bus va en una dirección y el usuario espera en una parada anterior, ya pasó.
-        if idx_bus >= idx_parada:
-            estado = "YA_PASO"
-            continue
-
-        eta = eta_bus_a_paradero(bus, parada)
-        if mejorETA is None or eta < mejorETA:
-            mejorETA = eta
-            mejorBusID = bid
-            estado = "EN_CAMINO"
+    # Bus con ETA más corta
+    mejorETA, mejorBusID = llegadas[0] if llegadas else (None, None)
 
     if mejorETA is None:
         
@@ -654,9 +1436,43 @@ def eta_usuario():
     "estado": estado
 }), 200
 
+
+@app.route('/api/stops', methods=['GET'])
+def listar_paradas():
+    """Paradas físicas con su id (para /api/stops/<id>/arrivals) y las rutas que las atienden"""
+    paradas = [
+        {
+            "id": fisica["id"],
+            "nombre": fisica["nombre"],
+            "lat": fisica["lat"],
+            "lon": fisica["lon"],
+            "rutas": [{"empresa": e, "numeroRuta": n, "orden": o} for e, n, o in fisica["rutas"]]
+        }
+        for fisica in obtener_tablero_llegadas().paradas.values()
+    ]
+    return jsonify({"success": True, "total_paradas": len(paradas), "paradas": paradas}), 200
+
+
+@app.route('/api/stops/<id_parada>/arrivals', methods=['GET'])
+def llegadas_parada(id_parada):
+    """
+    Próximas llegadas a una parada física, de todas las rutas que la atienden, ordenadas por minutos.
+    Sale del tablero materializado: no recorre los buses en cada consulta.
+    """
+    tablero = obtener_tablero_llegadas().llegadas_parada(id_parada)
+    if tablero is None:
+        return respuesta_error(404, f"Parada {id_parada} no encontrada")
+    return jsonify(dict(tablero, success=True)), 200
+
 # ==========================================================
 # 5. Simulador automático de buses
 # ==========================================================
+# Todos los buses simulados avanzan desde un único hilo planificador
+SIMULACION_TICKS_POR_SEGUNDO = float(os.environ.get("SIMULACION_TICKS_POR_SEGUNDO", 5))
+MOTOR_SIMULACION = MotorSimulacion(ticks_por_segundo=SIMULACION_TICKS_POR_SEGUNDO, log=_safe_print,
+                                   al_paso=METRICA_SIMULADOR_RETRASO.observar)
+
+
 @app.route('/api/simular-bus', methods=['POST'])
 def simular_bus():
     """
@@ -670,50 +1486,27 @@ def simular_bus():
     ruta = int(data.get("ruta"))
     velocidad_base = float(data.get("velocidad", 25))  # km/h
 
-    if empresa not in RUTAS_DATABASE or ruta not in RUTAS_DATABASE[empresa]:
+    rutas = red_vigente().rutas
+    if empresa not in rutas or ruta not in rutas[empresa]:
         return jsonify({"success": False, "mensaje": "Ruta inválida"}), 400
 
-    paradas = RUTAS_DATABASE[empresa][ruta]
+    paradas = rutas[empresa][ruta]
 
     _safe_print(f"🔵 Iniciando simulación SUAVE del bus {idBus} - {empresa} Ruta {ruta}")
     _safe_print(f"   Velocidad Base: {velocidad_base} km/h")
 
-    def hilo_simulacion():
-        global BUS_POSITIONS
-        import random
-
-        # Copiar paradas para poder modificarlas
-        paradas_actuales = list(paradas)
-
-        # Posicionar en inicio
-        BUS_POSITIONS[idBus] = {
-            "empresa": empresa,
-            "ruta": ruta,
-            "lat": paradas_actuales[0]["lat"],
-            "lon": paradas_actuales[0]["lon"],
-            "vel": 0,
-            "timestamp": time.time(),
-            "estado": "EN_PARADA",
-            "proxima_parada": paradas_actuales[0]["nombre"]
-        }
-
-        _safe_print(f"🟢 Bus {idBus} en salida: {paradas_actuales[0]['nombre']}")
-        time.sleep(2)
+    def crear_recorrido():
+        # Descargar la geometría de todos los tramos (ida y retorno) antes de arrancar
+        paradas_ida = list(paradas)
+        tramos_ida = calcular_tramos_osrm(paradas_ida)
+        tramos_retorno = calcular_tramos_osrm(paradas_ida[::-1])
+        return recorrido_simulado(idBus, empresa, ruta, paradas_ida, velocidad_base, tramos_ida, tramos_retorno)
 
-        while True:
-            # Bucle de recorrido (Ida)
-            recorrer_tramo(idBus, empresa, ruta, paradas_actuales, velocidad_base)
-            
-            # Llegada al final
-            _safe_print(f"🏁 Bus {idBus} terminó recorrido. Esperando retorno...")
-            time.sleep(10)
-            
-            # Invertir ruta para el retorno
-            paradas_actuales = paradas_actuales[::-1]
-            _safe_print(f"🔄 Bus {idBus} inicia retorno: {paradas_actuales[0]['nombre']} -> {paradas_actuales[-1]['nombre']}")
-
-    t = threading.Thread(target=hilo_simulacion, daemon=True)
-    t.start()
+    reiniciada = MOTOR_SIMULACION.iniciar(
+        idBus, crear_recorrido, empresa=empresa, ruta=ruta, velocidad=velocidad_base
+    )
+    if reiniciada:
+        _safe_print(f"🔁 Bus {idBus} ya estaba simulado: se reinicia")
 
     return jsonify({
         "success": True,
@@ -722,17 +1515,89 @@ def simular_bus():
         "ruta": ruta
     }), 200
 
-def recorrer_tramo(idBus, empresa, ruta, paradas, velocidad_base):
-    global BUS_POSITIONS
-    import random
-    
+
+@app.route('/api/simulaciones', methods=['GET'])
+def listar_simulaciones():
+    """Lista los buses simulados y el estado del planificador"""
+    return jsonify({
+        "success": True,
+        "simulaciones": MOTOR_SIMULACION.listar(),
+        "motor": MOTOR_SIMULACION.estadisticas()
+    }), 200
+
+
+@app.route('/api/simulaciones/<idBus>', methods=['DELETE'])
+def detener_simulacion(idBus):
+    if not MOTOR_SIMULACION.detener(idBus):
+        return jsonify({"success": False, "mensaje": f"El bus {idBus} no está simulado"}), 404
+    bus = BUS_POSITIONS.obtener(idBus)
+    BUS_POSITIONS.eliminar(idBus)
+    if bus is not None:
+        obtener_tablero_llegadas().marcar(bus["empresa"], bus["ruta"])
+    _safe_print(f"⏹️ Simulación del bus {idBus} detenida")
+    return jsonify({"success": True, "mensaje": f"Simulación del bus {idBus} detenida"}), 200
+
+
+@app.route('/api/simulaciones/<idBus>/pausar', methods=['POST'])
+def pausar_simulacion(idBus):
+    if not MOTOR_SIMULACION.pausar(idBus):
+        return jsonify({"success": False, "mensaje": f"El bus {idBus} no está simulado"}), 404
+    return jsonify({"success": True, "mensaje": f"Simulación del bus {idBus} pausada"}), 200
+
+
+@app.route('/api/simulaciones/<idBus>/reanudar', methods=['POST'])
+def reanudar_simulacion(idBus):
+    if not MOTOR_SIMULACION.reanudar(idBus):
+        return jsonify({"success": False, "mensaje": f"El bus {idBus} no está simulado"}), 404
+    return jsonify({"success": True, "mensaje": f"Simulación del bus {idBus} reanudada"}), 200
+
+
+def recorrido_simulado(idBus, empresa, ruta, paradas, velocidad_base, tramos_ida, tramos_retorno):
+    """
+    Generador del recorrido completo de un bus simulado (ida y retorno, indefinidamente).
+    Produce los segundos que el planificador debe esperar antes del siguiente paso.
+    """
+    # Copiar paradas para poder modificarlas
+    paradas_actuales = list(paradas)
+
+    # Posicionar en inicio
+    BUS_POSITIONS.actualizar(
+        idBus, empresa, ruta, paradas_actuales[0]["lat"], paradas_actuales[0]["lon"], 0, time.time(),
+        estado="EN_PARADA", proxima_parada=paradas_actuales[0]["nombre"]
+    )
+    obtener_tablero_llegadas().marcar(empresa, ruta)
+
+    _safe_print(f"🟢 Bus {idBus} en salida: {paradas_actuales[0]['nombre']}")
+    yield 2
+
+    while True:
+        # Bucle de recorrido (Ida)
+        yield from recorrer_tramo(idBus, empresa, ruta, paradas_actuales, velocidad_base, tramos_ida)
+
+        # Llegada al final
+        _safe_print(f"🏁 Bus {idBus} terminó recorrido. Esperando retorno...")
+        yield 10
+
+        # Invertir ruta para el retorno
+        paradas_actuales = paradas_actuales[::-1]
+        tramos_ida, tramos_retorno = tramos_retorno, tramos_ida
+        _safe_print(f"🔄 Bus {idBus} inicia retorno: {paradas_actuales[0]['nombre']} -> {paradas_actuales[-1]['nombre']}")
+
+
+def recorrer_tramo(idBus, empresa, ruta, paradas, velocidad_base, tramos):
+    """
+    Generador que mueve el bus por todas las paradas de la lista.
+    tramos: geometría OSRM de cada tramo (ver calcular_tramos_osrm)
+    Produce los segundos de espera entre pasos (un paso por tick del motor).
+    La red se vuelve a leer en cada paso: tras una recarga el bus sigue con la versión nueva.
+    """
+    paso_tiempo = MOTOR_SIMULACION.paso_tiempo
+
     for i in range(len(paradas) - 1):
         inicio = paradas[i]
         fin = paradas[i + 1]
-        
-        # Obtener geometría real de la calle usando OSRM
-        ruta_osrm = calcular_ruta_osrm(inicio['lat'], inicio['lon'], fin['lat'], fin['lon'])
-        
+        ruta_osrm = tramos[i]
+
         puntos_ruta = []
         if ruta_osrm and 'geometria' in ruta_osrm and ruta_osrm['geometria']:
             coords = ruta_osrm['geometria']['coordinates']
@@ -761,7 +1626,6 @@ def recorrer_tramo(idBus, empresa, ruta, paradas, velocidad_base):
             tiempo_segmento_horas = dist_km / velocidad_actual
             tiempo_segmento_segundos = tiempo_segmento_horas * 3600
             
-            paso_tiempo = 0.2
             num_pasos = int(max(1, tiempo_segmento_segundos / paso_tiempo))
             
             for paso in range(num_pasos):
@@ -769,28 +1633,168 @@ def recorrer_tramo(idBus, empresa, ruta, paradas, velocidad_base):
                 lat_interp = p1[0] + (p2[0] - p1[0]) * avance
                 lon_interp = p1[1] + (p2[1] - p1[1]) * avance
                 
-                BUS_POSITIONS[idBus] = {
-                    "empresa": empresa,
-                    "ruta": ruta,
-                    "lat": lat_interp,
-                    "lon": lon_interp,
-                    "vel": round(velocidad_actual, 1),
-                    "timestamp": time.time(),
-                    "ultima_parada_index": i,
-                    "estado": "EN_TRANSITO",
-                    "proxima_parada": fin["nombre"]
-                }
-                time.sleep(paso_tiempo)
+                red = red_vigente()
+                BUS_POSITIONS.actualizar(
+                    idBus, empresa, ruta, lat_interp, lon_interp, round(velocidad_actual, 1), time.time(),
+                    ultima_parada_index=i, estado="EN_TRANSITO", proxima_parada=fin["nombre"],
+                    emparejador=red.emparejador
+                )
+                red.tablero.marcar(empresa, ruta)
+                yield paso_tiempo
 
         # LLEGADA A PARADA
         _safe_print(f"🛑 Bus {idBus} PARADO en: {fin['nombre']}")
-        BUS_POSITIONS[idBus]["vel"] = 0
-        BUS_POSITIONS[idBus]["estado"] = "EN_PARADA"
-        BUS_POSITIONS[idBus]["lat"] = fin["lat"]
-        BUS_POSITIONS[idBus]["lon"] = fin["lon"]
+        BUS_POSITIONS.modificar(idBus, vel=0, estado="EN_PARADA", lat=fin["lat"], lon=fin["lon"])
+        obtener_tablero_llegadas().marcar(empresa, ruta)
         
         tiempo_parada = random.randint(5, 8)
-        time.sleep(tiempo_parada)
+        yield tiempo_parada
+
+
+# ==========================================================
+# Recarga de la red de rutas sin reiniciar
+# ==========================================================
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")   # sin definir -> /api/admin/recargar-rutas deshabilitado
+RUTAS_VIGILAR_INTERVALO = float(os.environ.get("RUTAS_VIGILAR_INTERVALO", 30))   # 0 -> no vigilar GTFS_RUTA
+# Archivo JSON donde la recarga por endpoint deja la red para los demás workers (sin definir -> solo este proceso)
+RUTAS_PUBLICADAS = os.environ.get("RUTAS_PUBLICADAS")
+RUTAS_PUBLICADAS_INTERVALO = float(os.environ.get("RUTAS_PUBLICADAS_INTERVALO", 2))
+
+
+def _huella_publicadas():
+    """(fecha de modificación, tamaño) de RUTAS_PUBLICADAS, o None si no existe"""
+    try:
+        estado = os.stat(RUTAS_PUBLICADAS)
+    except FileNotFoundError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+def _leer_publicadas():
+    """(rutas, tarifas) de RUTAS_PUBLICADAS; lanza ValueError si el archivo no es válido"""
+    with open(RUTAS_PUBLICADAS, encoding="utf-8") as f:
+        datos = json.load(f)
+    if not isinstance(datos, dict) or "rutas" not in datos or "tarifas" not in datos:
+        raise ValueError(f"{RUTAS_PUBLICADAS} no tiene 'rutas' y 'tarifas'")
+    return normalizar_rutas(datos["rutas"]), normalizar_tarifas(datos["tarifas"])
+
+
+def _publicar_red(red):
+    """
+    Deja la red en RUTAS_PUBLICADAS (archivo temporal + rename) para que la apliquen los demás
+    workers; red=None borra el archivo y los demás vuelven a leer GTFS_RUTA.
+    """
+    global _HUELLA_PUBLICADAS
+    # Con _RECARGA_LOCK tomado el vigilante de este proceso no ve el archivo nuevo antes que su huella
+    # (si lo viera, volvería a cargar la misma red y la versión de este worker se adelantaría)
+    with _RECARGA_LOCK:
+        if red is None:
+            try:
+                os.remove(RUTAS_PUBLICADAS)
+            except FileNotFoundError:
+                pass
+        else:
+            temporal = f"{RUTAS_PUBLICADAS}.{os.getpid()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({"rutas": red.rutas, "tarifas": red.tarifas}, f, ensure_ascii=False)
+            os.replace(temporal, RUTAS_PUBLICADAS)
+        # Este proceso ya tiene esa red: su vigilante no la vuelve a cargar
+        _HUELLA_PUBLICADAS = _huella_publicadas()
+
+
+def _vigilar_publicadas(intervalo):
+    """Hilo: aplica en este proceso la red que otro worker publicó (o borró) en RUTAS_PUBLICADAS"""
+    global _HUELLA_PUBLICADAS
+    while True:
+        time.sleep(intervalo)
+        try:
+            # Huella y contenido se leen juntos y con el mismo lock que _publicar_red
+            with _RECARGA_LOCK:
+                actual = _huella_publicadas()
+                if actual == _HUELLA_PUBLICADAS:
+                    continue
+                _HUELLA_PUBLICADAS = actual
+                publicada = _leer_publicadas() if actual is not None else None
+            if publicada is not None:
+                red = recargar_red(*publicada)
+            elif GTFS_RUTA:
+                red = recargar_red()
+            else:
+                continue
+            _safe_print(f"🔁 Red de rutas recargada por otro worker ({red.origen}): versión {red.version}, "
+                        f"{len(red.tablas)} rutas")
+        except Exception as e:
+            _safe_print(f"❌ No se pudo aplicar {RUTAS_PUBLICADAS} (se conserva la versión vigente): {e}")
+
+
+@app.route('/api/admin/recargar-rutas', methods=['POST'])
+def admin_recargar_rutas():
+    """
+    Publica una nueva versión de la red de rutas, sin cortar consultas.
+    Cabecera X-Admin-Token con el valor de ADMIN_TOKEN.
+    Cuerpo opcional: {"rutas": { empresa: { numeroRuta: [ {nombre, lat, lon}, ... ] } },
+                      "tarifas": { empresa: precio }}
+    Sin "rutas" se vuelve a leer el feed de GTFS_RUTA (o, si solo llegan tarifas, se
+    conservan las rutas vigentes).
+    La red se publica en este proceso; con RUTAS_PUBLICADAS también se deja en ese archivo y
+    los demás workers la aplican en RUTAS_PUBLICADAS_INTERVALO segundos. "alcance" en la
+    respuesta dice cuál de los dos casos ocurrió ("todos" o "proceso").
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"success": False, "mensaje": "Recarga deshabilitada: definir ADMIN_TOKEN"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"success": False, "mensaje": "Token de administración inválido"}), 403
+
+    datos = request.get_json(silent=True) or {}
+    if not isinstance(datos, dict):
+        return jsonify({"success": False, "mensaje": "Se esperaba un objeto JSON"}), 400
+    try:
+        rutas = normalizar_rutas(datos["rutas"]) if "rutas" in datos else None
+        tarifas = normalizar_tarifas(datos["tarifas"]) if "tarifas" in datos else None
+        if rutas is None and tarifas is not None:
+            rutas = red_vigente().rutas
+        red = recargar_red(rutas, tarifas)
+    except ValueError as e:
+        return jsonify({"success": False, "mensaje": str(e)}), 400
+
+    _safe_print(f"🔁 Red de rutas recargada ({red.origen}): versión {red.version}, {len(red.tablas)} rutas "
+                f"({red.ms_construccion:.0f} ms)")
+    mensaje = f"Red de rutas recargada: versión {red.version}"
+    alcance = "proceso"
+    if RUTAS_PUBLICADAS:
+        try:
+            _publicar_red(red if rutas is not None else None)
+            alcance = "todos"
+        except OSError as e:
+            _safe_print(f"⚠️ No se pudo escribir {RUTAS_PUBLICADAS}: {e}")
+            mensaje += f" (solo en este proceso: no se pudo escribir {RUTAS_PUBLICADAS})"
+    else:
+        mensaje += " (solo en este proceso: definir RUTAS_PUBLICADAS para llegar a todos los workers)"
+    return jsonify({
+        "success": True,
+        "mensaje": mensaje,
+        "alcance": alcance,
+        "red": red.resumen()
+    }), 200
+
+
+_HUELLA_PUBLICADAS = _huella_publicadas() if RUTAS_PUBLICADAS else None
+_red_inicial = None
+if _HUELLA_PUBLICADAS is not None:
+    # Un worker que arranca después de una recarga por endpoint toma la red publicada
+    try:
+        _red_inicial = recargar_red(*_leer_publicadas())
+    except (OSError, ValueError) as e:
+        _safe_print(f"❌ No se pudo leer {RUTAS_PUBLICADAS}, se usa la red de {GTFS_RUTA or 'server.py'}: {e}")
+if _red_inicial is None:
+    recargar_red(RUTAS_DATABASE, TARIFAS, origen="gtfs" if GTFS_RUTA else "server.py")
+if GTFS_RUTA and RUTAS_VIGILAR_INTERVALO > 0 and not _PROCESO_RECARGADOR:
+    threading.Thread(target=_vigilar_gtfs, args=(RUTAS_VIGILAR_INTERVALO, huella_feed(GTFS_RUTA)), daemon=True,
+                     name="vigilar-gtfs").start()
+if RUTAS_PUBLICADAS and RUTAS_PUBLICADAS_INTERVALO > 0 and not _PROCESO_RECARGADOR:
+    threading.Thread(target=_vigilar_publicadas, args=(RUTAS_PUBLICADAS_INTERVALO,), daemon=True,
+                     name="vigilar-rutas-publicadas").start()
+
 
 if __name__ == '__main__':
     # Set timeout behavior if needed (for production should use gunicorn with timeout)
@@ -0,0 +1,234 @@
+"""
+Modo ASGI del servidor API (asyncio):
+
+    uvicorn servidor_asgi:app --host 0.0.0.0 --port 3002
+
+En el servidor Flask cada estimación que sale a OSRM ocupa un hilo durante
+toda la consulta. Aquí POST /api/estimate-route es una corutina que espera a
+OSRM con httpx (ClienteOSRM.ruta_async, a través del cortocircuito), así que
+un proceso sostiene miles de estimaciones en vuelo con un solo hilo. La
+respuesta se arma con las mismas funciones de server.py (validación,
+resolver_estimacion) y con la app Flask (jsonify, CORS), por lo que el cuerpo
+y las cabeceras son idénticos.
+
+Mientras corre este modo, los tramos de geometría del simulador también se
+piden como corutinas en este bucle (ver server.calcular_tramos_osrm).
+
+Las demás rutas no esperan a la red y se atienden con la app Flask sin
+cambios, en un pool de hilos (ASGI_HILOS_WSGI). Las respuestas sin
+Content-Length (/api/buses/stream, lotes NDJSON) se envían a medida que se
+generan, leyéndolas en un hilo propio como lo haría un servidor WSGI con hilos.
+"""
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, request
+
+import server
+from server import (app as app_flask, CLIENTE_OSRM, _safe_print, calcular_ruta_osrm_async, cuerpo_error,
+                    necesita_osrm, resolver_estimacion, validar_payload_estimacion)
+
+ASGI_HILOS_WSGI = int(os.environ.get("ASGI_HILOS_WSGI", 32))   # hilos para las rutas atendidas por Flask
+ASGI_TROZOS_PENDIENTES = 16   # trozos de una respuesta en streaming esperando al cliente
+
+
+def _entorno_wsgi(scope, cuerpo):
+    """Entorno WSGI (PEP 3333) equivalente a la petición ASGI"""
+    servidor = scope.get("server") or ("localhost", 80)
+    cliente = scope.get("client") or ("", 0)
+    entorno = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": "",
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": servidor[0],
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": cliente[0],
+        "REMOTE_PORT": str(cliente[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(cuerpo),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for nombre, valor in scope["headers"]:
+        nombre = nombre.decode("latin1").upper().replace("-", "_")
+        valor = valor.decode("latin1")
+        if nombre in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            entorno[nombre] = valor
+        else:
+            clave = "HTTP_" + nombre
+            entorno[clave] = entorno[clave] + "," + valor if clave in entorno else valor
+    # El cuerpo ya está completo en memoria (también si llegó con Transfer-Encoding: chunked)
+    entorno["CONTENT_LENGTH"] = str(len(cuerpo))
+    entorno.pop("HTTP_TRANSFER_ENCODING", None)
+    return entorno
+
+
+def _cabeceras_asgi(cabeceras):
+    return [(nombre.lower().encode("latin1"), valor.encode("latin1")) for nombre, valor in cabeceras]
+
+
+def _llamar_flask(entorno):
+    """
+    Ejecuta la app Flask (en un hilo del pool).
+    Retorna (status, cabeceras, cuerpo): cuerpo son bytes si la respuesta trae
+    Content-Length, o el iterable WSGI sin consumir si es una respuesta en streaming.
+    """
+    inicio = {}
+
+    def start_response(status, cabeceras, exc_info=None):
+        inicio["status"] = status
+        inicio["cabeceras"] = cabeceras
+        return lambda datos: None
+
+    iterable = app_flask(entorno, start_response)
+    if not any(nombre.lower() == "content-length" for nombre, _ in inicio["cabeceras"]):
+        return inicio["status"], inicio["cabeceras"], iterable
+    try:
+        cuerpo = b"".join(iterable)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    return inicio["status"], inicio["cabeceras"], cuerpo
+
+
+async def estimar_ruta(entorno):
+    """Versión async de server.estimate_route. Retorna (codigo_http, cuerpo)."""
+    try:
+        with app_flask.request_context(entorno):
+            payload = request.get_json(force=True)
+        datos, error = validar_payload_estimacion(payload)
+        if error is not None:
+            return 400, cuerpo_error(error)
+        ruta_osrm = await calcular_ruta_osrm_async(*datos[:4]) if necesita_osrm(datos) else None
+        return resolver_estimacion(datos, ruta_osrm)
+
+    except Exception as e:
+        _safe_print("❌ Error interno:", str(e))
+        return 500, cuerpo_error("Error interno del servidor: %s" % str(e))
+
+
+# { (método, ruta): corutina(entorno) -> (codigo_http, cuerpo) } atendidas en el bucle
+RUTAS_ASYNC = {
+    ("POST", "/api/estimate-route"): estimar_ruta,
+}
+
+
+class AppASGI:
+    def __init__(self, hilos_wsgi=ASGI_HILOS_WSGI):
+        self._pool = ThreadPoolExecutor(max_workers=hilos_wsgi, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._ciclo_de_vida(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                server.BUCLE_ASYNC = asyncio.get_running_loop()
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                server.BUCLE_ASYNC = None
+                await CLIENTE_OSRM.cerrar_async()
+                self._pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        partes = []
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "http.disconnect":
+                return
+            partes.append(mensaje.get("body", b""))
+            if not mensaje.get("more_body"):
+                break
+        entorno = _entorno_wsgi(scope, b"".join(partes))
+
+        manejador = RUTAS_ASYNC.get((scope["method"], scope["path"]))
+        if manejador is not None:
+            entorno[server.CLAVE_INICIO_PETICION] = time.perf_counter()   # la mide el after_request de server.py
+            codigo, cuerpo = await manejador(entorno)
+            # jsonify y los after_request (CORS) de Flask, para responder exactamente igual
+            with app_flask.request_context(entorno):
+                respuesta = app_flask.process_response(app_flask.make_response((jsonify(cuerpo), codigo)))
+            await send({"type": "http.response.start", "status": respuesta.status_code,
+                        "headers": _cabeceras_asgi(respuesta.headers.items())})
+            await send({"type": "http.response.body", "body": respuesta.get_data()})
+            return
+
+        bucle = asyncio.get_running_loop()
+        status, cabeceras, cuerpo = await bucle.run_in_executor(self._pool, _llamar_flask, entorno)
+        await send({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                    "headers": _cabeceras_asgi(cabeceras)})
+        if isinstance(cuerpo, bytes):
+            await send({"type": "http.response.body", "body": cuerpo})
+        else:
+            await self._transmitir(cuerpo, receive, send)
+
+    async def _transmitir(self, iterable, receive, send):
+        # Un hilo recorre el iterable WSGI (puede bloquearse esperando eventos) y pasa los trozos por una
+        # cola acotada; si el cliente se desconecta el hilo cierra el iterable al recibir el siguiente trozo
+        bucle = asyncio.get_running_loop()
+        cola = asyncio.Queue(maxsize=ASGI_TROZOS_PENDIENTES)
+        cortado = threading.Event()
+
+        def producir():
+            try:
+                for trozo in iterable:
+                    if cortado.is_set():
+                        break
+                    if trozo:
+                        asyncio.run_coroutine_threadsafe(cola.put(trozo), bucle).result()
+            except Exception as e:
+                _safe_print(f"⚠️ Error en respuesta en streaming: {str(e)}")
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+                try:
+                    asyncio.run_coroutine_threadsafe(cola.put(None), bucle)
+                except RuntimeError:
+                    pass   # el bucle ya terminó
+
+        async def vigilar_desconexion():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            cortado.set()
+
+        threading.Thread(target=producir, name="asgi-stream", daemon=True).start()
+        vigia = asyncio.ensure_future(vigilar_desconexion())
+        try:
+            while True:
+                trozo = await cola.get()
+                if trozo is None:
+                    break
+                if cortado.is_set():
+                    continue   # se sigue vaciando la cola para que el hilo no quede bloqueado
+                try:
+                    await send({"type": "http.response.body", "body": trozo, "more_body": True})
+                except OSError:
+                    cortado.set()
+            if not cortado.is_set():
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            vigia.cancel()
+
+
+app = AppASGI()
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=3002)
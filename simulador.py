@@ -0,0 +1,201 @@
+"""
+Motor de simulación de buses con un solo hilo planificador.
+
+Cada bus simulado es un generador que produce los segundos que deben pasar
+hasta su siguiente paso. El motor guarda en un heap el instante del próximo
+paso de cada bus y los ejecuta en orden desde un único hilo, de modo que miles
+de buses simulados no necesitan miles de hilos.
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _BusSimulado:
+    __slots__ = ("id_bus", "info", "recorrido", "pausado", "turno", "pasos")
+
+    def __init__(self, id_bus, info):
+        self.id_bus = id_bus
+        self.info = info
+        self.recorrido = None   # generador, None mientras se prepara
+        self.pausado = False
+        self.turno = 0          # invalida entradas viejas del heap al pausar
+        self.pasos = 0
+
+    @property
+    def estado(self):
+        if self.recorrido is None:
+            return "PREPARANDO"
+        return "PAUSADA" if self.pausado else "ACTIVA"
+
+
+class MotorSimulacion:
+    def __init__(self, ticks_por_segundo=5, hilos_preparacion=4, log=print, al_paso=None):
+        """
+        ticks_por_segundo: frecuencia con la que cada bus en tránsito actualiza su posición
+        hilos_preparacion: hilos para preparar recorridos (descarga de geometría) sin frenar al planificador
+        log: función para mensajes del motor
+        al_paso: función(retraso_s) llamada tras cada paso con su atraso respecto de la agenda
+                 (en el hilo del planificador: debe ser barata)
+        """
+        self.ticks_por_segundo = ticks_por_segundo
+        self.paso_tiempo = 1.0 / ticks_por_segundo
+        self._log = log
+        self.al_paso = al_paso
+        self._buses = {}     # { id_bus: _BusSimulado }
+        self._agenda = []    # heap de (instante, contador, bus, turno)
+        self._contador = itertools.count()
+        self._cond = threading.Condition()
+        self._hilo = None
+        self._preparacion = ThreadPoolExecutor(max_workers=hilos_preparacion, thread_name_prefix="sim-prep")
+        self._pasos_totales = 0
+        self._retraso_ultimo = 0.0
+        self._retraso_max = 0.0
+
+    # ------------------------------------------------------
+    # Controles
+    # ------------------------------------------------------
+    def iniciar(self, id_bus, crear_recorrido, **info):
+        """
+        Inicia (o reinicia, si ya existía) la simulación de un bus.
+        crear_recorrido: función sin argumentos que retorna el generador del recorrido;
+                         se ejecuta en un hilo de preparación (puede consultar OSRM).
+        Retorna True si reemplazó una simulación existente con el mismo id.
+        """
+        bus = _BusSimulado(id_bus, info)
+        with self._cond:
+            anterior = self._buses.pop(id_bus, None)
+            if anterior is not None:
+                self._cerrar(anterior)
+            self._buses[id_bus] = bus
+            self._asegurar_hilo()
+        self._preparacion.submit(self._preparar, bus, crear_recorrido)
+        return anterior is not None
+
+    def detener(self, id_bus):
+        """Detiene y elimina la simulación. Retorna False si no existía."""
+        with self._cond:
+            bus = self._buses.pop(id_bus, None)
+            if bus is None:
+                return False
+            self._cerrar(bus)
+            return True
+
+    def pausar(self, id_bus):
+        with self._cond:
+            bus = self._buses.get(id_bus)
+            if bus is None:
+                return False
+            bus.pausado = True
+            bus.turno += 1
+            return True
+
+    def reanudar(self, id_bus):
+        with self._cond:
+            bus = self._buses.get(id_bus)
+            if bus is None:
+                return False
+            if bus.pausado:
+                bus.pausado = False
+                bus.turno += 1
+                if bus.recorrido is not None:
+                    self._agendar(bus, time.monotonic())
+            return True
+
+    def listar(self):
+        with self._cond:
+            return [
+                dict(bus.info, idBus=bus.id_bus, estado=bus.estado, pasos=bus.pasos)
+                for bus in self._buses.values()
+            ]
+
+    def existe(self, id_bus):
+        return id_bus in self._buses
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "buses": len(self._buses),
+                "ticks_por_segundo": self.ticks_por_segundo,
+                "pasos_totales": self._pasos_totales,
+                "agenda": len(self._agenda),
+                "retraso_ultimo_s": round(self._retraso_ultimo, 4),
+                "retraso_max_s": round(self._retraso_max, 4)
+            }
+
+    # ------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------
+    def _preparar(self, bus, crear_recorrido):
+        try:
+            recorrido = crear_recorrido()
+        except Exception as e:
+            self._log(f"⚠️ No se pudo preparar la simulación del bus {bus.id_bus}: {e}")
+            with self._cond:
+                if self._buses.get(bus.id_bus) is bus:
+                    del self._buses[bus.id_bus]
+            return
+
+        with self._cond:
+            if self._buses.get(bus.id_bus) is not bus:
+                # Detenida o reemplazada mientras se preparaba
+                recorrido.close()
+                return
+            bus.recorrido = recorrido
+            if not bus.pausado:
+                self._agendar(bus, time.monotonic())
+
+    def _agendar(self, bus, instante):
+        # Debe llamarse con self._cond tomado
+        heapq.heappush(self._agenda, (instante, next(self._contador), bus, bus.turno))
+        self._cond.notify()
+
+    def _cerrar(self, bus):
+        # Debe llamarse con self._cond tomado
+        bus.turno += 1
+        if bus.recorrido is not None:
+            bus.recorrido.close()
+
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._ejecutar, name="sim-planificador", daemon=True)
+            self._hilo.start()
+
+    def _ejecutar(self):
+        agenda = self._agenda
+        while True:
+            with self._cond:
+                ahora = time.monotonic()
+                while not agenda or agenda[0][0] > ahora:
+                    self._cond.wait(agenda[0][0] - ahora if agenda else None)
+                    ahora = time.monotonic()
+                instante, _, bus, turno = heapq.heappop(agenda)
+                if turno != bus.turno or self._buses.get(bus.id_bus) is not bus:
+                    continue
+
+                # El paso se ejecuta con el lock tomado: detener() no puede intercalarse
+                try:
+                    espera = next(bus.recorrido)
+                except StopIteration:
+                    del self._buses[bus.id_bus]
+                    continue
+                except Exception as e:
+                    self._log(f"⚠️ Simulación del bus {bus.id_bus} terminó con error: {e}")
+                    del self._buses[bus.id_bus]
+                    continue
+
+                bus.pasos += 1
+                self._pasos_totales += 1
+                self._retraso_ultimo = ahora - instante
+                if self._retraso_ultimo > self._retraso_max:
+                    self._retraso_max = self._retraso_ultimo
+                if self.al_paso is not None:
+                    self.al_paso(self._retraso_ultimo)
+
+                siguiente = instante + espera
+                if siguiente < ahora - 1.0:
+                    # Muy atrasado: no intentar recuperar pasos perdidos en ráfaga
+                    siguiente = ahora + espera
+                heapq.heappush(agenda, (siguiente, next(self._contador), bus, turno))
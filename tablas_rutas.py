@@ -0,0 +1,68 @@
+"""
+Tablas precalculadas por ruta: distancia y tiempo estático acumulados.
+
+Para una ruta con paradas p1..pn, ``acumulado_km[i]`` es la distancia sobre la
+ruta desde p1 hasta la parada en la posición i, y ``acumulado_min[i]`` el tiempo
+del método estático (velocidad fija más la espera en cada parada). Cualquier
+distancia o tiempo entre dos paradas es una resta de dos posiciones.
+"""
+from bisect import bisect_left, bisect_right
+
+
+class TablaRuta:
+    def __init__(self, paradas, distancia, velocidad_kmh=20.0, minutos_por_parada=2):
+        """
+        paradas: lista de paradas de la ruta, en orden
+        distancia: función (lat1, lon1, lat2, lon2) -> km
+        """
+        self.paradas = paradas
+        self.velocidad_kmh = velocidad_kmh
+        self.minutos_por_parada = minutos_por_parada
+        self.tramos_km = [
+            distancia(p1['lat'], p1['lon'], p2['lat'], p2['lon'])
+            for p1, p2 in zip(paradas, paradas[1:])
+        ]
+        self.acumulado_km = [0.0]
+        for tramo in self.tramos_km:
+            self.acumulado_km.append(self.acumulado_km[-1] + tramo)
+        self.acumulado_min = [
+            km / velocidad_kmh * 60.0 + i * minutos_por_parada
+            for i, km in enumerate(self.acumulado_km)
+        ]
+
+    @property
+    def longitud_km(self):
+        return self.acumulado_km[-1]
+
+    def distancia_km(self, orden_origen, orden_destino):
+        """Distancia sobre la ruta entre dos paradas (por su campo 'orden'), en cualquier sentido"""
+        return abs(self.acumulado_km[orden_destino - 1] - self.acumulado_km[orden_origen - 1])
+
+    def tiempo_min(self, orden_origen, orden_destino):
+        """Tiempo estático (viaje + espera en paradas) entre dos paradas, en cualquier sentido"""
+        return abs(self.acumulado_min[orden_destino - 1] - self.acumulado_min[orden_origen - 1])
+
+    def minutos_hasta(self, km_ruta, orden_destino, sentido=1, tolerancia_km=0.03):
+        """
+        Tiempo estático desde un punto de la ruta (km recorridos desde la primera parada)
+        hasta una parada: viaje a velocidad fija más la espera en las paradas intermedias.
+        sentido: 1 si el bus avanza hacia paradas de mayor orden, -1 si va de regreso
+        Retorna None si la parada ya quedó atrás (más de tolerancia_km) en ese sentido.
+        """
+        acumulado = self.acumulado_km
+        km_parada = acumulado[orden_destino - 1]
+        restante = (km_parada - km_ruta) if sentido >= 0 else (km_ruta - km_parada)
+        if restante < -tolerancia_km:
+            return None
+        desde, hasta = sorted((km_ruta, km_parada))
+        intermedias = max(0, bisect_left(acumulado, hasta) - bisect_right(acumulado, desde))
+        return max(restante, 0.0) / self.velocidad_kmh * 60.0 + intermedias * self.minutos_por_parada
+
+
+def construir_tablas(rutas, distancia, velocidad_kmh=20.0, minutos_por_parada=2):
+    """Retorna { (empresa, numeroRuta): TablaRuta } para todas las rutas"""
+    return {
+        (empresa, num): TablaRuta(paradas, distancia, velocidad_kmh, minutos_por_parada)
+        for empresa, rutas_dict in rutas.items()
+        for num, paradas in rutas_dict.items()
+    }
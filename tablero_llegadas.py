@@ -0,0 +1,207 @@
+"""
+Tablero materializado de próximas llegadas por parada.
+
+En lugar de recorrer los buses de la ruta en cada consulta de ETA, el tablero
+guarda por cada (empresa, ruta, orden de parada) los buses que vienen en
+camino, ordenados por minutos de llegada. Cada escritura de un bus marca su
+ruta como pendiente (marcar) y la ruta se recalcula completa la próxima vez
+que alguien la consulta, pero nunca más de una vez cada ``intervalo``
+segundos (configurable por ruta). Así mil usuarios mirando la misma parada
+en hora pico comparten un solo cálculo por intervalo.
+
+Una ruta sin escrituras se recalcula igual cada ``edad_maxima`` segundos para
+que los buses expirados desaparezcan del tablero.
+
+Las paradas físicas se identifican por un id legible derivado del nombre
+(p. ej. "parque-caldas-centro"); varias rutas que comparten una parada con el
+mismo nombre y coordenadas comparten el id.
+"""
+import re
+import threading
+import time
+import unicodedata
+
+EN_CAMINO = "EN_CAMINO"
+YA_PASO = "YA_PASO"
+NO_HAY_BUSES = "NO_HAY_BUSES"
+
+
+def id_parada(nombre):
+    """Id legible de una parada: nombre sin tildes, en minúsculas y con guiones"""
+    sin_tildes = unicodedata.normalize("NFKD", nombre).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", sin_tildes.lower()).strip("-") or "parada"
+
+
+class _EstadoRuta:
+    """Llegadas materializadas de una ruta"""
+    __slots__ = ("tabla", "intervalo", "sucia", "calculado", "calculando", "por_orden", "buses")
+
+    def __init__(self, tabla, intervalo):
+        self.tabla = tabla
+        self.intervalo = intervalo
+        self.sucia = True
+        self.calculado = float("-inf")
+        self.calculando = False   # un hilo está recalculando la ruta (fuera del lock)
+        self.por_orden = {}   # { orden: [(eta_min, id_bus)] ordenada }
+        self.buses = 0        # buses vigentes en la ruta en el último cálculo
+
+
+class TableroLlegadas:
+    def __init__(self, tablas, buses_en_ruta, calcular_eta, intervalo=1.0, intervalo_por_ruta=None,
+                 edad_maxima=30.0, max_llegadas=5):
+        """
+        tablas: { (empresa, numeroRuta): TablaRuta }
+        buses_en_ruta: función (empresa, numeroRuta) -> [(id_bus, dict)] de los buses vigentes
+        calcular_eta: función (tabla, bus, parada) -> minutos, o None si el bus ya pasó por la parada
+        intervalo: segundos mínimos entre dos recálculos de una misma ruta
+        intervalo_por_ruta: { (empresa, numeroRuta): segundos } para rutas con otro intervalo
+        edad_maxima: segundos tras los que una ruta se recalcula aunque no tenga escrituras
+        max_llegadas: llegadas guardadas por parada y ruta
+        """
+        self._buses_en_ruta = buses_en_ruta
+        self._calcular_eta = calcular_eta
+        self.edad_maxima = edad_maxima
+        self.max_llegadas = max_llegadas
+        intervalo_por_ruta = intervalo_por_ruta or {}
+        self._rutas = {
+            clave: _EstadoRuta(tabla, intervalo_por_ruta.get(clave, intervalo))
+            for clave, tabla in tablas.items()
+        }
+
+        # { id_parada: {"id", "nombre", "lat", "lon", "rutas": [(empresa, numeroRuta, orden)]} }
+        self.paradas = {}
+        for (empresa, num), tabla in tablas.items():
+            for parada in tabla.paradas:
+                pid = base = id_parada(parada['nombre'])
+                sufijo = 2
+                while pid in self.paradas and (self.paradas[pid]["lat"], self.paradas[pid]["lon"]) != \
+                        (parada['lat'], parada['lon']):
+                    pid = "%s-%d" % (base, sufijo)
+                    sufijo += 1
+                fisica = self.paradas.get(pid)
+                if fisica is None:
+                    fisica = self.paradas[pid] = {
+                        "id": pid, "nombre": parada['nombre'], "lat": parada['lat'], "lon": parada['lon'],
+                        "rutas": []
+                    }
+                fisica["rutas"].append((empresa, num, parada['orden']))
+
+        self._lock = threading.Lock()
+        self._consultas = 0
+        self._recalculos = 0
+        self._marcas = 0
+
+    # ------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------
+    def marcar(self, empresa, ruta):
+        """Indica que cambió la posición de algún bus de la ruta (sin lock: solo levanta una bandera)"""
+        estado = self._rutas.get((empresa, ruta))
+        if estado is not None:
+            estado.sucia = True
+            self._marcas += 1
+
+    def _vigente(self, clave, ahora):
+        """
+        Recalcula la ruta si corresponde y retorna (por_orden, buses, calculado) de una misma versión.
+        El recálculo corre fuera del lock (solo el reemplazo lo toma), así una ruta con muchos buses
+        no detiene las consultas de las demás; mientras tanto las consultas de esa ruta ven el
+        cálculo anterior. Solo un hilo recalcula cada ruta, salvo la primera vez (no hay anterior).
+        """
+        estado = self._rutas[clave]
+        with self._lock:
+            edad = ahora - estado.calculado
+            if not ((estado.sucia or edad >= self.edad_maxima) and edad >= estado.intervalo) or \
+                    (estado.calculando and estado.calculado != float("-inf")):
+                return estado.por_orden, estado.buses, estado.calculado
+            # Se baja la bandera antes de leer los buses: una escritura concurrente la vuelve a subir
+            estado.sucia = False
+            estado.calculando = True
+        try:
+            buses = self._buses_en_ruta(*clave)
+            por_orden = {}
+            for parada in estado.tabla.paradas:
+                llegadas = []
+                for id_bus, bus in buses:
+                    eta = self._calcular_eta(estado.tabla, bus, parada)
+                    if eta is not None:
+                        llegadas.append((eta, id_bus))
+                llegadas.sort()
+                por_orden[parada['orden']] = llegadas[:self.max_llegadas]
+        except BaseException:
+            with self._lock:
+                estado.sucia = True
+                estado.calculando = False
+            raise
+        with self._lock:
+            estado.por_orden = por_orden
+            estado.buses = len(buses)
+            estado.calculado = ahora
+            estado.calculando = False
+            self._recalculos += 1
+        return por_orden, len(buses), ahora
+
+    # ------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------
+    def llegadas_ruta(self, empresa, ruta, orden, ahora=None):
+        """
+        Próximas llegadas de una ruta a una de sus paradas.
+        Retorna (estado, [(eta_min, id_bus)]) donde estado es EN_CAMINO, YA_PASO (hay buses
+        en la ruta pero ninguno viene hacia la parada) o NO_HAY_BUSES; None si la ruta no existe.
+        """
+        clave = (empresa, ruta)
+        if clave not in self._rutas:
+            return None
+        with self._lock:
+            self._consultas += 1
+        por_orden, buses, _ = self._vigente(clave, time.time() if ahora is None else ahora)
+        llegadas = por_orden.get(orden, [])
+        if llegadas:
+            return EN_CAMINO, list(llegadas)
+        return (YA_PASO if buses else NO_HAY_BUSES), []
+
+    def llegadas_parada(self, pid, ahora=None):
+        """
+        Tablero de una parada física: todas las rutas que la atienden, con sus próximas
+        llegadas mezcladas por minutos. Retorna None si la parada no existe.
+        """
+        fisica = self.paradas.get(pid)
+        if fisica is None:
+            return None
+        ahora = time.time() if ahora is None else ahora
+        llegadas = []
+        rutas = []
+        with self._lock:
+            self._consultas += 1
+        for empresa, num, orden in fisica["rutas"]:
+            por_orden, buses, calculado = self._vigente((empresa, num), ahora)
+            proximas = por_orden.get(orden, [])
+            rutas.append({
+                "empresa": empresa,
+                "numeroRuta": num,
+                "orden": orden,
+                "estado": EN_CAMINO if proximas else (YA_PASO if buses else NO_HAY_BUSES),
+                "actualizado_hace_s": round(ahora - calculado, 3)
+            })
+            llegadas.extend(
+                {"idBus": id_bus, "empresa": empresa, "numeroRuta": num, "etaMinutos": eta}
+                for eta, id_bus in proximas
+            )
+        llegadas.sort(key=lambda llegada: llegada["etaMinutos"])
+        return {
+            "parada": {clave: fisica[clave] for clave in ("id", "nombre", "lat", "lon")},
+            "rutas": rutas,
+            "llegadas": llegadas
+        }
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "paradas": len(self.paradas),
+                "rutas": len(self._rutas),
+                "rutas_pendientes": sum(1 for estado in self._rutas.values() if estado.sucia),
+                "consultas": self._consultas,
+                "recalculos": self._recalculos,
+                "marcas": self._marcas
+            }